@@ -0,0 +1,225 @@
+### Content-Addressed Cache for Extracted Text and Summaries ###
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+CACHE_DIR = os.environ.get("REFERRAL_CACHE_DIR", os.path.join(Path.home(), ".cache", "referral_agent"))
+CACHE_MAX_BYTES = int(os.environ.get("REFERRAL_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+CACHE_MEMORY_ITEMS = int(os.environ.get("REFERRAL_CACHE_MEMORY_ITEMS", 256))
+
+_referral_cache = None
+
+
+def hash_bytes(data):
+    """Returns the SHA-256 hex digest of raw bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(*parts):
+    """Returns the SHA-256 hex digest of one or more strings."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """
+    A thread-safe in-memory least-recently-used cache with hit/miss counters.
+    Entries older than ``ttl`` seconds, when given, are treated as missing.
+    """
+
+    def __init__(self, max_items=CACHE_MEMORY_ITEMS, ttl=None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._items[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "items": len(self._items)}
+
+
+class DiskCache:
+    """
+    A JSON-on-disk cache with size-based eviction.
+
+    Entries are stored one file per key under ``directory``. When the total
+    size exceeds ``max_bytes`` the least recently used files are removed.
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._sizes = {path: path.stat().st_size for path in self.directory.glob("*/*.json")}
+        self._total = sum(self._sizes.values())
+
+    def _path(self, key):
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return default
+        os.utime(path)  # Mark as recently used for eviction
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            size = path.stat().st_size
+            self._total += size - self._sizes.get(path, 0)
+            self._sizes[path] = size
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def delete(self, key):
+        path = self._path(key)
+        with self._lock:
+            self._remove(path)
+
+    def _remove(self, path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        self._total -= self._sizes.pop(path, 0)
+
+    def _evict(self):
+        def last_used(path):
+            try:
+                return path.stat().st_mtime
+            except FileNotFoundError:
+                return 0
+
+        for path in sorted(self._sizes, key=last_used):
+            if self._total <= self.max_bytes:
+                break
+            self._remove(path)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "items": len(self._sizes), "bytes": self._total}
+
+
+class TieredCache:
+    """An in-memory LRU in front of an on-disk store."""
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES, max_items=CACHE_MEMORY_ITEMS):
+        self.memory = LRUCache(max_items)
+        self.disk = DiskCache(directory, max_bytes)
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        value = self.disk.get(key)
+        if value is None:
+            return default
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def stats(self):
+        return {"memory": self.memory.stats(), "disk": self.disk.stats()}
+
+
+class ReferralCache:
+    """
+    Two-level cache for the referral pipeline.
+
+    Level one maps the SHA-256 of the PDF bytes to the raw extracted text.
+    Level two maps the SHA-256 of that text, plus the prompt and model
+    version, to the structured summary.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_items=CACHE_MEMORY_ITEMS):
+        self.texts = TieredCache(os.path.join(directory, "text"), max_bytes // 2, max_items)
+        self.summaries = TieredCache(os.path.join(directory, "summary"), max_bytes // 2, max_items)
+
+    @staticmethod
+    def summary_key(text, version):
+        return hash_text(text, version)
+
+    def get_text(self, pdf_hash):
+        return self.texts.get(pdf_hash)
+
+    def set_text(self, pdf_hash, text):
+        self.texts.set(pdf_hash, text)
+
+    def get_summary(self, text, version):
+        return self.summaries.get(self.summary_key(text, version))
+
+    def set_summary(self, text, version, summary):
+        self.summaries.set(self.summary_key(text, version), summary)
+
+    def stats(self):
+        return {"text": self.texts.stats(), "summary": self.summaries.stats()}
+
+
+def get_referral_cache():
+    """Returns the process-wide referral cache."""
+    global _referral_cache
+    if _referral_cache is None:
+        _referral_cache = ReferralCache()
+    return _referral_cache
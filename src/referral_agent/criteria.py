@@ -0,0 +1,315 @@
+### Deterministic FIT / Ferritin / Hb Referral Criteria ###
+import re
+from dataclasses import dataclass, asdict
+from datetime import datetime
+
+import numpy as np
+
+FIT_POSITIVE_THRESHOLD = 10.0  # ugHb/g, positive if >= threshold
+FERRITIN_THRESHOLD = 45.0  # µg/L, low if <= threshold
+HB_THRESHOLD_MALE = 130.0  # g/L, anaemic if < threshold
+HB_THRESHOLD_FEMALE = 115.0  # g/L, non-menstruating women
+AGE_THRESHOLD = 40
+
+# Values between the label and the number may be padded with the form's dotted leaders.
+_GAP = r"[\s:.…]*"
+_NUMBER = r"(\d+(?:\.\d+)?)"
+# Labs report results under their detection limit as "<4"
+_FIT_RE = re.compile(rf"\bFIT(?:\s+result)?{_GAP}(<=|≤|<)?\s*{_NUMBER}", re.IGNORECASE)  # ugHb/g, the only unit in use
+_FERRITIN_RE = re.compile(rf"\bFerritin{_GAP}{_NUMBER}", re.IGNORECASE)  # µg/L and ng/mL are equal
+_HB_RE = re.compile(rf"\b(?:Hb|Ha?emoglobin){_GAP}{_NUMBER}", re.IGNORECASE)
+_AGE_RE = re.compile(r"\bAge\s*[:\-]?\s*(\d{1,3})\b", re.IGNORECASE)
+_GENDER_RE = re.compile(r"\b(?:Gender|Sex)\s*[:\-]?\s*(Male|Female|M|F)\b", re.IGNORECASE)
+_DOB_RE = re.compile(r"\bDoB\s*[:\-]?\s*(\d{1,2}/\d{1,2}/\d{4})", re.IGNORECASE)
+_SYMPTOM_RE = re.compile(
+    r"(Rectal bleeding|Change in bowel habit|Weight loss|Iron Deficiency Anaemia|Abdominal mass|"
+    r"Rectal mass|Anal ulceration/mass|Abdominal pain)\s*:\s*(Yes|No)",
+    re.IGNORECASE,
+)
+# Pathway symptoms as they are written in free text, keyed by the names ``extract_symptoms`` returns
+_SYMPTOM_MENTION_RES = {
+    "rectal bleeding": re.compile(r"\b(?:rectal|PR) bleed|\bbleeding (?:per|from the) rectum|\bblood (?:in|on) (?:the )?(?:stool|faeces)", re.IGNORECASE),
+    "change in bowel habit": re.compile(r"\bbowel habit|\bdiarrho?ea|\bconstipat|\blooser stools", re.IGNORECASE),
+    "weight loss": re.compile(r"\bweight loss|\b(?:losing|lost) weight", re.IGNORECASE),
+    "iron deficiency anaemia": re.compile(r"\ban(?:a)?emi|\biron deficien|\bIDA\b", re.IGNORECASE),
+    "abdominal mass": re.compile(r"\babdo(?:minal)? mass|\bmass in the abdomen", re.IGNORECASE),
+    "rectal mass": re.compile(r"\brectal mass", re.IGNORECASE),
+    "anal ulceration/mass": re.compile(r"\banal (?:ulcer|mass)", re.IGNORECASE),
+    "abdominal pain": re.compile(r"\babdo(?:minal)? pain|\btummy pain", re.IGNORECASE),
+}
+_SYMPTOMS_FIELD_RE = re.compile(r"^[ \t]*-?[ \t]*Symptoms[ \t]*:[ \t]*(.+)$", re.IGNORECASE | re.MULTILINE)
+_WEIGHT_LOSS_PERCENT_RE = re.compile(
+    r"\bweight[^.;\n%]{0,40}?(\d+(?:\.\d+)?)\s*%|(\d+(?:\.\d+)?)\s*%[^.;\n]{0,30}?\bweight", re.IGNORECASE
+)
+_WHO_RE = re.compile(r"WHO Performance status\s*:\s*(?:Grade\s*)?([0-4])", re.IGNORECASE)
+_REFERRAL_DATE_RE = re.compile(r"\bDate of (?:Referral|Decision to refer)\s*[:\-]?\s*(\d{1,2}/\d{1,2}/\d{4})", re.IGNORECASE)
+
+
+@dataclass
+class PatientFeatures:
+    """Numeric inputs to the referral criteria, normalized to the guideline units."""
+    age: int = None
+    gender: str = None  # "M" or "F"
+    fit: float = None  # ugHb/g
+    fit_below: str = None  # "<" or "≤" when the lab reported an upper bound rather than a value
+    ferritin: float = None  # µg/L
+    hb: float = None  # g/L
+
+
+@dataclass
+class CriteriaResult:
+    """Pathway flags. ``None`` means the inputs needed to decide were not provided."""
+    fit_positive: bool = None
+    fit_negative: bool = None
+    aged_40_or_over: bool = None
+    ferritin_low: bool = None
+    anaemia: bool = None
+    meets_fit_positive_criteria: bool = None
+    meets_fit_negative_ida_criteria: bool = None
+
+
+def _first(pattern, text):
+    match = pattern.search(text)
+    return match.groups() if match else None
+
+
+def normalize_hb(value):
+    """
+    Converts haemoglobin to g/L.
+
+    Forms mix up the two units (the WMCA form prints "Hb <13g/L" and "Hb ....g/dl"
+    next to g/L values), so the magnitude decides: a plausible Hb below 25 is g/dL.
+    """
+    if value < 25:
+        return value * 10
+    return value
+
+
+def _age_from_dates(text):
+    # Age on the referral date only: anything relative to today would drift in cached criteria
+    dob, referral = _first(_DOB_RE, text), _first(_REFERRAL_DATE_RE, text)
+    if not dob or not referral:
+        return None
+    try:
+        born = datetime.strptime(dob[0], "%d/%m/%Y")
+        on = datetime.strptime(referral[0], "%d/%m/%Y")
+    except ValueError:
+        return None
+    return on.year - born.year - ((on.month, on.day) < (born.month, born.day))
+
+
+def extract_features(text):
+    """
+    Parses age, gender, FIT, ferritin and Hb from form text or an LLM field extraction.
+
+    Returns:
+        PatientFeatures: Values in ugHb/g, µg/L and g/L; missing values are None.
+    """
+    features = PatientFeatures()
+
+    age = _first(_AGE_RE, text)
+    features.age = int(age[0]) if age else _age_from_dates(text)
+
+    gender = _first(_GENDER_RE, text)
+    if gender:
+        features.gender = gender[0][0].upper()
+
+    fit = _first(_FIT_RE, text)
+    if fit:
+        below, value = fit
+        features.fit = float(value)
+        features.fit_below = {"<": "<", "<=": "≤", "≤": "≤"}.get(below)
+
+    ferritin = _first(_FERRITIN_RE, text)
+    if ferritin:
+        features.ferritin = float(ferritin[0])
+
+    hb = _first(_HB_RE, text)
+    if hb:
+        features.hb = normalize_hb(float(hb[0]))
+
+    return features
+
+
+def extract_symptoms(text):
+    """Returns the symptoms marked 'Yes' in an LLM field extraction, lowercased, in order."""
+    symptoms = [name.lower() for name, flag in _SYMPTOM_RE.findall(text) if flag.lower() == "yes"]
+    return list(dict.fromkeys(symptoms))
+
+
+def extract_mentioned_symptoms(text):
+    """
+    Returns the pathway symptoms named in the free-text Symptoms field of an LLM
+    field extraction, whether or not their boxes were ticked. Negations are not
+    parsed: "no weight loss" mentions weight loss.
+    """
+    mentioned = set()
+    for field in _SYMPTOMS_FIELD_RE.findall(text):
+        mentioned.update(name for name, pattern in _SYMPTOM_MENTION_RES.items() if pattern.search(field))
+    return mentioned
+
+
+def extract_weight_loss_percent(text):
+    """Returns the weight lost as a percentage of body weight (e.g. "weight loss of 12%"), or None."""
+    match = _WEIGHT_LOSS_PERCENT_RE.search(text)
+    if not match:
+        return None
+    return float(match.group(1) or match.group(2))
+
+
+def extract_who_status(text):
+    """Returns the WHO performance status (0-4) from an LLM field extraction, or None."""
+    who = _first(_WHO_RE, text)
+    return int(who[0]) if who else None
+
+
+def merge_features(primary, fallback):
+    """Fills the missing values of ``primary`` from ``fallback``."""
+    merged = asdict(primary)
+    fallback = asdict(fallback)
+    for name, value in fallback.items():
+        if merged[name] is None and name != "fit_below":
+            merged[name] = value
+    # A FIT bound belongs to the value it came with
+    if primary.fit is None:
+        merged["fit_below"] = fallback["fit_below"]
+    return PatientFeatures(**merged)
+
+
+def _all(*flags):
+    """Three-valued AND: False if any flag is False, None if any is unknown."""
+    if any(flag is False for flag in flags):
+        return False
+    if any(flag is None for flag in flags):
+        return None
+    return True
+
+
+def _anaemia(hb, gender):
+    if hb is None:
+        return None
+    if gender == "M":
+        return hb < HB_THRESHOLD_MALE
+    if gender == "F":
+        return hb < HB_THRESHOLD_FEMALE
+    # Gender unknown: decidable only when both thresholds agree
+    if hb < HB_THRESHOLD_FEMALE:
+        return True
+    if hb >= HB_THRESHOLD_MALE:
+        return False
+    return None
+
+
+def _fit_positive(fit, below):
+    """FIT ≥ threshold; a reported bound ("<4", "≤9") is negative only if the whole range is below it."""
+    if fit is None:
+        return None
+    if below == "<":
+        return False if fit <= FIT_POSITIVE_THRESHOLD else None
+    if below == "≤":
+        return False if fit < FIT_POSITIVE_THRESHOLD else None
+    return fit >= FIT_POSITIVE_THRESHOLD
+
+
+def evaluate_criteria(features):
+    """
+    Applies the FIT-positive and FIT-negative IDA pathway thresholds to one patient.
+    The FIT-positive pathway depends on the FIT result alone; the age limit applies
+    to the FIT-negative IDA criteria.
+    """
+    result = CriteriaResult()
+    result.fit_positive = _fit_positive(features.fit, features.fit_below)
+    if result.fit_positive is not None:
+        result.fit_negative = not result.fit_positive
+    if features.age is not None:
+        result.aged_40_or_over = features.age >= AGE_THRESHOLD
+    if features.ferritin is not None:
+        result.ferritin_low = features.ferritin <= FERRITIN_THRESHOLD
+    result.anaemia = _anaemia(features.hb, features.gender)
+
+    result.meets_fit_positive_criteria = result.fit_positive
+    result.meets_fit_negative_ida_criteria = _all(
+        result.aged_40_or_over, result.fit_negative, result.ferritin_low, result.anaemia
+    )
+    return result
+
+
+def evaluate_criteria_batch(features_list):
+    """
+    Vectorized ``evaluate_criteria`` over many patients.
+
+    Returns:
+        dict[str, numpy.ndarray]: One object array per ``CriteriaResult`` field,
+        holding True, False or None for each patient.
+    """
+    def column(name):
+        return np.array([np.nan if getattr(f, name) is None else getattr(f, name) for f in features_list], dtype=float)
+
+    age, fit, ferritin, hb = column("age"), column("fit"), column("ferritin"), column("hb")
+    gender = np.array([f.gender or "" for f in features_list])
+    below = np.array([f.fit_below or "" for f in features_list])
+
+    def flag(values, known):
+        out = np.full(len(features_list), None, dtype=object)
+        out[known] = values[known].tolist()
+        return out
+
+    # A reported bound decides only when the whole range is below the threshold
+    bound_negative = ((below == "<") & (fit <= FIT_POSITIVE_THRESHOLD)) | ((below == "≤") & (fit < FIT_POSITIVE_THRESHOLD))
+    fit_known = ~np.isnan(fit) & ((below == "") | bound_negative)
+    fit_positive = flag((fit >= FIT_POSITIVE_THRESHOLD) & (below == ""), fit_known)
+    fit_negative = flag(~((fit >= FIT_POSITIVE_THRESHOLD) & (below == "")), fit_known)
+    aged = flag(age >= AGE_THRESHOLD, ~np.isnan(age))
+    ferritin_low = flag(ferritin <= FERRITIN_THRESHOLD, ~np.isnan(ferritin))
+
+    hb_threshold = np.where(gender == "M", HB_THRESHOLD_MALE, np.where(gender == "F", HB_THRESHOLD_FEMALE, np.nan))
+    has_hb = ~np.isnan(hb)
+    gender_known = ~np.isnan(hb_threshold)
+    anaemia = flag(hb < hb_threshold, has_hb & gender_known)
+    # Gender unknown: decidable only when both thresholds agree
+    unknown_gender = has_hb & ~gender_known
+    anaemia[unknown_gender & (hb < HB_THRESHOLD_FEMALE)] = True
+    anaemia[unknown_gender & (hb >= HB_THRESHOLD_MALE)] = False
+
+    def all_of(*flags):
+        stacked = np.stack(flags)
+        out = np.full(len(features_list), None, dtype=object)
+        out[(stacked == True).all(axis=0)] = True  # noqa: E712 - elementwise on object arrays
+        out[(stacked == False).any(axis=0)] = False  # noqa: E712
+        return out
+
+    return {
+        "fit_positive": fit_positive,
+        "fit_negative": fit_negative,
+        "aged_40_or_over": aged,
+        "ferritin_low": ferritin_low,
+        "anaemia": anaemia,
+        "meets_fit_positive_criteria": fit_positive.copy(),
+        "meets_fit_negative_ida_criteria": all_of(aged, fit_negative, ferritin_low, anaemia),
+    }
+
+
+def _yes_no(flag):
+    return {True: "Yes", False: "No"}.get(flag, "Unknown (not provided)")
+
+
+def _value(value, unit, below=None):
+    return "Not provided" if value is None else f"{below or ''}{value:g} {unit}"
+
+
+def format_criteria(features, result):
+    """Renders computed flags in the same bullet layout as the summary."""
+    fit_status = ""
+    if result.fit_positive is not None:
+        fit_status = ", FIT Positive" if result.fit_positive else ", FIT Negative"
+    return "\n".join([
+        "- Computed referral criteria:",
+        f"    - FIT result: {_value(features.fit, 'ugHb/g', features.fit_below)}{fit_status}",
+        f"    - Meets FIT positive pathway criteria (FIT ≥10): {_yes_no(result.meets_fit_positive_criteria)}",
+        "    - FIT negative pathway results:",
+        f"        - Meets criteria for referral: {_yes_no(result.meets_fit_negative_ida_criteria)}",
+        f"        - Aged 40 years or over: {_yes_no(result.aged_40_or_over)}",
+        f"        - FIT Negative: {_yes_no(result.fit_negative)}, FIT result: {_value(features.fit, 'ugHb/g', features.fit_below)}",
+        f"        - Ferritin ≤45 µg/L: {_yes_no(result.ferritin_low)}, Ferritin: {_value(features.ferritin, 'µg/L')}",
+        f"        - Anaemia: {_yes_no(result.anaemia)}, Hb: {_value(features.hb, 'g/L')}",
+    ])
@@ -0,0 +1,378 @@
+### Precompiled Guideline Decision Table ###
+import hashlib
+import json
+import os
+import re
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from pathlib import Path
+
+from criteria import (
+    FERRITIN_THRESHOLD,
+    PatientFeatures,
+    evaluate_criteria,
+    extract_features,
+    extract_mentioned_symptoms,
+    extract_symptoms,
+    extract_weight_loss_percent,
+    extract_who_status,
+)
+
+RULES_DIR = str(Path(__file__).resolve().parents[2] / "rules")
+DECISION_TABLE_PATH = os.environ.get("REFERRAL_DECISION_TABLE_PATH", os.path.join(RULES_DIR, "decision_table.json"))
+DECISION_TABLE_ENABLED = os.environ.get("REFERRAL_DECISION_TABLE", "1") == "1"
+# Bump when the rule schema or ``lookup`` semantics change
+DECISION_TABLE_SCHEMA = "2"
+
+IDA = "iron deficiency anaemia"
+ANY_SYMPTOM = "*"
+
+
+@dataclass
+class Rule:
+    """
+    One pathway branch: the conditions a patient must meet, the action, and where it is written.
+
+    ``symptoms`` match if any of them is present (empty means any or no symptoms);
+    ``isolated`` requires that symptom to be the only one. An age bound or lab
+    criterion the patient's data cannot answer makes the rule undecidable for them.
+    """
+    id: str
+    document: str
+    quote: str  # Verbatim text from the pathway PDF, checked at compile time
+    action: str
+    outcome: str = ""
+    fit: str = "any"  # "positive", "negative" or "any"
+    symptoms: list = field(default_factory=list)
+    with_any: list = field(default_factory=list)  # At least one additional symptom required
+    isolated: bool = False
+    min_age: int = None  # Inclusive
+    max_age: int = None  # Exclusive
+    min_who: int = None
+    ferritin_max: float = None
+    ferritin_strict: bool = False  # "<" rather than "<="
+    anaemia: bool = False
+    min_weight_loss_percent: float = None
+    page: int = None  # Filled in by ``compile_table``
+
+
+# "Over N" in the pathways is read as older than N; "≥N" as N or older.
+RULE_SPECS = [
+    # BSOL FIT Pathway, general rules
+    Rule("bsol-mass", "BSOL_Pathway.pdf",
+         "Criteria for LGI 2WW Referral: a. Unexplained abdominal mass. b. Unexplained rectal mass. c. Anal ulceration/mass.",
+         "LGI 2WW referral.",
+         symptoms=["abdominal mass", "rectal mass", "anal ulceration/mass"]),
+    Rule("bsol-fit-positive", "BSOL_Pathway.pdf",
+         "FIT Positive Results (≥10 µgHb/g): a. Requires urgent LGI 2WW Referral for further investigation.",
+         "Urgent LGI 2WW referral; add the FIT code and 2WW urgent referral codes within the required timelines.",
+         fit="positive"),
+    Rule("bsol-ida", "BSOL_Pathway.pdf",
+         "Ferritin ≤45 µg/L. ii. Hb <130 g/L (men) or Hb <115 g/L (non-menstruating women). b. Action: LGI 2WW Referral for specialist evaluation.",
+         "LGI 2WW referral for specialist evaluation.",
+         "Identification of underlying pathology such as occult bleeding or cancer.",
+         symptoms=[IDA], ferritin_max=FERRITIN_THRESHOLD, anaemia=True),
+    # BSOL FIT Negative Pathway
+    Rule("bsol-neg-cibh-under-50", "BSOL_Pathway.pdf",
+         "Patients <50 Years Old with Isolated Persistent Change in Bowel Habit",
+         "Trial IBS treatment in primary care and perform a faecal calprotectin test: >250 urgent "
+         "gastroenterology referral; <250 routine referral to IBS clinic or continued primary care management.",
+         "Management of IBS or referral to the IBD pathway based on results.",
+         fit="negative", symptoms=["change in bowel habit"], isolated=True, max_age=50),
+    Rule("bsol-neg-cibh-50", "BSOL_Pathway.pdf",
+         "Patients ≥50 Years Old with Isolated Persistent Change in Bowel Habit",
+         "GP direct access to urgent colonoscopy.",
+         "Early identification of potential GI pathologies.",
+         fit="negative", symptoms=["change in bowel habit"], isolated=True, min_age=50),
+    Rule("bsol-neg-rectal-bleeding", "BSOL_Pathway.pdf",
+         "Patients ≥40 Years Old with Persistent Rectal Bleeding",
+         "GP direct access to urgent flexible sigmoidoscopy.",
+         "Investigation of underlying causes such as hemorrhoids, polyps, or cancer.",
+         fit="negative", symptoms=["rectal bleeding"], min_age=40),
+    Rule("bsol-neg-weight-loss-plus", "BSOL_Pathway.pdf",
+         "Patients ≥40 Years Old with Weight Loss and at Least One Additional Symptom",
+         "GP direct access to CT TAP (Thorax, Abdomen, and Pelvis).",
+         "Investigation of weight loss and associated symptoms.",
+         fit="negative", symptoms=["weight loss"], with_any=["abdominal pain", "change in bowel habit"], min_age=40),
+    Rule("bsol-neg-weight-loss-isolated", "BSOL_Pathway.pdf",
+         "Patients ≥40 Years Old with Vague Symptoms Including Isolated Weight Loss",
+         "2WW NSS (Non-Specific Symptoms) referral.",
+         "Timely evaluation of nonspecific or systemic symptoms.",
+         fit="negative", symptoms=["weight loss"], isolated=True, min_age=40),
+    # UHB FIT Positive Pathway
+    Rule("uhb-pos-rectal-bleeding", "UHB_Pathway.pdf",
+         "Bright Red Rectal Bleeding (≥2 Episodes Within 4 Weeks)",
+         "2WW colonoscopy.",
+         "Endoscopist to decide whether the patient is further investigated or discharged back to GP.",
+         fit="positive", symptoms=["rectal bleeding"]),
+    Rule("uhb-pos-cibh", "UHB_Pathway.pdf",
+         "Change in Bowel Habit (± Abdominal Pain)",
+         "2WW colonoscopy.",
+         "Endoscopist to decide whether the patient is further investigated or discharged back to GP.",
+         fit="positive", symptoms=["change in bowel habit"]),
+    Rule("uhb-pos-mass", "UHB_Pathway.pdf",
+         "Over 16 Years Old With Rectal or Anal Ulceration/Mass or Abdominal Mass",
+         "Rapid Access Colorectal Clinic.",
+         "Expedited referral to colorectal specialists for comprehensive evaluation.",
+         fit="positive", symptoms=["abdominal mass", "rectal mass", "anal ulceration/mass"], min_age=17),
+    Rule("uhb-pos-ida", "UHB_Pathway.pdf",
+         "Over 40 Years Old With Unexplained Iron Deficiency Anaemia (Ferritin <15)",
+         "Gastroscopy and colonoscopy.",
+         "Endoscopist to decide whether the patient is further investigated or discharged back to GP.",
+         fit="positive", symptoms=[IDA], min_age=41, ferritin_max=15, ferritin_strict=True, anaemia=True),
+    Rule("uhb-pos-over-80", "UHB_Pathway.pdf",
+         "Over 80 Years Old (Any Symptoms)",
+         "Rapid Access Colorectal Clinic.",
+         "Comprehensive evaluation for age-specific risks and comorbidities.",
+         fit="positive", min_age=81),
+    Rule("uhb-pos-weight-loss", "UHB_Pathway.pdf",
+         "Unexplained Weight Loss (10% or More ± Abdominal Pain)",
+         "Rapid Access Gastro Clinic.",
+         "Evaluation for potential malignancies or other serious GI conditions.",
+         fit="positive", symptoms=["weight loss"], min_weight_loss_percent=10),
+    Rule("uhb-pos-mobility", "UHB_Pathway.pdf",
+         "Patients With Mobility Problems (WHO Performance Score 3 or 4)",
+         "Rapid Access Colorectal Clinic.",
+         "Tailored diagnostic and treatment plans to accommodate mobility limitations.",
+         fit="positive", min_who=3),
+    # UHB FIT Negative Pathway
+    Rule("uhb-neg-cibh", "UHB_Pathway.pdf",
+         "≥50 Years Old with Persistent Change in Bowel Habit (≥6 Weeks)",
+         "GP direct access to urgent colonoscopy.",
+         "Early diagnosis of any underlying pathology.",
+         fit="negative", symptoms=["change in bowel habit"], min_age=50),
+    Rule("uhb-neg-rectal-bleeding", "UHB_Pathway.pdf",
+         "≥40 Years Old with Rectal Bleeding",
+         "GP direct access to urgent flexible sigmoidoscopy.",
+         "Examination of the lower colon to identify causes like hemorrhoids, polyps, or cancer.",
+         fit="negative", symptoms=["rectal bleeding"], min_age=40),
+    Rule("uhb-neg-ida", "UHB_Pathway.pdf",
+         "≥40 Years Old with Ferritin ≤45 µg/L and Anaemia",
+         "LGI 2WW referral; cases are vetted by IDA clinicians for direct access to endoscopy, CT or capsule endoscopy.",
+         "Thorough investigation to identify the source of anaemia.",
+         fit="negative", symptoms=[IDA], min_age=40, ferritin_max=FERRITIN_THRESHOLD, anaemia=True),
+]
+
+
+@dataclass
+class PatientFacts:
+    """
+    The structured patient data the decision table is keyed by. ``mentioned_symptoms``
+    are the pathway symptoms named in the free-text Symptoms field, ticked or not.
+    """
+    features: PatientFeatures
+    symptoms: frozenset = frozenset()
+    mentioned_symptoms: frozenset = frozenset()
+    who_status: int = None
+    weight_loss_percent: float = None
+
+
+def facts_from_summary(summary):
+    """Reads the lab values, symptoms, WHO status and weight loss from a structured summary."""
+    return PatientFacts(
+        features=extract_features(summary),
+        symptoms=frozenset(extract_symptoms(summary)),
+        mentioned_symptoms=frozenset(extract_mentioned_symptoms(summary)),
+        who_status=extract_who_status(summary),
+        weight_loss_percent=extract_weight_loss_percent(summary),
+    )
+
+
+@dataclass
+class Decision:
+    """The matched rules for one patient, in table order."""
+    rules: list
+    version: str
+
+    @property
+    def citations(self):
+        return [f"{rule.document} p.{rule.page}: \"{rule.quote}\"" for rule in self.rules]
+
+    def render_answer(self):
+        lines = ["Recommended course of action (from the compiled pathway decision table):"]
+        for number, rule in enumerate(self.rules, start=1):
+            lines.append(f"- {rule.action} [{number}]")
+            if rule.outcome:
+                lines.append(f"  Potential outcome: {rule.outcome}")
+        lines.append("")
+        lines.append("Sources:")
+        lines.extend(f"[{number}] {citation}" for number, citation in enumerate(self.citations, start=1))
+        return "\n".join(lines)
+
+    def render_steps(self):
+        return f"Resolved by decision table {self.version}: " + ", ".join(rule.id for rule in self.rules)
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _fit_status(features):
+    result = evaluate_criteria(features)
+    if result.fit_positive:
+        return "positive"
+    if result.fit_negative:
+        return "negative"
+    return "unknown"
+
+
+class DecisionTable:
+    """
+    Pathway rules indexed by FIT status and symptom.
+
+    ``lookup`` returns a ``Decision`` only when every symptom the patient has is
+    covered by a matching rule and every candidate rule's conditions can be fully
+    evaluated; otherwise it returns None and the caller falls back to retrieval
+    and the LLM. Symptoms named only in the free-text Symptoms field are not
+    trusted as facts, so they also make the table defer.
+    """
+
+    def __init__(self, rules, version, index=None):
+        self.rules = {rule.id: rule for rule in rules}
+        self.order = [rule.id for rule in rules]
+        self.version = version
+        self.index = index or build_index(rules)
+
+    def _matches(self, rule, facts, symptoms):
+        """True, False, or None when the patient's data cannot answer a condition."""
+        features = facts.features
+        if rule.symptoms and not symptoms & set(rule.symptoms):
+            return False
+        if rule.isolated and len(symptoms) != 1:
+            return False
+        if rule.with_any and not symptoms & set(rule.with_any):
+            return False
+        if rule.min_age is not None or rule.max_age is not None:
+            if features.age is None:
+                return None
+            if rule.min_age is not None and features.age < rule.min_age:
+                return False
+            if rule.max_age is not None and features.age >= rule.max_age:
+                return False
+        if rule.min_who is not None:
+            if facts.who_status is None:
+                return None
+            if facts.who_status < rule.min_who:
+                return False
+        if rule.ferritin_max is not None:
+            if features.ferritin is None:
+                return None
+            if features.ferritin > rule.ferritin_max or (rule.ferritin_strict and features.ferritin == rule.ferritin_max):
+                return False
+        if rule.anaemia:
+            anaemia = evaluate_criteria(features).anaemia
+            if anaemia is None:
+                return None
+            if not anaemia:
+                return False
+        if rule.min_weight_loss_percent is not None:
+            if facts.weight_loss_percent is None:
+                return None
+            if facts.weight_loss_percent < rule.min_weight_loss_percent:
+                return False
+        return True
+
+    def lookup(self, facts):
+        """
+        Returns the ``Decision`` for ``facts``, or None if the table cannot decide.
+        """
+        symptoms = set(facts.symptoms)
+        result = evaluate_criteria(facts.features)
+        if result.ferritin_low and result.anaemia:
+            symptoms.add(IDA)
+        if facts.mentioned_symptoms - symptoms:
+            return None
+        fit = _fit_status(facts.features)
+
+        candidate_ids = set()
+        for key in list(symptoms) + [ANY_SYMPTOM]:
+            candidate_ids.update(self.index.get(fit, {}).get(key, []))
+
+        matched, covered = [], set()
+        for rule_id in sorted(candidate_ids, key=self.order.index):
+            rule = self.rules[rule_id]
+            matches = self._matches(rule, facts, symptoms)
+            if matches is None:
+                # A branch that may apply cannot be ruled out, e.g. the over-80 route with no age
+                return None
+            if matches:
+                matched.append(rule)
+                covered.update(set(rule.symptoms) & symptoms)
+                covered.update(set(rule.with_any) & symptoms)
+
+        if not matched or covered != symptoms:
+            return None
+        return Decision(matched, self.version)
+
+    def lookup_summary(self, summary):
+        return self.lookup(facts_from_summary(summary))
+
+    @classmethod
+    def load(cls, path=DECISION_TABLE_PATH):
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        rules = [Rule(**rule) for rule in payload["rules"]]
+        return cls(rules, payload["version"], payload.get("index"))
+
+
+def build_index(rules):
+    """Maps FIT status ("positive", "negative", "unknown") and symptom (or "*") to rule ids."""
+    index = {"positive": {}, "negative": {}, "unknown": {}}
+    for rule in rules:
+        statuses = ["positive", "negative", "unknown"] if rule.fit == "any" else [rule.fit]
+        for status in statuses:
+            for key in rule.symptoms or [ANY_SYMPTOM]:
+                index[status].setdefault(key, []).append(rule.id)
+    return index
+
+
+def compile_table(rules_dir=RULES_DIR, specs=RULE_SPECS):
+    """
+    Compiles the rule specs against the pathway PDFs in ``rules_dir``.
+
+    Every rule's quote must appear verbatim (up to whitespace) in its document;
+    the page it appears on becomes the rule's citation. The version is a hash of
+    the schema, the rules and the source PDFs, so it changes whenever any of them do.
+
+    Returns:
+        dict: The decision table, ready to be written as JSON.
+
+    Raises:
+        ValueError: If a quote is not found, i.e. the pathway text has changed.
+    """
+    import fitz  # PyMuPDF
+
+    sources, pages = {}, {}
+    for document in sorted({rule.document for rule in specs}):
+        path = os.path.join(rules_dir, document)
+        with open(path, "rb") as f:
+            data = f.read()
+        sources[document] = hashlib.sha256(data).hexdigest()
+        with fitz.open(stream=data, filetype="pdf") as pdf:
+            pages[document] = [_normalize(page.get_text()) for page in pdf]
+
+    rules = []
+    for spec in specs:
+        quote = _normalize(spec.quote)
+        page = next((number for number, text in enumerate(pages[spec.document], start=1) if quote in text), None)
+        if page is None:
+            raise ValueError(f"Rule {spec.id}: quote not found in {spec.document}: {spec.quote!r}")
+        rules.append(Rule(**{**asdict(spec), "page": page}))
+
+    rule_payload = [asdict(rule) for rule in rules]
+    digest = hashlib.sha256(json.dumps([DECISION_TABLE_SCHEMA, rule_payload, sources], sort_keys=True).encode("utf-8"))
+    return {
+        "version": digest.hexdigest()[:12],
+        "schema": DECISION_TABLE_SCHEMA,
+        "sources": sources,
+        "rules": rule_payload,
+        "index": build_index(rules),
+    }
+
+
+@lru_cache(maxsize=1)
+def get_decision_table():
+    """Returns the compiled decision table from DECISION_TABLE_PATH, or None if it has not been compiled."""
+    if not os.path.exists(DECISION_TABLE_PATH):
+        return None
+    return DecisionTable.load(DECISION_TABLE_PATH)
@@ -0,0 +1,133 @@
+### Direct RAG Recommendation Engine ###
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from criteria import evaluate_criteria, extract_features, extract_symptoms, extract_who_status
+
+DIRECT_TOP_K = int(os.environ.get("REFERRAL_DIRECT_TOP_K", 3))
+DIRECT_MAX_CHUNKS = int(os.environ.get("REFERRAL_DIRECT_MAX_CHUNKS", 8))
+DIRECT_TIMEOUT = float(os.environ.get("REFERRAL_DIRECT_TIMEOUT", 30))
+
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("REFERRAL_DIRECT_WORKERS", 8)))
+
+
+def build_queries(summary):
+    """
+    Builds guideline retrieval queries from the structured summary fields:
+    FIT status, ticked symptoms, the FIT-negative IDA criteria, WHO status and age.
+    """
+    features = extract_features(summary)
+    result = evaluate_criteria(features)
+    symptoms = extract_symptoms(summary)
+    queries = []
+
+    if result.fit_positive:
+        queries.append("FIT positive ≥10 µgHb/g urgent LGI 2WW referral")
+        queries.extend(f"FIT positive pathway {symptom} action and outcome" for symptom in symptoms)
+    elif result.fit_negative:
+        queries.append("FIT negative <10 µgHb/g pathway ongoing symptoms")
+        queries.extend(f"FIT negative pathway {symptom} action" for symptom in symptoms)
+    else:
+        queries.append("FIT test requirement and criteria for LGI 2WW referral")
+        queries.extend(f"{symptom} referral criteria" for symptom in symptoms)
+
+    if result.ferritin_low or result.anaemia or "iron deficiency anaemia" in symptoms:
+        queries.append("iron deficiency anaemia ferritin ≤45 µg/L Hb <130 g/L men <115 g/L women action")
+
+    who = extract_who_status(summary)
+    if who is not None and who >= 3:
+        queries.append("mobility problems WHO performance score 3 or 4")
+
+    if features.age is not None and features.age >= 80:
+        queries.append("over 80 years old any symptoms")
+
+    return list(dict.fromkeys(queries))
+
+
+def build_recommendation_prompt(summary, documents):
+    excerpts = "\n\n".join(
+        f"[{i}] ({doc.metadata.get('document', 'guideline')}) {doc.page_content.strip()}"
+        for i, doc in enumerate(documents, start=1)
+    )
+    return f"""You are a highly knowledgeable medical assistant specializing in colorectal cancer referrals.
+Imagine you are the GP and this is all you have about this patient.
+
+Patient data extracted from the 2WW referral form:
+{summary}
+
+Guideline excerpts:
+{excerpts}
+
+Using only the guideline excerpts above (not external knowledge such as NICE guidelines), give the recommended course of action and the potential outcome for this patient. Cite the excerpts you rely on by number, e.g. [1].
+"""
+
+
+class DirectRecommender:
+    """
+    A single-pass recommendation engine: one batched retrieval, one LLM call.
+
+    Queries are built from the summary fields, embedded in one
+    ``embed_documents`` call and looked up in the vector store; the
+    deduplicated chunks go into a single prompt.
+
+    ``recommend`` stops waiting after ``timeout`` seconds, counted from the start
+    of retrieval, so a slow embeddings or vector store call counts against the
+    same deadline as the LLM. The work itself is not cancelled (a running thread
+    cannot be): it runs on in the background and its result is discarded.
+    ``llm`` should therefore be built with the same client timeout, as
+    ``initialize_direct_recommender`` does, so an abandoned call ends on its own
+    instead of holding its worker and rate-limit budget indefinitely.
+    """
+
+    def __init__(self, vector_store, embeddings, llm, top_k=DIRECT_TOP_K,
+                 max_chunks=DIRECT_MAX_CHUNKS, timeout=DIRECT_TIMEOUT):
+        self.vector_store = vector_store
+        self.embeddings = embeddings
+        self.llm = llm
+        self.top_k = top_k
+        self.max_chunks = max_chunks
+        self.timeout = timeout
+
+    def retrieve(self, queries):
+        """Fetches the chunks for every query with one embeddings call."""
+        vectors = self.embeddings.embed_documents(queries)
+        documents, seen = [], set()
+        for vector in vectors:
+            for doc in self.vector_store.similarity_search_by_vector(vector, k=self.top_k):
+                if doc.page_content not in seen:
+                    seen.add(doc.page_content)
+                    documents.append(doc)
+        return documents[:self.max_chunks]
+
+    def _retrieve_and_answer(self, summary, queries):
+        start = time.perf_counter()
+        documents = self.retrieve(queries)
+        retrieval_seconds = time.perf_counter() - start
+        response = self.llm.invoke(build_recommendation_prompt(summary, documents))
+        return documents, retrieval_seconds, response
+
+    def recommend(self, summary):
+        """
+        Returns:
+            tuple[str, str]: A description of the queries and sources used, and the recommendation.
+        """
+        start = time.perf_counter()
+        queries = build_queries(summary)
+        future = _executor.submit(self._retrieve_and_answer, summary, queries)
+        try:
+            documents, retrieval_seconds, response = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Not cancelled: the work runs until it completes or its clients time out, and the result is discarded
+            raise TimeoutError(f"Recommendation did not complete within {self.timeout:.0f}s")
+        final_answer = response.content if hasattr(response, "content") else str(response)
+
+        steps = [f"Retrieval queries ({retrieval_seconds:.2f}s):"]
+        steps.extend(f"- {query}" for query in queries)
+        steps.append("Guideline excerpts used:")
+        steps.extend(
+            f"[{i}] {doc.metadata.get('document', 'guideline')}: {doc.page_content.strip()[:120]}..."
+            for i, doc in enumerate(documents, start=1)
+        )
+        steps.append(f"Single LLM call completed in {time.perf_counter() - start - retrieval_seconds:.2f}s.")
+        return "\n".join(steps), final_answer
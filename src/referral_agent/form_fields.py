@@ -0,0 +1,200 @@
+### AcroForm Field Extraction Fast Path ###
+import glob
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from criteria import extract_features
+from referral_summary import ReferralSummary
+
+logger = logging.getLogger(__name__)
+
+FIELD_MAPS_DIR = os.environ.get(
+    "REFERRAL_FIELD_MAPS_DIR",
+    os.path.join(os.path.dirname(__file__), "..", "..", "rules", "field_maps"),
+)
+# Fraction of the summary fields a field map must find in a form to skip the LLM
+FIELD_MAP_MIN_COVERAGE = float(os.environ.get("REFERRAL_FIELD_MAP_MIN_COVERAGE", 0.8))
+
+# The printed labels of the ``ReferralSummary`` fields a field map can fill
+SUMMARY_FIELDS = [
+    "Name", "Age", "Gender", "Address", "Hospital number", "GP declaration",
+    "GP/Doctor details and referral date", "Symptoms", "FIT result",
+]
+SYMPTOM_FIELDS = ["Rectal bleeding", "Change in bowel habit", "Weight loss", "Iron Deficiency Anaemia"]
+LAB_FIELDS = ["Ferritin", "Hb", "WHO Performance status", "Additional History"]
+# Not printed, but used to work out the age when the form has no age field
+DATE_FIELDS = ["DoB", "Date of Referral"]
+
+_CHECKED = {"yes", "on", "true", "1", "x"}
+
+
+@dataclass
+class FieldMap:
+    """
+    Maps the widgets of one fillable form template to the summary fields.
+
+    Loaded from a JSON file in FIELD_MAPS_DIR::
+
+        {
+          "name": "wmca-2ww-v3",
+          "match": ["Surname", "NHS_number"],
+          "fields": {"Name": ["Forename", "Surname"], "FIT result": ["FIT_a", "FIT_b"], ...},
+          "checkboxes": {"Rectal bleeding": "Tick_a", ...},
+          "units": {"FIT result": "ugHb/g", "Ferritin": "µg/L", "Hb": "g/L"}
+        }
+
+    ``match`` lists widgets every form of the template has. A field mapped to
+    several widgets takes their distinct non-empty values, joined with spaces.
+    rules/field_maps/example_2ww_fillable.json is a complete example.
+    """
+    name: str
+    match: list = field(default_factory=list)
+    fields: dict = field(default_factory=dict)
+    checkboxes: dict = field(default_factory=dict)
+    units: dict = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        return cls(
+            name=payload.get("name", os.path.splitext(os.path.basename(path))[0]),
+            match=payload.get("match", []),
+            fields=payload.get("fields", {}),
+            checkboxes=payload.get("checkboxes", {}),
+            units=payload.get("units", {}),
+        )
+
+    def matches(self, widgets):
+        return bool(self.match) and all(name in widgets for name in self.match)
+
+    def coverage(self, widgets):
+        """Fraction of the printed summary fields this map finds in ``widgets``."""
+        def present(names):
+            names = [names] if isinstance(names, str) else names
+            return any(name in widgets for name in names)
+
+        wanted = SUMMARY_FIELDS + LAB_FIELDS
+        found = sum(1 for name in wanted if name in self.fields and present(self.fields[name]))
+        found += sum(1 for name in SYMPTOM_FIELDS if name in self.checkboxes and present(self.checkboxes[name]))
+        return found / (len(wanted) + len(SYMPTOM_FIELDS))
+
+
+@lru_cache(maxsize=1)
+def load_field_maps(directory=FIELD_MAPS_DIR):
+    """Loads every ``*.json`` field map in ``directory``."""
+    return tuple(FieldMap.load(path) for path in sorted(glob.glob(os.path.join(directory, "*.json"))))
+
+
+def _widget_value(widget):
+    import fitz  # PyMuPDF
+
+    if widget.field_type in (fitz.PDF_WIDGET_TYPE_CHECKBOX, fitz.PDF_WIDGET_TYPE_RADIOBUTTON):
+        value = widget.field_value
+        if isinstance(value, bool):
+            return value
+        return str(value).strip().lower() not in ("", "off", "false", "no")
+    value = widget.field_value
+    if isinstance(value, (list, tuple)):
+        value = ", ".join(str(item) for item in value)
+    return str(value).strip() if value is not None else ""
+
+
+def read_widgets(pdf_document):
+    """
+    Reads every form widget of an open document.
+
+    Returns:
+        dict: Widget name to its text, or to a bool for checkboxes. Radio groups map
+        to the on-state name of the selected button (or "" if none is selected).
+    """
+    import fitz  # PyMuPDF
+
+    widgets = {}
+    for page in pdf_document:
+        for widget in page.widgets():
+            name = widget.field_name
+            if widget.field_type == fitz.PDF_WIDGET_TYPE_RADIOBUTTON:
+                if _widget_value(widget):
+                    widgets[name] = widget.on_state() or "Yes"
+                else:
+                    widgets.setdefault(name, "")
+            else:
+                widgets[name] = _widget_value(widget)
+    return widgets
+
+
+def _lookup(widgets, names):
+    names = [names] if isinstance(names, str) else names
+    values = []
+    for name in names:
+        value = widgets.get(name)
+        if isinstance(value, bool):
+            value = "Yes" if value else ""
+        if value and value not in values:
+            values.append(value)
+    return " ".join(values)
+
+
+def _checked(widgets, names):
+    names = [names] if isinstance(names, str) else names
+    for name in names:
+        value = widgets.get(name)
+        if value is True or (isinstance(value, str) and value.lower() in _CHECKED):
+            return True
+    return False
+
+
+def format_field_summary(widgets, field_map):
+    """Builds the summary the LLM would produce from the mapped widget values."""
+    values = {name: _lookup(widgets, names) for name, names in field_map.fields.items()}
+    for name, unit in field_map.units.items():
+        if values.get(name) and not values[name].lower().endswith(unit.lower()):
+            values[name] = f"{values[name]} {unit}"
+    if not values.get("Age") and values.get("DoB"):
+        age = extract_features(f"DoB: {values['DoB']}\nDate of Referral: {values.get('Date of Referral', '')}").age
+        values["Age"] = str(age) if age is not None else ""
+
+    labelled = {name: values.get(name) for name in SUMMARY_FIELDS + LAB_FIELDS}
+    labelled.update({name: _checked(widgets, field_map.checkboxes.get(name, [])) for name in SYMPTOM_FIELDS})
+    return ReferralSummary.from_labels(labelled)
+
+
+def summarize_form_fields(data, field_maps=None, min_coverage=FIELD_MAP_MIN_COVERAGE):
+    """
+    Builds the structured summary straight from the widgets of a fillable PDF.
+
+    Args:
+        data (bytes): The PDF bytes.
+        field_maps (list[FieldMap]): Templates to try. Defaults to those in FIELD_MAPS_DIR.
+        min_coverage (float): Smallest share of summary fields a map must find.
+
+    Returns:
+        ReferralSummary: The summary, or None when the form has no widgets, no field
+        map matches it, or the best map covers too few fields.
+    """
+    import fitz  # PyMuPDF
+
+    field_maps = load_field_maps() if field_maps is None else field_maps
+    if not field_maps:
+        return None
+    try:
+        with fitz.open(stream=data, filetype="pdf") as pdf_document:
+            if not pdf_document.is_form_pdf:
+                return None
+            widgets = read_widgets(pdf_document)
+    except Exception as e:
+        logger.debug("Could not read form widgets: %s", e)
+        return None
+
+    candidates = [(field_map.coverage(widgets), field_map) for field_map in field_maps if field_map.matches(widgets)]
+    if not candidates:
+        return None
+    coverage, field_map = max(candidates, key=lambda candidate: candidate[0])
+    if coverage < min_coverage:
+        logger.info("Field map %s covers %.0f%% of the summary fields; using the LLM", field_map.name, coverage * 100)
+        return None
+    return format_field_summary(widgets, field_map)
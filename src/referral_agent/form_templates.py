@@ -0,0 +1,228 @@
+### Template-Aware Form Text Compression ###
+import hashlib
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_PATH = os.environ.get(
+    "REFERRAL_TEMPLATES_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "..", "rules", "templates.json"),
+)
+# Fraction of a layout's forms a line must appear in to count as template text
+TEMPLATE_MIN_SUPPORT = float(os.environ.get("REFERRAL_TEMPLATE_MIN_SUPPORT", 1.0))
+# Fraction of a layout's template lines a form must contain to be matched to it
+TEMPLATE_MATCH_THRESHOLD = float(os.environ.get("REFERRAL_TEMPLATE_MATCH_THRESHOLD", 0.6))
+# Template lines kept in front of each filled-in line so values keep their labels
+TEMPLATE_CONTEXT_LINES = int(os.environ.get("REFERRAL_TEMPLATE_CONTEXT_LINES", 4))
+
+_LEADER_RE = re.compile(r"[.…_]{2,}")
+# Short "Label: value" lines always carry a value, even if it repeats across the corpus
+_LABELLED_VALUE_RE = re.compile(r"^[^:]{1,30}:\s*[^\s.…_:][^:]{0,29}$")
+
+
+def normalize_line(line):
+    """Collapses whitespace and dotted leaders so the same template line always compares equal."""
+    line = _LEADER_RE.sub("…", line.strip())
+    return re.sub(r"\s+", " ", line)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.encoding_for_model("gpt-4o")
+    except Exception as e:  # tiktoken missing, or its BPE file cannot be downloaded
+        logger.debug("Falling back to estimated token counts: %s", e)
+        return None
+
+
+def count_tokens(text):
+    """Counts GPT-4o tokens with tiktoken, or estimates four characters per token without it."""
+    encoding = _encoding()
+    if encoding is None:
+        return max(1, len(text) // 4) if text else 0
+    return len(encoding.encode(text))
+
+
+@dataclass
+class FormLayout:
+    """The static lines of one form layout, learned from ``forms`` example forms."""
+    name: str
+    lines: set = field(default_factory=set)
+    forms: int = 0
+
+    def coverage(self, normalized_lines):
+        """Fraction of this layout's template lines present in a form."""
+        if not self.lines:
+            return 0.0
+        return len(self.lines & normalized_lines) / len(self.lines)
+
+
+@dataclass
+class CompressionResult:
+    text: str
+    layout: str = None
+    original_tokens: int = 0
+    compressed_tokens: int = 0
+
+    @property
+    def reduction(self):
+        """Fraction of input tokens removed."""
+        if not self.original_tokens:
+            return 0.0
+        return 1 - self.compressed_tokens / self.original_tokens
+
+
+def _line_set(text):
+    return {normalized for normalized in map(normalize_line, text.splitlines()) if normalized}
+
+
+class FormTemplates:
+    """
+    Known form layouts and their boilerplate.
+
+    ``learn`` groups a corpus of extracted form texts by layout (forms
+    sharing most of their lines) and records the lines common to every form
+    of a layout. ``compress`` then drops those lines from a new form of a
+    known layout, keeping every filled-in or ticked line together with the
+    few template lines just above it (its label). Forms of an unknown
+    layout are passed through unchanged.
+    """
+
+    def __init__(self, layouts=None, match_threshold=TEMPLATE_MATCH_THRESHOLD, context_lines=TEMPLATE_CONTEXT_LINES):
+        self.layouts = layouts or []
+        self.match_threshold = match_threshold
+        self.context_lines = context_lines
+
+    @property
+    def version(self):
+        """A hash of the learned templates, to tag summaries made from compressed text."""
+        digest = hashlib.sha256()
+        for layout in sorted(self.layouts, key=lambda layout: layout.name):
+            digest.update(layout.name.encode("utf-8"))
+            digest.update("\n".join(sorted(layout.lines)).encode("utf-8"))
+        return digest.hexdigest()[:12]
+
+    @classmethod
+    def learn(cls, texts, min_support=TEMPLATE_MIN_SUPPORT, min_forms=2, **kwargs):
+        """
+        Learns layouts from extracted form texts.
+
+        Args:
+            texts (list[str]): Extracted text of each example form.
+            min_support (float): Fraction of a layout's forms a line must appear in to be template text.
+            min_forms (int): Layouts seen fewer times are dropped, since their values cannot be told from boilerplate.
+
+        Returns:
+            FormTemplates: The learned templates.
+        """
+        groups = []  # [(first form's line set, [line sets])]
+        for text in texts:
+            lines = _line_set(text)
+            for anchor, members in groups:
+                if len(anchor & lines) / max(1, min(len(anchor), len(lines))) >= 0.5:
+                    members.append(lines)
+                    break
+            else:
+                groups.append((lines, [lines]))
+
+        layouts = []
+        for _, members in groups:
+            if len(members) < min_forms:
+                continue
+            counts = {}
+            for lines in members:
+                for line in lines:
+                    counts[line] = counts.get(line, 0) + 1
+            static = {
+                line for line, count in counts.items()
+                if count >= min_support * len(members) and not _LABELLED_VALUE_RE.search(line)
+            }
+            name = "layout-" + hashlib.sha256("\n".join(sorted(static)).encode("utf-8")).hexdigest()[:8]
+            layouts.append(FormLayout(name=name, lines=static, forms=len(members)))
+        return cls(layouts, **kwargs)
+
+    def match(self, text, partial=False):
+        """
+        Returns the best-matching known layout for ``text``, or None.
+
+        With ``partial``, ``text`` is only part of a form (e.g. its first page)
+        and is matched by the share of its own lines that are template lines.
+        """
+        lines = _line_set(text)
+        best, best_coverage = None, self.match_threshold
+        for layout in self.layouts:
+            if partial:
+                coverage = len(layout.lines & lines) / len(lines) if lines else 0.0
+            else:
+                coverage = layout.coverage(lines)
+            if coverage >= best_coverage:
+                best, best_coverage = layout, coverage
+        return best
+
+    def compress(self, text, layout=None):
+        """
+        Strips the template text of a known layout from ``text``.
+        Pass ``layout`` to skip matching, e.g. for later pages of a form being streamed.
+
+        Returns:
+            CompressionResult: The compressed text, matched layout and token counts before and after.
+        """
+        original_tokens = count_tokens(text)
+        layout = layout or self.match(text)
+        if layout is None:
+            return CompressionResult(text, None, original_tokens, original_tokens)
+
+        kept, pending = [], []  # pending: template lines since the last kept line
+        for line in text.splitlines():
+            normalized = normalize_line(line)
+            if not normalized:
+                continue
+            if normalized in layout.lines:
+                pending.append(normalized)
+                continue
+            if self.context_lines:
+                kept.extend(pending[-self.context_lines:])
+            kept.append(normalized)
+            pending = []
+
+        compressed = "\n".join(kept)
+        return CompressionResult(compressed, layout.name, original_tokens, count_tokens(compressed))
+
+    def save(self, path=TEMPLATES_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        payload = {
+            "version": self.version,
+            "layouts": [
+                {"name": layout.name, "forms": layout.forms, "lines": sorted(layout.lines)}
+                for layout in self.layouts
+            ],
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=TEMPLATES_PATH, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        layouts = [
+            FormLayout(name=layout["name"], lines=set(layout["lines"]), forms=layout["forms"])
+            for layout in payload["layouts"]
+        ]
+        return cls(layouts, **kwargs)
+
+
+@lru_cache(maxsize=1)
+def get_form_templates():
+    """Returns the learned templates from TEMPLATES_PATH, or None if none have been learned."""
+    if not os.path.exists(TEMPLATES_PATH):
+        return None
+    return FormTemplates.load(TEMPLATES_PATH)
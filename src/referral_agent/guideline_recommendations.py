@@ -1,17 +1,32 @@
 ### Module 3: Recommendation Generation ###
-import io
-import sys
-import re
+from decision_table import DECISION_TABLE_ENABLED, get_decision_table
+from direct_rag import DirectRecommender
+from metrics import timed
 
-def strip_ansi_codes(text):
-    """Removes ANSI escape codes from a string."""
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    return ansi_escape.sub('', text)
 
+def get_guideline_recommendations(summary, agent_executor, collector=None, use_table=DECISION_TABLE_ENABLED):
+    """
+    Generates recommendations and captures intermediate steps.
+
+    The agent's steps are recorded by a per-call ``TraceCollector`` callback rather
+    than by capturing stdout, so concurrent calls keep separate traces. Pass a
+    collector to keep the structured trace (timings, tokens, tool inputs/outputs).
+
+    ``agent_executor`` may also be a ``DirectRecommender``, which answers with a
+    single retrieval batch and one LLM call instead of the agent loop.
+
+    With ``use_table``, patients the compiled pathway decision table can decide are
+    answered from it directly, with citations, and neither engine is called.
+    """
+    table = get_decision_table() if use_table else None
+    decision = table.lookup_summary(summary) if table is not None else None
+    if decision is not None:
+        return decision.render_steps(), decision.render_answer()
+
+    if isinstance(agent_executor, DirectRecommender):
+        with timed("recommend", engine="direct"):
+            return agent_executor.recommend(summary)
 
-def get_guideline_recommendations(summary, agent_executor):
-    """Generates recommendations and captures intermediate steps."""
-    
     # Prepare the prompt
     prompt = f"""
         Based on the following patient data extracted from a patient's 2WW referral form:
@@ -20,22 +35,19 @@ def get_guideline_recommendations(summary, agent_executor):
         Please provide guideline-based recommendations for the patient. Use the medical guidelines tool to inform your response.
     """
 
-    # Capture verbose output
-    old_stdout = sys.stdout
-    sys.stdout = mystdout = io.StringIO()
+    from tracing import TraceCollector
 
-    try:
-        # Execute the agent and capture logs
-        response = agent_executor.invoke({"input": prompt, "chat_history": ""})
-    finally:
-        # Restore standard output
-        sys.stdout = old_stdout
+    collector = collector or TraceCollector()
 
-    # Retrieve verbose logs
-    verbose_logs = mystdout.getvalue()
+    # Execute the agent and record its steps
+    with timed("recommend", engine="agent"):
+        response = agent_executor.invoke(
+            {"input": prompt, "chat_history": ""},
+            config={"callbacks": [collector]},
+        )
 
     # Extract final output and intermediate steps
-    intermediate_steps = strip_ansi_codes(verbose_logs)
+    intermediate_steps = collector.render_text()
     final_answer = response.get("output", "No recommendation provided.")
 
     return intermediate_steps, final_answer
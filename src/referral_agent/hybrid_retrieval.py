@@ -0,0 +1,202 @@
+### Hybrid Lexical + Vector Guideline Retrieval ###
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from ingest import RULES_DIR, load_chunks
+from local_index import read_index_version
+
+# "vector" uses the vector store alone; "hybrid" fuses it with the BM25 index below
+RETRIEVER_MODE = os.environ.get("REFERRAL_RETRIEVER", "vector")
+HYBRID_TOP_K = int(os.environ.get("REFERRAL_HYBRID_TOP_K", 4))
+# Candidates taken from each ranking before fusion
+HYBRID_FETCH_K = int(os.environ.get("REFERRAL_HYBRID_FETCH_K", 10))
+RRF_K = int(os.environ.get("REFERRAL_RRF_K", 60))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"(?:[<>≤≥]=?\s*)?\d+(?:\.\d+)?|[a-zµ]+")
+_COMPARATORS = {"<=": "≤", ">=": "≥", "=<": "≤", "=>": "≥"}
+# Abbreviations and spellings used interchangeably in the forms and the pathways
+_EXPANSIONS = {
+    "ida": ["iron", "deficiency", "anaemia"],
+    "cibh": ["change", "bowel", "habit"],
+    "pr": ["rectal"],
+    "anemia": ["anaemia"],
+    "anemic": ["anaemia"],
+    "anaemic": ["anaemia"],
+    "ps": ["performance", "status"],
+    "lgi": ["lower", "gastrointestinal"],
+    "ugi": ["upper", "gastrointestinal"],
+}
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have if in into is it its of on or should the this to was "
+    "what when which with".split()
+)
+
+
+def tokenize(text):
+    """
+    Lowercases and splits guideline text into search terms.
+
+    Thresholds keep their comparator as an extra term ("ferritin ≤45" gives
+    "ferritin", "≤45" and "45"), so an exact threshold match outranks a bare
+    number. Common abbreviations are expanded to the words the pathways use.
+    """
+    text = text.lower()
+    for comparator, symbol in _COMPARATORS.items():
+        text = text.replace(comparator, symbol)
+    tokens = []
+    for token in _TOKEN_RE.findall(text):
+        token = token.replace(" ", "")
+        if token[0] in "<>≤≥":
+            tokens.append(token)
+            tokens.append(token.lstrip("<>≤≥="))
+        elif token in _EXPANSIONS:
+            tokens.extend(_EXPANSIONS[token])
+        elif token not in _STOPWORDS and (len(token) > 1 or token.isdigit()):
+            tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """An in-memory Okapi BM25 inverted index over guideline chunks."""
+
+    def __init__(self, documents, k1=BM25_K1, b=BM25_B):
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for i, doc in enumerate(self.documents):
+            counts = Counter(tokenize(doc.page_content))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((i, tf))
+        self.postings = dict(self.postings)
+        n = len(self.documents)
+        average = sum(self.lengths) / n if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+        # Per-document length normalization, precomputed so a search only sums postings
+        self._norms = [k1 * (1 - b + b * length / average) if average else k1 for length in self.lengths]
+
+    @classmethod
+    def from_chunks(cls, chunks, **kwargs):
+        return cls(
+            [Document(id=chunk.id, page_content=chunk.text, metadata=chunk.metadata) for chunk in chunks],
+            **kwargs,
+        )
+
+    def __len__(self):
+        return len(self.documents)
+
+    def search(self, query, k=HYBRID_FETCH_K):
+        """Returns up to ``k`` (Document, score) pairs, best first."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + self._norms[i])
+        best = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        return [(self.documents[i], score) for i, score in best]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses several rankings of documents into one, scoring each by sum(1 / (k + rank)).
+
+    Documents are matched across rankings by their text, since the vector store and
+    the BM25 index may not share ids.
+
+    Returns:
+        list[tuple[Document, float]]: Fused documents, best first.
+    """
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.page_content
+            documents.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return [(documents[key], score) for key, score in sorted(scores.items(), key=lambda item: -item[1])]
+
+
+@lru_cache(maxsize=4096)
+def _terms(text):
+    return frozenset(tokenize(text))
+
+
+def rerank(query, scored_documents, k=HYBRID_TOP_K):
+    """
+    Reorders fused candidates by how much of the query each one covers.
+
+    The fused score is scaled by the share of distinct query terms found in the
+    chunk, with thresholds ("≤45", "<10") weighted double because they are what
+    separates one pathway branch from the next.
+    """
+    terms = set(tokenize(query))
+    if not terms:
+        return [doc for doc, _ in scored_documents[:k]]
+    weights = {term: 2.0 if term[0] in "<>≤≥" else 1.0 for term in terms}
+    total = sum(weights.values())
+
+    def score(item):
+        doc, fused = item
+        present = _terms(doc.page_content)
+        coverage = sum(weight for term, weight in weights.items() if term in present) / total
+        return fused * (0.5 + coverage)
+
+    return [doc for doc, _ in sorted(scored_documents, key=lambda item: -score(item))[:k]]
+
+
+@lru_cache(maxsize=4)
+def _build_bm25_index(rules_dir, version):
+    return BM25Index.from_chunks(load_chunks(rules_dir))
+
+
+def get_bm25_index(rules_dir=RULES_DIR, index_name="pathways"):
+    """
+    Returns the BM25 index over the same chunks the ingestion embeds into ``index_name``.
+
+    The index is built once per version of ``index_name``, so a re-ingestion
+    (which bumps the version) is picked up on the next query.
+    """
+    return _build_bm25_index(str(rules_dir), read_index_version(index_name))
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retrieves guideline chunks by fusing vector search with BM25 keyword search.
+
+    Both rankings are fused with reciprocal rank fusion and the top candidates
+    reranked locally, so exact terms and thresholds the embeddings miss still
+    reach the top ``k``.
+
+    Without an explicit ``bm25`` index, the current one for ``index_name`` is
+    looked up on every query.
+    """
+    vector_store: Any
+    bm25: Any = None
+    index_name: str = "pathways"
+    k: int = HYBRID_TOP_K
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list:
+        vector_hits = self.vector_store.similarity_search(query, k=self.fetch_k)
+        bm25 = self.bm25 if self.bm25 is not None else get_bm25_index(index_name=self.index_name)
+        lexical_hits = [doc for doc, _ in bm25.search(query, k=self.fetch_k)]
+        fused = reciprocal_rank_fusion([vector_hits, lexical_hits], k=self.rrf_k)
+        return rerank(query, fused[:self.fetch_k], k=self.k)
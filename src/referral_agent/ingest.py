@@ -0,0 +1,179 @@
+### Guideline Ingestion Pipeline ###
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from langchain_community.document_loaders import PyPDFLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+RULES_DIR = Path(__file__).resolve().parents[2] / "rules"
+EMBED_BATCH_SIZE = int(os.environ.get("REFERRAL_EMBED_BATCH_SIZE", 64))
+UPSERT_BATCH_SIZE = int(os.environ.get("REFERRAL_UPSERT_BATCH_SIZE", 100))
+EMBED_CONCURRENCY = int(os.environ.get("REFERRAL_EMBED_CONCURRENCY", 4))
+
+
+@dataclass
+class Chunk:
+    id: str
+    text: str
+    metadata: dict
+
+
+@dataclass
+class IngestReport:
+    total: int = 0
+    embedded: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+    errors: list = field(default_factory=list)
+
+    @property
+    def chunks_per_second(self):
+        return self.embedded / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.total} chunks: {self.embedded} embedded, {self.unchanged} unchanged, "
+            f"{self.deleted} deleted, {self.failed} failed in {self.seconds:.2f}s "
+            f"({self.chunks_per_second:.1f} chunks/s)"
+        )
+
+
+def chunk_id(document, text):
+    """A stable id from the document name and chunk content, so unchanged chunks keep their id."""
+    return f"{Path(document).stem}-{hashlib.sha256(text.encode('utf-8')).hexdigest()[:24]}"
+
+
+def load_chunks(rules_dir=RULES_DIR, chunk_size=1000, chunk_overlap=100):
+    """Splits every PDF under ``rules_dir`` into chunks with content-hash ids."""
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = {}
+    for pdf_path in sorted(Path(rules_dir).glob("**/*.pdf")):
+        documents = PyPDFLoader(str(pdf_path)).load()
+        for doc in text_splitter.split_documents(documents):
+            cid = chunk_id(pdf_path.name, doc.page_content)
+            chunks[cid] = Chunk(cid, doc.page_content, {
+                "text": doc.page_content,
+                "document": pdf_path.name,
+                "source": pdf_path.stem.split("_")[0],
+                "page": doc.metadata.get("page", 0),
+            })
+    return list(chunks.values())
+
+
+class PineconeSink:
+    """Writes chunk vectors to a Pinecone index namespace."""
+
+    def __init__(self, index, namespace="ns1"):
+        self.index = index
+        self.namespace = namespace
+
+    def existing_ids(self):
+        # list() pages through every id in the namespace, including legacy "doc-{i}" ids
+        return {vector_id for page in self.index.list(namespace=self.namespace) for vector_id in page}
+
+    def upsert(self, chunks, vectors):
+        self.index.upsert(
+            vectors=[
+                {"id": chunk.id, "values": vector, "metadata": chunk.metadata}
+                for chunk, vector in zip(chunks, vectors)
+            ],
+            namespace=self.namespace,
+        )
+
+    def delete(self, ids):
+        self.index.delete(ids=list(ids), namespace=self.namespace)
+
+
+class LocalSink:
+    """Writes chunk vectors to a ``LocalVectorIndex``."""
+
+    def __init__(self, local_index):
+        self.local_index = local_index
+
+    def existing_ids(self):
+        return set(self.local_index.get_ids())
+
+    def upsert(self, chunks, vectors):
+        self.local_index.add_vectors(
+            [chunk.id for chunk in chunks],
+            vectors,
+            [chunk.text for chunk in chunks],
+            [{k: v for k, v in chunk.metadata.items() if k != "text"} for chunk in chunks],
+        )
+
+    def delete(self, ids):
+        self.local_index.delete(list(ids))
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def ingest(chunks, sink, embeddings, embed_batch_size=EMBED_BATCH_SIZE,
+           upsert_batch_size=UPSERT_BATCH_SIZE, concurrency=EMBED_CONCURRENCY):
+    """
+    Incrementally syncs ``chunks`` into ``sink``.
+
+    Only chunks whose id is not already in the sink are embedded, in batches of
+    ``embed_batch_size`` with up to ``concurrency`` embedding requests in flight.
+    Vectors are upserted in batches of ``upsert_batch_size``, and ids in the sink
+    that no longer correspond to a chunk are deleted. If any embedding batch
+    failed, nothing is deleted: a changed document's old chunks stay indexed
+    until a later run has indexed their replacements.
+
+    Returns:
+        IngestReport: Counts and throughput for the run.
+    """
+    start = time.perf_counter()
+    report = IngestReport(total=len(chunks))
+
+    existing = sink.existing_ids()
+    current = {chunk.id for chunk in chunks}
+    new_chunks = [chunk for chunk in chunks if chunk.id not in existing]
+    stale_ids = sorted(existing - current)
+    report.unchanged = len(chunks) - len(new_chunks)
+
+    pending_chunks, pending_vectors = [], []
+
+    def flush(force=False):
+        while len(pending_chunks) >= upsert_batch_size or (force and pending_chunks):
+            batch_chunks = pending_chunks[:upsert_batch_size]
+            batch_vectors = pending_vectors[:upsert_batch_size]
+            sink.upsert(batch_chunks, batch_vectors)
+            report.embedded += len(batch_chunks)
+            del pending_chunks[:upsert_batch_size]
+            del pending_vectors[:upsert_batch_size]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {
+            pool.submit(embeddings.embed_documents, [chunk.text for chunk in batch]): batch
+            for batch in _batches(new_chunks, embed_batch_size)
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                vectors = future.result()
+            except Exception as e:
+                # Failed chunks stay missing from the sink and are retried on the next run
+                report.failed += len(batch)
+                report.errors.append(str(e))
+                continue
+            pending_chunks.extend(batch)
+            pending_vectors.extend(vectors)
+            flush()
+    flush(force=True)
+
+    if not report.failed:
+        for batch in _batches(stale_ids, upsert_batch_size):
+            sink.delete(batch)
+            report.deleted += len(batch)
+
+    report.seconds = time.perf_counter() - start
+    return report
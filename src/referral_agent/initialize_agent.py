@@ -1,42 +1,128 @@
 ### Module 1: Query Tool and Agent Initialization ###
 
-from langchain.agents import create_react_agent, Tool, AgentExecutor
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-from langchain_openai import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
-from langchain_community.vectorstores import Pinecone
-from langchain_core.prompts import ChatPromptTemplate
-from langchain import hub
-
-def create_query_tool(index_name, tool_name, description, namespace="ns1"):
+# LangChain, the OpenAI and Pinecone clients and the vector index take seconds to
+# import, so they are imported inside the functions that need them. Importing this
+# module stays cheap and the first request (or warmup.start_warm_up) pays the cost.
+import os
+import threading
+from functools import lru_cache
+from direct_rag import DIRECT_TIMEOUT
+from llm_backends import get_embeddings, get_llm
+
+# "pinecone" queries the hosted index; "local" uses the memory-mapped index under LOCAL_INDEX_DIR
+VECTOR_BACKEND = os.environ.get("REFERRAL_VECTOR_BACKEND", "pinecone")
+# "agent" runs the ReAct loop; "direct" makes one retrieval batch and one LLM call
+RECOMMENDATION_MODE = os.environ.get("REFERRAL_RECOMMENDATION_MODE", "agent")
+AGENT_MAX_ITERATIONS = int(os.environ.get("REFERRAL_AGENT_MAX_ITERATIONS", 5))
+AGENT_MAX_EXECUTION_TIME = float(os.environ.get("REFERRAL_AGENT_MAX_EXECUTION_TIME", 120))
+
+_recommenders = {}
+_recommenders_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def get_query_embeddings():
+    """Returns the shared embeddings client, caching query embeddings across agents."""
+    from query_cache import CachedEmbeddings
+
+    return CachedEmbeddings(get_embeddings())
+
+def load_vector_store(index_name, namespace="ns1", backend=None):
     """
-    Creates a tool to query a specified Pinecone index.
+    Opens the guideline vector store for the selected backend.
+
+    Args:
+        index_name (str): Name of the Pinecone index, or of the local index directory.
+        namespace (str): Namespace for Pinecone index.
+        backend (str): "pinecone" or "local". Defaults to VECTOR_BACKEND.
+
+    Returns:
+        VectorStore: The opened vector store.
+    """
+    backend = backend or VECTOR_BACKEND
+    if backend == "local":
+        from local_index import LOCAL_INDEX_DIR, LocalVectorIndex
+
+        return LocalVectorIndex.load(os.path.join(LOCAL_INDEX_DIR, index_name), get_query_embeddings())
+    if backend == "pinecone":
+        from langchain_community.vectorstores import Pinecone
+
+        return Pinecone.from_existing_index(index_name, get_query_embeddings(), namespace=namespace)
+    raise ValueError(f"Unknown vector backend: {backend}")
+
+def create_query_tool(index_name, tool_name, description, namespace="ns1", backend=None, cache=None,
+                      vector_store=None, llm=None, retriever=None):
+    """
+    Creates a tool to query a specified guideline index.
 
     Args:
         index_name (str): Name of the Pinecone index.
         tool_name (str): Name of the tool.
         description (str): Description of the tool.
         namespace (str): Namespace for Pinecone index.
+        backend (str): "pinecone" or "local". Defaults to VECTOR_BACKEND.
+        cache (bool): Serve repeated (or, if enabled, semantically similar) queries
+            from the process-wide answer cache for this index. Defaults to QUERY_CACHE_ENABLED.
+        vector_store (VectorStore): Use this store instead of opening ``index_name``.
+        llm (BaseChatModel): Model for the RetrievalQA answer. Defaults to the "qa" stage model.
+        retriever (str): "vector" searches the vector store alone; "hybrid" fuses it with
+            BM25 keyword search over the same chunks. Defaults to RETRIEVER_MODE.
 
     Returns:
         Tool: A LangChain tool for querying the specified index.
     """
-    pinecone_index = Pinecone.from_existing_index(index_name, OpenAIEmbeddings(), namespace=namespace)
-
+    from langchain.agents import Tool
+    from langchain.chains import RetrievalQA
+    from hybrid_retrieval import RETRIEVER_MODE, HybridRetriever
+    from metrics import timed
+    from query_cache import QUERY_CACHE_ENABLED, get_query_cache, model_identity
+    from tracing import RetrieverMetricsHandler
+
+    if vector_store is None:
+        vector_store = load_vector_store(index_name, namespace=namespace, backend=backend)
+
+    cache = QUERY_CACHE_ENABLED if cache is None else cache
+    retriever = retriever or RETRIEVER_MODE
+    if retriever == "hybrid":
+        search = HybridRetriever(vector_store=vector_store, index_name=index_name)
+    elif retriever == "vector":
+        search = vector_store.as_retriever()
+    else:
+        raise ValueError(f"Unknown retriever: {retriever}")
+
+    llm = llm or get_llm("qa")
     retrieval_chain = RetrievalQA.from_chain_type(
-        llm=ChatOpenAI(model="gpt-3.5-turbo"),
-        retriever=pinecone_index.as_retriever()
+        llm=llm,
+        retriever=search
     )
+    # Passed per call (not to the chain) so the handler is inherited by the retriever run
+    retrieval_metrics = RetrieverMetricsHandler(index_name, retriever)
+
+    def run(query):
+        return retrieval_chain.run(query, callbacks=[retrieval_metrics])
+
+    if cache:
+        # Answers depend on how chunks are retrieved and on the model that writes them
+        run = get_query_cache(index_name, get_query_embeddings()).wrap(run, config=f"{retriever}:{model_identity(llm)}")
+
+    def timed_run(*args, **kwargs):
+        with timed("guideline_query", index=index_name):
+            return run(*args, **kwargs)
+
     return Tool(
         name=tool_name,
-        func=retrieval_chain.run,
+        func=timed_run,
         description=description
     )
 
-def initialize_agent():
-    """Initializes the LangChain agent with the necessary tools and prompt."""
-    guideline_tool = create_query_tool("pathways", "GuidelineQuery", "Search the colorectal cancer guideline index for next steps.")
+def initialize_agent(llm=None, guideline_tool=None):
+    """
+    Initializes the LangChain agent with the necessary tools and prompt.
+    ``llm`` and ``guideline_tool`` replace the default model and query tool, e.g. for benchmarks.
+    """
+    from langchain.agents import AgentExecutor, create_react_agent
+    from langchain.prompts import PromptTemplate
+
+    guideline_tool = guideline_tool or create_query_tool("pathways", "GuidelineQuery", "Search the colorectal cancer guideline index for next steps.")
 
     tools = [guideline_tool]
     tool_names = ["GuidelineQuery"]
@@ -79,12 +165,61 @@ def initialize_agent():
 
     prompt = PromptTemplate.from_template(template)
 
-    llm = ChatOpenAI(
-        model="gpt-3.5-turbo",
-        temperature=0.7,
-        max_tokens=1500
-    )
+    llm = llm or get_llm("agent", temperature=0.7, max_tokens=1500)
 
     agent = create_react_agent(tools=tools, llm=llm, prompt=prompt)
 
-    return AgentExecutor(agent=agent, tools=[guideline_tool], handle_parsing_errors=True, verbose=True)
\ No newline at end of file
+    return AgentExecutor(
+        agent=agent,
+        tools=[guideline_tool],
+        handle_parsing_errors=True,
+        max_iterations=AGENT_MAX_ITERATIONS,
+        max_execution_time=AGENT_MAX_EXECUTION_TIME,
+    )
+
+def initialize_direct_recommender(llm=None, vector_store=None, embeddings=None, timeout=DIRECT_TIMEOUT):
+    """
+    Initializes the single-pass recommendation engine over the "pathways" index.
+
+    Args:
+        llm (BaseChatModel): Model for the one recommendation call. Defaults to the "direct" stage model at temperature 0.
+        vector_store (VectorStore): Use this store instead of opening the "pathways" index.
+        embeddings (Embeddings): Embeddings for the retrieval queries. Defaults to the shared client.
+        timeout (float): Seconds to wait for the recommendation. The default model's client gets
+            the same timeout, so a call the recommender stops waiting for also ends.
+
+    Returns:
+        DirectRecommender: The recommendation engine.
+    """
+    from direct_rag import DirectRecommender
+
+    return DirectRecommender(
+        vector_store=vector_store if vector_store is not None else load_vector_store("pathways"),
+        embeddings=embeddings or get_query_embeddings(),
+        llm=llm or get_llm("direct", temperature=0, max_tokens=800, timeout=timeout, max_retries=1),
+        timeout=timeout,
+    )
+
+def initialize_recommender(mode=None):
+    """
+    Initializes the recommendation engine selected by ``mode`` ("agent" or "direct").
+    Defaults to RECOMMENDATION_MODE. Either engine can be passed to get_guideline_recommendations.
+    """
+    mode = mode or RECOMMENDATION_MODE
+    if mode == "agent":
+        return initialize_agent()
+    if mode == "direct":
+        return initialize_direct_recommender()
+    raise ValueError(f"Unknown recommendation mode: {mode}")
+
+def get_recommender(mode=None):
+    """
+    Returns the process-wide recommendation engine for ``mode``, building it on first use.
+    Concurrent callers (e.g. a request arriving during the background warm-up) wait for
+    the one build instead of starting their own.
+    """
+    mode = mode or RECOMMENDATION_MODE
+    with _recommenders_lock:
+        if mode not in _recommenders:
+            _recommenders[mode] = initialize_recommender(mode)
+        return _recommenders[mode]
@@ -0,0 +1,293 @@
+### Persistent Referral Job Queue and Worker Pool ###
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from cache import CACHE_DIR, hash_bytes
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.environ.get("REFERRAL_JOB_DB", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+JOB_WORKERS = int(os.environ.get("REFERRAL_JOB_WORKERS", 2))
+# A running job whose worker has not checked in for this long is handed to another worker
+JOB_LEASE_SECONDS = float(os.environ.get("REFERRAL_JOB_LEASE_SECONDS", 600))
+JOB_MAX_ATTEMPTS = int(os.environ.get("REFERRAL_JOB_MAX_ATTEMPTS", 3))
+# How often idle workers look for jobs submitted by other processes
+JOB_POLL_INTERVAL = float(os.environ.get("REFERRAL_JOB_POLL_INTERVAL", 1.0))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    pdf_hash TEXT NOT NULL,
+    filename TEXT,
+    status TEXT NOT NULL,
+    stage TEXT,
+    pdf BLOB,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_pdf_hash ON jobs (pdf_hash);
+"""
+_COLUMNS = "id, pdf_hash, filename, status, stage, result, error, attempts, created_at, started_at, finished_at"
+
+
+class JobQueue:
+    """
+    A referral job queue in a local SQLite database, safe to share between the
+    threads of one process and between processes on the same host.
+
+    Jobs are claimed with a lease: a worker that dies mid-job stops renewing it,
+    and once it lapses the job is claimed again, up to ``max_attempts`` times.
+    Updates are made only by the worker holding the job, so a worker whose lease
+    lapsed cannot overwrite the outcome of the worker that took the job over.
+    The PDF is dropped from the row once the job finishes; the result is kept.
+    """
+
+    def __init__(self, path=JOB_DB_PATH, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._submitted = threading.Condition()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def submit(self, data, filename=None):
+        """
+        Queues a PDF for analysis. A PDF already queued, running or done is not
+        queued again; its existing job is returned instead.
+
+        Returns:
+            dict: The job (see ``get``).
+        """
+        pdf_hash = hash_bytes(data)
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE pdf_hash = ? AND status != ? ORDER BY created_at DESC LIMIT 1",
+                (pdf_hash, FAILED),
+            ).fetchone()
+            if row is not None:
+                return self._job(row)
+            job_id = uuid.uuid4().hex
+            connection.execute(
+                "INSERT INTO jobs (id, pdf_hash, filename, status, pdf, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, pdf_hash, filename, QUEUED, data, time.time()),
+            )
+        with self._submitted:
+            self._submitted.notify()
+        return self.get(job_id)
+
+    def claim(self, worker):
+        """
+        Takes the oldest queued job, or a running job whose lease has lapsed.
+
+        Returns:
+            tuple[str, bytes] | None: The job id and the PDF bytes.
+        """
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            # Jobs whose workers died too often are failed rather than retried forever
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, pdf = NULL, finished_at = ? "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, "Worker stopped before finishing the job", now, RUNNING, now, self.max_attempts),
+            )
+            row = connection.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, lease_until = ?, "
+                "started_at = ?, stage = NULL "
+                "WHERE id = (SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) "
+                "ORDER BY created_at LIMIT 1) RETURNING id, pdf",
+                (RUNNING, worker, now + self.lease_seconds, now, QUEUED, RUNNING, now),
+            ).fetchone()
+        return (row["id"], row["pdf"]) if row is not None else None
+
+    def renew(self, job_id, worker):
+        """
+        Extends the lease of a job ``worker`` holds.
+
+        Returns:
+            bool: False if the job is no longer running on ``worker``.
+        """
+        return self._update(job_id, worker, "lease_until = ?", (time.time() + self.lease_seconds,))
+
+    def set_stage(self, job_id, worker, stage):
+        """Records the pipeline stage a job has reached and renews its lease."""
+        return self._update(job_id, worker, "stage = ?, lease_until = ?", (stage, time.time() + self.lease_seconds))
+
+    def complete(self, job_id, worker, result):
+        return self._update(
+            job_id, worker, "status = ?, result = ?, pdf = NULL, finished_at = ?, lease_until = NULL",
+            (DONE, json.dumps(result), time.time()),
+        )
+
+    def fail(self, job_id, worker, error):
+        return self._update(
+            job_id, worker, "status = ?, error = ?, pdf = NULL, finished_at = ?, lease_until = NULL",
+            (FAILED, error, time.time()),
+        )
+
+    def _update(self, job_id, worker, assignments, values):
+        """Applies ``assignments`` if ``worker`` still holds the running job; returns whether it did."""
+        cursor = self._connection().execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ? AND worker = ? AND status = ?",
+            (*values, job_id, worker, RUNNING),
+        )
+        if not cursor.rowcount:
+            logger.warning("Job %s is no longer held by %s; ignoring its update", job_id, worker)
+        return bool(cursor.rowcount)
+
+    @staticmethod
+    def _job(row):
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def get(self, job_id):
+        """
+        Returns:
+            dict | None: The job's id, status, stage, timestamps, attempts, and its
+            result (summary, intermediate steps, final answer) or error once finished.
+        """
+        row = self._connection().execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def wait_for_submission(self, timeout):
+        """Blocks until a job is submitted in this process, or ``timeout`` seconds pass."""
+        with self._submitted:
+            self._submitted.wait(timeout)
+
+    def wake_all(self):
+        with self._submitted:
+            self._submitted.notify_all()
+
+    def counts(self):
+        """Number of jobs in each status."""
+        rows = self._connection().execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        return {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)} | {row["status"]: row["count"] for row in rows}
+
+
+def run_pipeline(data, on_stage=None):
+    """
+    Runs one referral through ``parse_and_summarize_pdf`` and ``get_guideline_recommendations``.
+
+    Returns:
+        dict: ``summary``, ``intermediate_steps`` and ``final_answer``.
+    """
+    from io import BytesIO
+
+    from guideline_recommendations import get_guideline_recommendations
+    from initialize_agent import get_recommender
+    from parse_and_summarize_pdf import parse_and_summarize_pdf
+
+    on_stage = on_stage or (lambda stage: None)
+    on_stage("summarizing")
+    summary = parse_and_summarize_pdf(BytesIO(data))
+    on_stage("recommending")
+    intermediate_steps, final_answer = get_guideline_recommendations(summary, get_recommender())
+    return {"summary": summary, "intermediate_steps": intermediate_steps, "final_answer": final_answer}
+
+
+class WorkerPool:
+    """
+    Threads that claim jobs from a ``JobQueue`` and run them through ``pipeline``.
+    More throughput comes from more workers here, or from more processes sharing
+    the same queue database.
+    """
+
+    def __init__(self, queue, workers=JOB_WORKERS, pipeline=run_pipeline, poll_interval=JOB_POLL_INTERVAL):
+        self.queue = queue
+        self.workers = workers
+        self.pipeline = pipeline
+        self.poll_interval = poll_interval
+        self.name = f"{os.uname().nodename}:{os.getpid()}"
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(f"{self.name}:{number}",),
+                                      name=f"referral-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Started %d referral workers on %s", self.workers, self.queue.path)
+        return self
+
+    def stop(self, timeout=None):
+        """Stops claiming jobs and waits for the jobs in progress to finish."""
+        self._stopping.set()
+        self.queue.wake_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self, worker):
+        while not self._stopping.is_set():
+            try:
+                claimed = self.queue.claim(worker)
+            except sqlite3.Error as e:
+                logger.warning("Could not claim a job: %s", e)
+                claimed = None
+            if claimed is None:
+                self.queue.wait_for_submission(self.poll_interval)
+                continue
+            job_id, data = claimed
+            self.run_job(job_id, data, worker)
+
+    def _heartbeat(self, job_id, worker, finished):
+        """Renews the job's lease until ``finished`` is set, so a long stage does not lose it."""
+        while not finished.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.renew(job_id, worker):
+                    return
+            except sqlite3.Error as e:
+                logger.warning("Could not renew the lease of job %s: %s", job_id, e)
+
+    def run_job(self, job_id, data, worker):
+        from metrics import metrics, timed
+
+        logger.info("Running job %s on %s", job_id, worker)
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, worker, finished),
+                                     name=f"referral-heartbeat-{job_id[:8]}", daemon=True)
+        heartbeat.start()
+        try:
+            with timed("job"):
+                result = self.pipeline(data, on_stage=lambda stage: self.queue.set_stage(job_id, worker, stage))
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            if self.queue.fail(job_id, worker, f"{type(e).__name__}: {e}"):
+                metrics.inc("referral_jobs_total", status=FAILED)
+            return
+        finally:
+            finished.set()
+            heartbeat.join()
+        if self.queue.complete(job_id, worker, result):
+            metrics.inc("referral_jobs_total", status=DONE)
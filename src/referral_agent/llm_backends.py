@@ -0,0 +1,158 @@
+### LLM Backend Registry ###
+import os
+import threading
+from functools import lru_cache
+
+OPENAI_TIMEOUT = float(os.environ.get("REFERRAL_OPENAI_TIMEOUT", 60))
+OPENAI_MAX_RETRIES = int(os.environ.get("REFERRAL_OPENAI_MAX_RETRIES", 2))
+OLLAMA_URL = os.environ.get("REFERRAL_OLLAMA_URL", "http://localhost:11434")
+OLLAMA_TIMEOUT = float(os.environ.get("REFERRAL_OLLAMA_TIMEOUT", 120))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("REFERRAL_OLLAMA_CONNECT_TIMEOUT", 5))
+# How long Ollama keeps the model loaded after a request (Ollama duration string)
+OLLAMA_KEEP_ALIVE = os.environ.get("REFERRAL_OLLAMA_KEEP_ALIVE", "30m")
+# Keep-alive connections per host, shared by every client of a backend
+HTTP_POOL_SIZE = int(os.environ.get("REFERRAL_HTTP_POOL_SIZE", 16))
+# Stream completions token by token instead of waiting for the whole response
+LLM_STREAMING = os.environ.get("REFERRAL_LLM_STREAMING", "0") == "1"
+
+# The model each pipeline stage uses, as "backend:model". Override a stage with
+# REFERRAL_<STAGE>_LLM, e.g. REFERRAL_SUMMARY_LLM=ollama:llama3.1:8b.
+STAGE_MODELS = {
+    "summary": "openai:gpt-4o",
+    "qa": "openai:gpt-3.5-turbo",
+    "agent": "openai:gpt-3.5-turbo",
+    "direct": "openai:gpt-3.5-turbo",
+}
+
+_llms = {}
+_llms_lock = threading.Lock()
+
+
+def stage_spec(stage):
+    """Returns the configured "backend:model" for a pipeline stage."""
+    if stage not in STAGE_MODELS:
+        raise ValueError(f"Unknown LLM stage: {stage}")
+    return os.environ.get(f"REFERRAL_{stage.upper()}_LLM", STAGE_MODELS[stage])
+
+
+def parse_spec(spec):
+    """Splits "backend:model" (the model may itself contain colons). A bare model name means OpenAI."""
+    backend, sep, model = spec.partition(":")
+    if not sep or backend not in BACKENDS:
+        return "openai", spec
+    return backend, model
+
+
+@lru_cache(maxsize=1)
+def openai_http_client():
+    """The pooled keep-alive HTTP client shared by every OpenAI chat model."""
+    import httpx
+
+    return httpx.Client(limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE))
+
+
+@lru_cache(maxsize=None)
+def http_session(base_url):
+    """The pooled keep-alive ``requests`` session shared by every client of ``base_url``."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def openai_chat_model(model, temperature=None, max_tokens=None, timeout=None, max_retries=None, streaming=LLM_STREAMING):
+    from langchain_openai import ChatOpenAI
+
+    options = {name: value for name, value in (("temperature", temperature), ("max_tokens", max_tokens))
+               if value is not None}
+    return ChatOpenAI(
+        model=model,
+        timeout=timeout or OPENAI_TIMEOUT,
+        max_retries=OPENAI_MAX_RETRIES if max_retries is None else max_retries,
+        streaming=streaming,
+        http_client=openai_http_client(),
+        **options,
+    )
+
+
+def ollama_chat_model(model, temperature=None, max_tokens=None, timeout=None, max_retries=None, streaming=LLM_STREAMING):
+    import httpx
+    from langchain_ollama import ChatOllama
+
+    # A local server has no rate limits to retry through, so max_retries is ignored. ChatOllama
+    # always streams from the server internally, so the read timeout applies per token.
+    # client_kwargs go to both its httpx.Client and httpx.AsyncClient, so they must suit both.
+    return ChatOllama(
+        model=model,
+        base_url=OLLAMA_URL,
+        temperature=temperature,
+        num_predict=max_tokens,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        client_kwargs={
+            "timeout": httpx.Timeout(timeout or OLLAMA_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+            "limits": httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+        },
+    )
+
+
+# Factories take the model name and the stage's settings and return a LangChain chat model
+BACKENDS = {
+    "openai": openai_chat_model,
+    "ollama": ollama_chat_model,
+}
+
+
+def register_backend(name, factory):
+    """Adds (or replaces) a backend usable as "name:model" in a stage spec."""
+    BACKENDS[name] = factory
+
+
+def get_llm(stage, **settings):
+    """
+    Returns the long-lived chat model configured for a pipeline stage.
+
+    Args:
+        stage (str): "summary", "qa", "agent" or "direct".
+        **settings: temperature, max_tokens, timeout and max_retries for the stage.
+
+    Returns:
+        BaseChatModel: A client shared by every caller of the stage asking for the same settings,
+        wrapped with the backend's rate limiter unless REFERRAL_RATE_LIMIT=0, and
+        reporting its calls to ``metrics``.
+    """
+    from rate_limit import RATE_LIMIT_ENABLED, RATE_LIMIT_RETRIES, rate_limited_chat_model
+    from tracing import LLMMetricsHandler
+
+    spec = stage_spec(stage)
+    key = (stage, spec, tuple(sorted(settings.items())))
+    with _llms_lock:
+        if key not in _llms:
+            backend, model = parse_spec(spec)
+            if RATE_LIMIT_ENABLED:
+                # The wrapper retries with backoff coordinated across callers, so the client must not retry too
+                settings = dict(settings)
+                retries = settings.pop("max_retries", RATE_LIMIT_RETRIES)
+                llm = rate_limited_chat_model(BACKENDS[backend](model, max_retries=0, **settings), backend, retries)
+            else:
+                llm = BACKENDS[backend](model, **settings)
+            llm.callbacks = [LLMMetricsHandler(stage, model)]
+            _llms[key] = llm
+        return _llms[key]
+
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """Returns the shared OpenAI embeddings client, rate limited like the chat models."""
+    from langchain_openai import OpenAIEmbeddings
+    from rate_limit import RATE_LIMIT_ENABLED, rate_limited_embeddings
+
+    embeddings = OpenAIEmbeddings(
+        timeout=OPENAI_TIMEOUT,
+        max_retries=0 if RATE_LIMIT_ENABLED else OPENAI_MAX_RETRIES,
+        http_client=openai_http_client(),
+    )
+    return rate_limited_embeddings(embeddings)
@@ -0,0 +1,205 @@
+### Local Memory-Mapped Vector Index ###
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+LOCAL_INDEX_DIR = os.environ.get(
+    "REFERRAL_LOCAL_INDEX_DIR", str(Path(__file__).resolve().parents[2] / "rules" / "index")
+)
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.jsonl"
+# Names the version directory holding the current embeddings and chunks
+CURRENT_FILE = "CURRENT"
+
+
+def index_version_path(index_name):
+    """The marker file whose content changes every time ``index_name`` is modified."""
+    return Path(LOCAL_INDEX_DIR) / f"{index_name}.version"
+
+
+def read_index_version(index_name):
+    try:
+        return index_version_path(index_name).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return ""
+
+
+def bump_index_version(index_name):
+    """Records that ``index_name`` changed, invalidating cached guideline answers."""
+    path = index_version_path(index_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    version = f"{time.time_ns()}"
+    path.write_text(version, encoding="utf-8")
+    return version
+
+
+def _index_exists(path):
+    return (path / CURRENT_FILE).exists() or (path / EMBEDDINGS_FILE).exists()
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class LocalVectorIndex(VectorStore):
+    """
+    An in-process vector store for small corpora such as the pathway PDFs.
+
+    Unit-normalized float32 embeddings live in ``embeddings.npy`` and are
+    memory-mapped on load; chunk ids, text and metadata live alongside in
+    ``chunks.jsonl`` (one line per row of the matrix). Search is an exact
+    top-k cosine similarity computed with a single matrix-vector product.
+
+    Each save writes both files to a new version directory and then swaps the
+    ``CURRENT`` pointer, so a reader always gets a matching pair.
+    """
+
+    def __init__(self, path, embedding):
+        self.path = Path(path)
+        self._embedding = embedding
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        if _index_exists(self.path):
+            self._load()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _current_dir(self):
+        """The directory holding the current files; indexes written before versioning keep them at the top level."""
+        try:
+            return self.path / (self.path / CURRENT_FILE).read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return self.path
+
+    def _load(self):
+        directory = self._current_dir()
+        vectors = np.load(directory / EMBEDDINGS_FILE, mmap_mode="r")
+        ids, texts, metadatas = [], [], []
+        with open(directory / CHUNKS_FILE, encoding="utf-8") as f:
+            for line in f:
+                chunk = json.loads(line)
+                ids.append(chunk["id"])
+                texts.append(chunk["text"])
+                metadatas.append(chunk["metadata"])
+        if len(vectors) != len(ids):
+            raise ValueError(f"Corrupt local vector index at {directory}: {len(vectors)} vectors but {len(ids)} chunks")
+        self._vectors, self._ids, self._texts, self._metadatas = vectors, ids, texts, metadatas
+
+    def _save(self, vectors):
+        self.path.mkdir(parents=True, exist_ok=True)
+        previous = self._current_dir()
+        # Both files go to a fresh directory, published by replacing the one-line pointer
+        version = f"v{time.time_ns()}"
+        directory = self.path / version
+        directory.mkdir()
+        with open(directory / EMBEDDINGS_FILE, "wb") as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+        with open(directory / CHUNKS_FILE, "w", encoding="utf-8") as f:
+            for chunk_id, text, metadata in zip(self._ids, self._texts, self._metadatas):
+                f.write(json.dumps({"id": chunk_id, "text": text, "metadata": metadata}) + "\n")
+        tmp_pointer = self.path / f"{CURRENT_FILE}.tmp"
+        tmp_pointer.write_text(version, encoding="utf-8")
+        os.replace(tmp_pointer, self.path / CURRENT_FILE)
+        self._load()
+        # Keep the previous version for readers that resolved the pointer just before the swap
+        for old in self.path.glob("v*"):
+            if old.is_dir() and old not in (directory, previous):
+                shutil.rmtree(old, ignore_errors=True)
+
+    def get_ids(self):
+        return list(self._ids)
+
+    def add_vectors(self, ids, vectors, texts, metadatas=None):
+        """Adds precomputed embeddings, replacing any existing rows with the same ids."""
+        metadatas = metadatas or [{} for _ in ids]
+        replaced = set(ids)
+        keep = [i for i, chunk_id in enumerate(self._ids) if chunk_id not in replaced]
+
+        new_vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        old_vectors = np.asarray(self._vectors[keep]) if len(self._vectors) else new_vectors[:0]
+        self._ids = [self._ids[i] for i in keep] + list(ids)
+        self._texts = [self._texts[i] for i in keep] + list(texts)
+        self._metadatas = [self._metadatas[i] for i in keep] + list(metadatas)
+        self._save(np.concatenate([old_vectors, new_vectors]))
+        return list(ids)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_vectors(ids, vectors, texts, metadatas and list(metadatas))
+
+    def delete(self, ids=None, **kwargs):
+        if ids is None:
+            return False
+        removed = set(ids)
+        keep = [i for i, chunk_id in enumerate(self._ids) if chunk_id not in removed]
+        if len(keep) == len(self._ids):
+            return True
+        vectors = np.asarray(self._vectors[keep])
+        self._ids = [self._ids[i] for i in keep]
+        self._texts = [self._texts[i] for i in keep]
+        self._metadatas = [self._metadatas[i] for i in keep]
+        self._save(vectors)
+        return True
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        """Returns the ``k`` most similar chunks with their cosine similarity."""
+        if not self._ids:
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        scores = self._vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (Document(id=self._ids[i], page_content=self._texts[i], metadata=self._metadatas[i]), float(scores[i]))
+            for i in top
+        ]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @staticmethod
+    def _cosine_relevance_score_fn(similarity):
+        return (similarity + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path=LOCAL_INDEX_DIR, **kwargs):
+        index = cls(path, embedding)
+        index.add_texts(texts, metadatas=metadatas, ids=ids)
+        return index
+
+    @classmethod
+    def load(cls, path, embedding):
+        """Opens an existing index, raising if it has not been built yet."""
+        if not _index_exists(Path(path)):
+            raise FileNotFoundError(f"No local vector index at {path}. Run the guideline ingestion first.")
+        return cls(path, embedding)
+
@@ -1,10 +1,51 @@
 import streamlit as st
-from initialize_agent import initialize_agent
+from io import BytesIO
+from cache import hash_bytes
+from initialize_agent import get_recommender
 from guideline_recommendations import get_guideline_recommendations
+from metrics import PROFILER, profile_request, start_metrics_server
 from parse_and_summarize_pdf import parse_and_summarize_pdf
+from service_client import SERVICE_URL, ServiceClient
+from warmup import start_warm_up
+
+if not SERVICE_URL:
+    # Loads LangChain, PyMuPDF and the model clients in the background while the page renders
+    start_warm_up()
+    # Serves /metrics when REFERRAL_METRICS_PORT is set
+    start_metrics_server()
+
+
+@st.cache_resource(show_spinner="Connecting to the guideline index...")
+def get_agent_executor():
+    """Builds the recommendation engine (see REFERRAL_RECOMMENDATION_MODE) once per process; shared by every session and rerun."""
+    return get_recommender()
+
+
+def analyze_referral(data, profiler=PROFILER):
+    """Runs the full pipeline on the raw bytes of an uploaded referral form, profiled if ``profiler`` is set."""
+    with profile_request("referral", profiler=profiler):
+        summary = parse_and_summarize_pdf(BytesIO(data))
+        intermediate_steps, final_answer = get_guideline_recommendations(summary, get_agent_executor())
+    return {"summary": summary, "intermediate_steps": intermediate_steps, "final_answer": final_answer}
+
+
+def analyze_referral_remotely(data, filename=None):
+    """
+    Submits the form to the analysis service (see REFERRAL_SERVICE_URL) and follows its job
+    to the end. The service returns the existing job for a PDF it already has, so a rerun or
+    a reopened tab picks up the same job instead of starting another.
+    """
+    client = ServiceClient()
+    job = client.submit(data, filename=filename)
+    with st.status("Queued for processing...") as status:
+        def show(job):
+            label = {"queued": "Queued for processing...", "running": f"Processing: {job['stage'] or 'starting'}..."}
+            status.update(label=label.get(job["status"], job["status"].capitalize()))
+
+        result = client.wait(job["id"], on_update=show)
+        status.update(label="Processed", state="complete")
+    return result
 
-# Initialize the agent for recommendations
-agent_executor = initialize_agent()
 
 # App title and subheader
 # Add custom CSS for the subheader
@@ -45,11 +86,19 @@ if "Disabled" in selected_cancer:
 # Sidebar for file upload
 st.sidebar.header("Upload PDF")
 uploaded_file = st.sidebar.file_uploader("Upload a patient's 2WW referral form (PDF)", type="pdf")
+profile = st.sidebar.checkbox(
+    "Profile this request", value=False, disabled=bool(SERVICE_URL),
+    help="Writes a cProfile file to REFERRAL_PROFILE_DIR (not available when using the analysis service)",
+)
 
 # Initialize chat history
 if "chat_history" not in st.session_state:
     st.session_state["chat_history"] = []
 
+# Results of each analyzed upload in this session, keyed by the file's SHA-256
+if "results" not in st.session_state:
+    st.session_state["results"] = {}
+
 # Display chat messages
 
 for chat in st.session_state["chat_history"]:
@@ -58,27 +107,29 @@ for chat in st.session_state["chat_history"]:
 # File upload and analysis
 if uploaded_file:
     st.sidebar.success("File uploaded successfully!")
-    with st.spinner("Processing the uploaded PDF..."):
-        try:
-            # Parse and summarize the PDF
-             # Parse and summarize the PDF
-            summary = parse_and_summarize_pdf(uploaded_file)
-            st.subheader("Extracted Patient Data")
-            st.text_area("Summary of Patient 2WW Form", summary, height=300)
-
-            # Get recommendations and intermediate steps
-            intermediate_steps, final_answer = get_guideline_recommendations(summary, agent_executor)
-
-            # Display final recommendation
-            st.subheader("Recommendations")
-            st.text_area("Detailed Recommendation", final_answer, height=150)
-
-            # Display intermediate steps
-            st.subheader("Intermediate Steps")
-            st.text_area("Agent's Thought Process", intermediate_steps, height=300)
-
-
-        except Exception as e:
-            st.error(f"An error occurred while processing the file: {e}")
+    data = uploaded_file.getvalue()
+    digest = hash_bytes(data)
+    try:
+        # Reruns that do not change the file reuse the stored result
+        if digest not in st.session_state["results"] and SERVICE_URL:
+            st.session_state["results"][digest] = analyze_referral_remotely(data, uploaded_file.name)
+        elif digest not in st.session_state["results"]:
+            with st.spinner("Processing the uploaded PDF..."):
+                st.session_state["results"][digest] = analyze_referral(data, "cprofile" if profile else PROFILER)
+        result = st.session_state["results"][digest]
+
+        st.subheader("Extracted Patient Data")
+        st.text_area("Summary of Patient 2WW Form", result["summary"], height=300)
+
+        # Display final recommendation
+        st.subheader("Recommendations")
+        st.text_area("Detailed Recommendation", result["final_answer"], height=150)
+
+        # Display intermediate steps
+        st.subheader("Intermediate Steps")
+        st.text_area("Agent's Thought Process", result["intermediate_steps"], height=300)
+
+    except Exception as e:
+        st.error(f"An error occurred while processing the file: {e}")
 
 st.sidebar.info("Remember to clear your chat history periodically for privacy.")
@@ -0,0 +1,269 @@
+### Pipeline Metrics and Profiling ###
+import atexit
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Serve /metrics in Prometheus text format on this port (unset: no server)
+METRICS_PORT = os.environ.get("REFERRAL_METRICS_PORT")
+# Write the metrics to this file at exit, in Prometheus text format (unset: no dump)
+METRICS_FILE = os.environ.get("REFERRAL_METRICS_FILE")
+# Profile every request with "cprofile" or "pyinstrument" (unset: only when asked per request)
+PROFILER = os.environ.get("REFERRAL_PROFILER")
+PROFILE_DIR = Path(os.environ.get("REFERRAL_PROFILE_DIR", "profiles"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# USD per million (input, output) tokens; models not listed (e.g. local Ollama models) cost nothing
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "text-embedding-ada-002": (0.10, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+}
+
+_HELP = {
+    "referral_stage_seconds": "Wall time of each pipeline stage",
+    "referral_llm_seconds": "Latency of each chat model call",
+    "referral_llm_calls_total": "Chat model calls",
+    "referral_llm_errors_total": "Chat model calls that raised",
+    "referral_llm_tokens_total": "Tokens sent to and received from chat models",
+    "referral_llm_cost_usd_total": "Estimated chat model spend",
+    "referral_llm_shared_calls_total": "Chat model calls answered by an identical in-flight call (no tokens spent)",
+    "referral_retrieval_seconds": "Latency of each guideline retrieval",
+    "referral_ocr_pages_total": "PDF pages extracted, by how their text was obtained",
+    "referral_ocr_seconds_total": "Wall time spent extracting pages",
+    "referral_jobs_total": "Referral jobs finished by the worker pool, by outcome",
+    "referral_near_duplicate_hits_total": "Resubmitted referrals summarized from their earlier submission",
+}
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Thread-safe labelled counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def counter(self, name, **labels):
+        """The total of ``name`` over every label set matching ``labels``."""
+        wanted = set(self._key(name, labels)[1])
+        with self._lock:
+            return sum(value for (key, label_set), value in self.counters.items()
+                       if key == name and wanted <= set(label_set))
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        def labels_text(label_set, extra=()):
+            pairs = list(label_set) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (value.replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+            return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+        lines = []
+        with self._lock:
+            for kind, series in (("counter", self.counters), ("histogram", self.histograms)):
+                for name in sorted({key for key, _ in series}):
+                    lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (key, label_set), value in sorted(series.items()):
+                        if key != name:
+                            continue
+                        if kind == "counter":
+                            lines.append(f"{name}{labels_text(label_set)} {value:g}")
+                            continue
+                        cumulative = 0
+                        for bound, count in zip(list(value.buckets) + ["+Inf"], value.counts):
+                            cumulative += count
+                            lines.append(f"{name}_bucket{labels_text(label_set, [('le', str(bound))])} {cumulative}")
+                        lines.append(f"{name}_sum{labels_text(label_set)} {value.sum:g}")
+                        lines.append(f"{name}_count{labels_text(label_set)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def timed(stage, **labels):
+    """Records the wall time of the ``with`` block under ``referral_stage_seconds{stage=...}``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe("referral_stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+
+def model_cost(model, input_tokens, output_tokens):
+    """Estimated USD cost of a call, from MODEL_PRICES (matched on the longest model-name prefix)."""
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    if not matches:
+        return 0.0
+    input_price, output_price = MODEL_PRICES[max(matches, key=len)]
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def record_llm_call(stage, model, seconds, input_tokens=0, output_tokens=0, shared=False):
+    """
+    Records one chat model call. A ``shared`` call was answered by another caller's
+    identical in-flight call, so its tokens and cost were already recorded by that caller.
+    """
+    metrics.observe("referral_llm_seconds", seconds, stage=stage, model=model)
+    metrics.inc("referral_llm_calls_total", stage=stage, model=model)
+    if shared:
+        metrics.inc("referral_llm_shared_calls_total", stage=stage, model=model)
+        return
+    metrics.inc("referral_llm_tokens_total", input_tokens, stage=stage, model=model, kind="input")
+    metrics.inc("referral_llm_tokens_total", output_tokens, stage=stage, model=model, kind="output")
+    metrics.inc("referral_llm_cost_usd_total", model_cost(model, input_tokens, output_tokens), stage=stage, model=model)
+
+
+def record_ocr_document(pages, seconds):
+    """Records the pages of one document (PageText list) and the wall time to extract them."""
+    for page in pages:
+        metrics.inc("referral_ocr_pages_total", source=page.source)
+    metrics.inc("referral_ocr_seconds_total", seconds)
+
+
+def summary():
+    """Headline figures for logs and reports: calls, tokens, cost and OCR pages/sec."""
+    pages = metrics.counter("referral_ocr_pages_total")
+    ocr_seconds = metrics.counter("referral_ocr_seconds_total")
+    return {
+        "llm_calls": metrics.counter("referral_llm_calls_total"),
+        "input_tokens": metrics.counter("referral_llm_tokens_total", kind="input"),
+        "output_tokens": metrics.counter("referral_llm_tokens_total", kind="output"),
+        "cost_usd": round(metrics.counter("referral_llm_cost_usd_total"), 4),
+        "ocr_pages": pages,
+        "ocr_pages_per_second": pages / ocr_seconds if ocr_seconds else 0.0,
+    }
+
+
+def dump_metrics(path=METRICS_FILE):
+    """Writes the metrics to ``path`` in Prometheus text format (e.g. for node_exporter's textfile collector)."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(metrics.render())
+    os.replace(tmp_path, path)
+
+
+if METRICS_FILE:
+    atexit.register(dump_metrics, METRICS_FILE)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, host="0.0.0.0"):
+    """Serves GET /metrics on a daemon thread, once per process. Returns None when no port is set."""
+    global _server
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="referral-metrics", daemon=True).start()
+            logger.info("Serving metrics on port %s", port)
+        return _server
+
+
+@contextmanager
+def profile_request(name, profiler=PROFILER):
+    """
+    Profiles the ``with`` block when ``profiler`` is "cprofile" or "pyinstrument",
+    writing the profile to PROFILE_DIR. Does nothing when ``profiler`` is None.
+
+    Yields:
+        Path: Where the profile will be written, or None.
+    """
+    if not profiler:
+        yield None
+        return
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stem = PROFILE_DIR / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{threading.get_ident()}"
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+
+        path = stem.with_suffix(".html")
+        session = Profiler()
+        session.start()
+        try:
+            yield path
+        finally:
+            session.stop()
+            path.write_text(session.output_html(), encoding="utf-8")
+    elif profiler == "cprofile":
+        import cProfile
+
+        path = stem.with_suffix(".prof")
+        session = cProfile.Profile()
+        session.enable()
+        try:
+            yield path
+        finally:
+            session.disable()
+            session.dump_stats(path)
+    else:
+        raise ValueError(f"Unknown profiler: {profiler}")
+    logger.info("Wrote %s profile to %s", profiler, path)
@@ -0,0 +1,275 @@
+### Near-Duplicate Referral Index (MinHash/LSH) ###
+import difflib
+import logging
+import os
+import re
+import threading
+import zlib
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from cache import CACHE_DIR, DiskCache, hash_text
+from form_templates import normalize_line
+
+logger = logging.getLogger(__name__)
+
+# Estimated Jaccard similarity of two forms' shingle sets at or above which the earlier
+# form's summary is reused and only the changed fields are re-extracted. Unset disables it.
+NEAR_DUPLICATE_THRESHOLD = os.environ.get("REFERRAL_NEAR_DUPLICATE_THRESHOLD")
+NEAR_DUPLICATE_DIR = os.environ.get("REFERRAL_NEAR_DUPLICATE_DIR", os.path.join(CACHE_DIR, "near_duplicates"))
+MINHASH_PERMUTATIONS = int(os.environ.get("REFERRAL_MINHASH_PERMUTATIONS", 128))
+SHINGLE_WORDS = int(os.environ.get("REFERRAL_SHINGLE_WORDS", 5))
+# Signatures added since the band tables were last sorted; merged in one pass past this size
+BUFFER_SIZE = 4096
+# Weights of missed near-duplicates and of extra candidates when picking the band layout.
+# Candidates are checked against the full signature, so a miss costs far more than an extra one.
+FALSE_NEGATIVE_WEIGHT = 0.8
+FALSE_POSITIVE_WEIGHT = 0.2
+
+_PRIME = (1 << 31) - 1
+_WORD_RE = re.compile(r"\w+")
+# Patient identifiers that must agree, where both forms have them, for a form to count as a resubmission
+_IDENTIFIER_RES = (
+    re.compile(r"\b(?:NHS|Hospital)\b[^:\n]{0,20}?(?:number|no)\.?\s*[:\-]?\s*([A-Z]?\d[\d ]{4,}\d)", re.IGNORECASE),
+    re.compile(r"\bDoB\s*[:\-]?\s*(\d{1,2}/\d{1,2}/\d{4})", re.IGNORECASE),
+    re.compile(r"\bSurname\s*:[ \t]*(\S+)", re.IGNORECASE),
+)
+
+
+def lsh_params(threshold, num_perm):
+    """
+    Picks the number of bands and rows per band (bands * rows <= num_perm) whose
+    candidate probability curve best separates similarities above and below ``threshold``.
+
+    Returns:
+        tuple[int, int]: ``(bands, rows)``.
+    """
+    similarity = np.linspace(0, 1, 201)
+    below, above = similarity <= threshold, similarity >= threshold
+    best, best_error = (1, num_perm), float("inf")
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        candidate = 1 - (1 - similarity ** rows) ** bands
+        false_positives = np.trapezoid(candidate[below], similarity[below])
+        false_negatives = np.trapezoid(1 - candidate[above], similarity[above])
+        error = FALSE_POSITIVE_WEIGHT * false_positives + FALSE_NEGATIVE_WEIGHT * false_negatives
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+def changed_lines(old_text, new_text):
+    """
+    Lines removed from and added to ``old_text``, compared after normalizing whitespace.
+
+    Returns:
+        tuple[list[str], list[str]]: ``(removed, added)``.
+    """
+    old_lines = [line for line in map(normalize_line, old_text.splitlines()) if line]
+    new_lines = [line for line in map(normalize_line, new_text.splitlines()) if line]
+    removed, added = [], []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            removed.extend(old_lines[i1:i2])
+            added.extend(new_lines[j1:j2])
+    return removed, added
+
+
+def same_patient(text, other):
+    """
+    False when the two forms give a different NHS/hospital number, date of birth or
+    surname. Forms on the same layout share most of their text, so similarity alone
+    cannot tell a resubmission from another patient's referral.
+    """
+    for pattern in _IDENTIFIER_RES:
+        first, second = pattern.search(text), pattern.search(other)
+        if first and second and first.group(1).replace(" ", "").lower() != second.group(1).replace(" ", "").lower():
+            return False
+    return True
+
+
+class MinHasher:
+    """MinHash signatures over word shingles, stable across processes (no salted ``hash()``)."""
+
+    def __init__(self, num_perm=MINHASH_PERMUTATIONS, shingle_words=SHINGLE_WORDS, seed=1):
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self.b = generator.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+    def shingles(self, text):
+        """The distinct hashed ``shingle_words``-word shingles of ``text`` (31-bit ints)."""
+        words = _WORD_RE.findall(text.lower())
+        if not words:
+            return np.zeros(0, dtype=np.uint64)
+        word_hashes = np.array([zlib.crc32(word.encode("utf-8")) for word in words], dtype=np.uint64)
+        size = min(self.shingle_words, len(words))
+        shingles = word_hashes[: len(words) - size + 1].copy()
+        for offset in range(1, size):
+            shingles = (shingles * np.uint64(1_000_003) + word_hashes[offset: len(words) - size + 1 + offset]) & np.uint64(0xFFFFFFFF)
+        return np.unique(shingles & np.uint64(_PRIME))
+
+    def signature(self, text):
+        """The ``num_perm`` minimum hashes of the text's shingles, as uint32."""
+        shingles = self.shingles(text)
+        if not len(shingles):
+            return np.full(self.num_perm, _PRIME, dtype=np.uint32)
+        hashed = (np.outer(shingles, self.a) + self.b) % np.uint64(_PRIME)
+        return hashed.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """
+    Finds processed referrals whose text is nearly the same as a new one.
+
+    Each form is reduced to a MinHash signature, split into bands; forms sharing
+    any band are candidates, and a candidate matches when the fraction of equal
+    signature values (the estimated Jaccard similarity of their shingles) reaches
+    ``threshold``. Band keys live in sorted NumPy arrays searched with binary
+    search, plus a small dict of recent additions, so a lookup costs a few
+    microseconds per band however many forms are indexed.
+
+    Signatures are appended to a log under ``directory`` and reloaded on start;
+    the record stored with each form (its text and summary) is kept in a DiskCache.
+    """
+
+    def __init__(self, directory=NEAR_DUPLICATE_DIR, threshold=0.9, num_perm=MINHASH_PERMUTATIONS,
+                 shingle_words=SHINGLE_WORDS):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_words)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.records = DiskCache(self.directory / "records")
+        self._log_path = self.directory / f"signatures-{num_perm}x{shingle_words}.bin"
+        self._dtype = np.dtype([("key", "u1", (32,)), ("signature", "<u4", (num_perm,))])
+        self._lock = threading.Lock()
+        self._keys = []
+        self._positions = {}
+        self._signatures = np.zeros((1024, num_perm), dtype=np.uint32)
+        self._tables = [(np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64))] * self.bands
+        self._buffer = [{} for _ in range(self.bands)]
+        self._buffered = 0
+        self._multipliers = np.uint64(0x100000001B3) ** np.arange(self.rows, dtype=np.uint64)
+        self._load()
+
+    def _band_keys(self, signatures):
+        """One uint64 key per band for each signature row."""
+        banded = signatures[:, : self.bands * self.rows].astype(np.uint64).reshape(-1, self.bands, self.rows)
+        return (banded * self._multipliers).sum(axis=2)
+
+    def _load(self):
+        if not self._log_path.exists():
+            return
+        count = self._log_path.stat().st_size // self._dtype.itemsize
+        entries = np.fromfile(self._log_path, dtype=self._dtype, count=count)
+        keys = [key.tobytes().hex() for key in entries["key"]]
+        # Keep the first entry of each key (another process may have appended the same form)
+        first = np.sort(np.unique(keys, return_index=True)[1]) if keys else np.zeros(0, dtype=np.int64)
+        signatures = entries["signature"][first]
+        self._keys = [keys[i] for i in first]
+        self._positions = {key: position for position, key in enumerate(self._keys)}
+        self._signatures = np.concatenate([signatures, self._signatures])
+        band_keys = self._band_keys(signatures)
+        for band in range(self.bands):
+            order = np.argsort(band_keys[:, band], kind="stable")
+            self._tables[band] = (band_keys[order, band], order.astype(np.int64))
+        logger.info("Loaded %d referral signatures (%d bands x %d rows)", len(self._keys), self.bands, self.rows)
+
+    def _append(self, key, signature):
+        if key in self._positions:
+            return False
+        position = len(self._keys)
+        if position == len(self._signatures):
+            self._signatures = np.concatenate([self._signatures, np.zeros_like(self._signatures)])
+        self._signatures[position] = signature
+        self._keys.append(key)
+        self._positions[key] = position
+        for band, band_key in enumerate(self._band_keys(signature[None])[0].tolist()):
+            self._buffer[band].setdefault(band_key, []).append(position)
+        self._buffered += 1
+        if self._buffered >= BUFFER_SIZE:
+            self._compact()
+        return True
+
+    def _compact(self):
+        """Merges the buffered band keys into the sorted tables."""
+        if not self._buffered:
+            return
+        for band, buffer in enumerate(self._buffer):
+            keys, positions = self._tables[band]
+            new_keys = np.fromiter((key for key, items in buffer.items() for _ in items), dtype=np.uint64)
+            new_positions = np.fromiter((p for items in buffer.values() for p in items), dtype=np.int64)
+            keys, positions = np.concatenate([keys, new_keys]), np.concatenate([positions, new_positions])
+            order = np.argsort(keys, kind="stable")
+            self._tables[band] = (keys[order], positions[order])
+            buffer.clear()
+        self._buffered = 0
+
+    def query(self, text):
+        """
+        Returns:
+            list[tuple[str, float]]: The keys of indexed forms whose estimated Jaccard
+            similarity with ``text`` reaches the threshold, most similar first.
+        """
+        return self.query_signature(self.hasher.signature(text))
+
+    def query_signature(self, signature):
+        band_keys = self._band_keys(signature[None])[0]
+        with self._lock:
+            candidates = set()
+            for band, band_key in enumerate(band_keys):
+                keys, positions = self._tables[band]
+                # Search with the uint64 scalar; a Python int would make NumPy convert the whole table
+                start = keys.searchsorted(band_key, side="left")
+                end = keys.searchsorted(band_key, side="right")
+                candidates.update(positions[start:end].tolist())
+                candidates.update(self._buffer[band].get(int(band_key), ()))
+            if not candidates:
+                return []
+            candidates = list(candidates)
+            similarities = (self._signatures[candidates] == signature).mean(axis=1)
+            matches = [(self._keys[position], float(similarity))
+                       for position, similarity in zip(candidates, similarities) if similarity >= self.threshold]
+        return sorted(matches, key=lambda match: match[1], reverse=True)
+
+    def add(self, text, record):
+        """
+        Indexes ``text`` and stores ``record`` for it (replacing any earlier record).
+
+        Returns:
+            str: The form's key.
+        """
+        key = hash_text(text)
+        signature = self.hasher.signature(text)
+        self.records.set(key, record)
+        with self._lock:
+            if self._append(key, signature):
+                entry = np.zeros(1, dtype=self._dtype)
+                entry["key"] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+                entry["signature"] = signature
+                # One unbuffered append per form, so concurrent processes do not interleave entries
+                with open(self._log_path, "ab", buffering=0) as f:
+                    f.write(entry.tobytes())
+        return key
+
+    def get_record(self, key):
+        return self.records.get(key)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def stats(self):
+        return {"forms": len(self._keys), "bands": self.bands, "rows": self.rows, "threshold": self.threshold}
+
+
+@lru_cache(maxsize=1)
+def get_near_duplicate_index():
+    """Returns the process-wide near-duplicate index, or None when REFERRAL_NEAR_DUPLICATE_THRESHOLD is unset."""
+    if not NEAR_DUPLICATE_THRESHOLD:
+        return None
+    return NearDuplicateIndex(threshold=float(NEAR_DUPLICATE_THRESHOLD))
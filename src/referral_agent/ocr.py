@@ -0,0 +1,177 @@
+### OCR Engine: Parallel Region-Level Text Extraction ###
+import atexit
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from metrics import record_ocr_document
+from page_analysis import analyze_page, merge_regions, render_region
+
+logger = logging.getLogger(__name__)
+
+OCR_WORKERS = int(os.environ.get("REFERRAL_OCR_WORKERS", min(4, os.cpu_count() or 1)))
+OCR_DPI = int(os.environ.get("REFERRAL_OCR_DPI", 300))
+
+_pool = None
+_pool_workers = 0
+
+
+@dataclass
+class PageText:
+    """Text recovered from a single PDF page, with timing for each step."""
+    page_number: int
+    text: str
+    source: str  # "text" for selectable text, "ocr" for scanned pages, "hybrid" for both
+    extract_seconds: float = 0.0
+    render_seconds: float = 0.0
+    ocr_seconds: float = 0.0
+    ocr_regions: int = 0
+    ocr_pixels: int = 0
+
+    @property
+    def total_seconds(self):
+        return self.extract_seconds + self.render_seconds + self.ocr_seconds
+
+
+def get_ocr_pool(workers):
+    """Returns a process-wide OCR pool, recreating it only when the size changes."""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+
+@atexit.register
+def shutdown_ocr_pool():
+    """Stops the OCR worker processes."""
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool, _pool_workers = None, 0
+
+
+def ocr_image(width, height, samples):
+    """Runs tesseract on raw grayscale pixels. Executed inside a pool worker."""
+    import pytesseract
+    from PIL import Image
+
+    start = time.perf_counter()
+    image = Image.frombytes("L", (width, height), samples)
+    text = pytesseract.image_to_string(image)
+    return text, time.perf_counter() - start
+
+
+def iter_pages(pdf_document, workers=None, dpi=None):
+    """
+    Yields the text of every page of an open PyMuPDF document, in page order,
+    as soon as each page is ready.
+
+    Each page is analyzed for text and image blocks (see ``page_analysis``).
+    Selectable text is read directly; only the image regions that need OCR are
+    rendered, each clipped to its bounding box at an adaptive DPI, and sent to
+    a bounded process pool. At most ``2 * workers`` rendered regions are held
+    in memory at once, and no further pages are read while the consumer is
+    busy with the last one yielded. OCR'd text is merged with the page's
+    native text in reading order.
+
+    Args:
+        pdf_document (fitz.Document): The open PDF document.
+        workers (int): OCR worker processes. 1 or less runs OCR in-process.
+        dpi (int): Highest resolution used to rasterize scanned regions.
+
+    Yields:
+        PageText: One entry per page, in page order.
+    """
+    workers = OCR_WORKERS if workers is None else workers
+    dpi = OCR_DPI if dpi is None else dpi
+
+    started = time.perf_counter()
+    done = []
+    waiting = deque()  # (PageText, PageLayout or None), oldest first
+    pending = {}  # (page_number, region index) -> future
+    layouts = {}
+    results = {}
+    pool = get_ocr_pool(workers) if workers > 1 else None
+
+    def collect(key):
+        text, ocr_seconds = pending.pop(key).result()
+        page_number, index = key
+        layouts[page_number].ocr_regions[index].text = text
+        results[page_number].ocr_seconds += ocr_seconds
+
+    def finished(block):
+        """Yields the waiting pages whose OCR is done; with ``block``, waits for all of them."""
+        for key in [key for key, future in pending.items() if future.done()]:
+            collect(key)
+        while waiting:
+            result, layout = waiting[0]
+            keys = sorted(key for key in pending if key[0] == result.page_number)
+            if keys and not block:
+                return
+            for key in keys:
+                collect(key)
+            waiting.popleft()
+            results.pop(result.page_number)
+            if layouts.pop(result.page_number, None) is not None:
+                result.text = merge_regions(layout)
+            logger.debug(
+                "page %d (%s): %.3fs extract, %.3fs render, %.3fs ocr, %d regions, %d pixels",
+                result.page_number + 1, result.source, result.extract_seconds,
+                result.render_seconds, result.ocr_seconds, result.ocr_regions, result.ocr_pixels,
+            )
+            done.append(result)
+            yield result
+
+    for page_number in range(len(pdf_document)):
+        page = pdf_document[page_number]
+        start = time.perf_counter()
+        layout = analyze_page(page, max_dpi=dpi)
+        extract_seconds = time.perf_counter() - start
+
+        if not layout.ocr_regions:
+            result = PageText(page_number, layout.native_text, "text", extract_seconds)
+            results[page_number] = result
+            waiting.append((result, None))
+            yield from finished(block=False)
+            continue
+
+        # OCR only the image regions, merged with any selectable text once they are done
+        result = PageText(page_number, "", "hybrid" if layout.has_text else "ocr", extract_seconds)
+        results[page_number] = result
+        layouts[page_number] = layout
+        waiting.append((result, layout))
+        for index, region in enumerate(layout.ocr_regions):
+            start = time.perf_counter()
+            rendered = render_region(page, region)
+            result.render_seconds += time.perf_counter() - start
+            result.ocr_regions += 1
+            result.ocr_pixels += rendered[0] * rendered[1]
+
+            if pool is None:
+                region.text, ocr_seconds = ocr_image(*rendered)
+                result.ocr_seconds += ocr_seconds
+                continue
+
+            if len(pending) >= 2 * workers:
+                collect(min(pending))
+            pending[(page_number, index)] = pool.submit(ocr_image, *rendered)
+        yield from finished(block=False)
+
+    yield from finished(block=True)
+    record_ocr_document(done, time.perf_counter() - started)
+
+
+def extract_pages(pdf_document, workers=None, dpi=None):
+    """
+    Extracts text from every page of an open PyMuPDF document; see ``iter_pages``.
+
+    Returns:
+        list[PageText]: One entry per page, in page order.
+    """
+    return list(iter_pages(pdf_document, workers=workers, dpi=dpi))
@@ -0,0 +1,146 @@
+### Page and Region Content Analysis ###
+import os
+from dataclasses import dataclass, field
+
+# Image regions smaller than this fraction of the page (logos, ticks, signatures) are not OCR'd
+OCR_MIN_REGION_AREA = float(os.environ.get("REFERRAL_OCR_MIN_REGION_AREA", 0.02))
+# Scanned regions are rendered at their native resolution, but no lower than this
+OCR_MIN_DPI = int(os.environ.get("REFERRAL_OCR_MIN_DPI", 150))
+# An image with at least this many characters of selectable text over it already has a text layer
+TEXT_LAYER_MIN_CHARS = 20
+
+
+@dataclass
+class Region:
+    """A rectangle of page content: a native text block or an image to OCR."""
+    bbox: tuple  # (x0, y0, x1, y1) in PDF points
+    kind: str  # "text" or "image"
+    text: str = ""
+    dpi: int = 0  # Render resolution for image regions
+
+    @property
+    def area(self):
+        x0, y0, x1, y1 = self.bbox
+        return max(0.0, x1 - x0) * max(0.0, y1 - y0)
+
+
+@dataclass
+class PageLayout:
+    """What a page is made of, and which parts of it need OCR."""
+    page_number: int
+    width: float
+    height: float
+    text_blocks: list = field(default_factory=list)
+    image_blocks: list = field(default_factory=list)  # Every image on the page
+    ocr_regions: list = field(default_factory=list)  # The images worth OCR'ing
+
+    @property
+    def native_text(self):
+        """The selectable text in PyMuPDF's block order, as ``page.get_text()`` returns it."""
+        return "".join(block.text for block in self.text_blocks)
+
+    @property
+    def has_text(self):
+        return any(block.text.strip() for block in self.text_blocks)
+
+    @property
+    def has_images(self):
+        return bool(self.image_blocks)
+
+    @property
+    def kind(self):
+        """One of "text", "scanned", "hybrid" (text plus regions to OCR) or "empty"."""
+        if self.ocr_regions:
+            return "hybrid" if self.has_text else "scanned"
+        return "text" if self.has_text else "empty"
+
+
+def _intersection_area(a, b):
+    return max(0.0, min(a[2], b[2]) - max(a[0], b[0])) * max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+
+
+def adaptive_dpi(pixel_width, bbox_width, min_dpi=OCR_MIN_DPI, max_dpi=300):
+    """
+    The resolution at which an embedded image is drawn on the page, clamped to
+    [min_dpi, max_dpi]. Rendering above it only adds pixels tesseract has to read.
+    """
+    if bbox_width <= 0 or pixel_width <= 0:
+        return max_dpi
+    native = pixel_width / (bbox_width / 72)
+    return int(min(max_dpi, max(min_dpi, native)))
+
+
+def analyze_page(page, min_region_area=OCR_MIN_REGION_AREA, max_dpi=300):
+    """
+    Finds the native text blocks and image blocks of a page, with their bounding boxes.
+
+    Images covering at least ``min_region_area`` of the page and without a text
+    layer of their own become OCR regions, each with the DPI to render it at.
+    A page with neither text nor images becomes one full-page OCR region.
+
+    Args:
+        page (fitz.Page): The page to analyze.
+        min_region_area (float): Smallest image, as a fraction of the page area, to OCR.
+        max_dpi (int): Highest resolution to render a region at.
+
+    Returns:
+        PageLayout: The page's text blocks, image blocks and OCR regions.
+    """
+    import fitz  # PyMuPDF
+
+    rect = page.rect
+    layout = PageLayout(page.number, rect.width, rect.height)
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks"):
+        if block_type == 0:
+            layout.text_blocks.append(Region((x0, y0, x1, y1), "text", text))
+
+    page_area = rect.width * rect.height
+    for info in page.get_image_info():
+        bbox = tuple(fitz.Rect(info["bbox"]) & rect)
+        region = Region(bbox, "image")
+        if region.area <= 0:
+            continue
+        region.dpi = adaptive_dpi(info.get("width", 0), bbox[2] - bbox[0], max_dpi=max_dpi)
+        layout.image_blocks.append(region)
+
+        if region.area < min_region_area * page_area:
+            continue
+        covered_chars = sum(
+            len(block.text.strip()) for block in layout.text_blocks
+            if _intersection_area(block.bbox, bbox) > 0.5 * block.area
+        )
+        if covered_chars < TEXT_LAYER_MIN_CHARS:
+            layout.ocr_regions.append(region)
+
+    if not layout.has_text and not layout.ocr_regions:
+        layout.ocr_regions.append(Region(tuple(rect), "image", dpi=max_dpi))
+    return layout
+
+
+def analyze_document(pdf_document, **kwargs):
+    """Analyzes every page of an open document; see ``analyze_page``."""
+    return [analyze_page(page, **kwargs) for page in pdf_document]
+
+
+def render_region(page, region, colorspace=None):
+    """Rasterizes just ``region`` of a page to grayscale pixels at the region's DPI."""
+    import fitz  # PyMuPDF
+
+    pixmap = page.get_pixmap(
+        dpi=region.dpi, clip=fitz.Rect(region.bbox), colorspace=colorspace or fitz.csGRAY, alpha=False
+    )
+    return pixmap.width, pixmap.height, pixmap.samples
+
+
+def reading_order(regions, line_tolerance=5.0):
+    """
+    Sorts regions top to bottom, then left to right for regions starting on
+    the same line (within ``line_tolerance`` points).
+    """
+    return sorted(regions, key=lambda region: (round(region.bbox[1] / line_tolerance), region.bbox[0]))
+
+
+def merge_regions(layout):
+    """Joins the page's native text blocks and OCR'd regions in reading order."""
+    regions = [region for region in layout.text_blocks + layout.ocr_regions if region.text.strip()]
+    return "\n".join(region.text.rstrip("\n") for region in reading_order(regions)) + "\n"
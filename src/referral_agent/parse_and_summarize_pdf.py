@@ -1,114 +1,405 @@
 ### Module 2: PDF Processing and Summarization ###
-from langchain_openai import ChatOpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import fitz  # PyMuPDF
-from pdf2image import convert_from_bytes
-import pytesseract
+import asyncio
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
+from cache import get_referral_cache, hash_bytes
+from criteria import PatientFeatures, evaluate_criteria, extract_features, format_criteria, merge_features
+from form_fields import summarize_form_fields
+from form_templates import get_form_templates
+from llm_backends import get_llm, stage_spec
+from metrics import metrics, timed
+from near_duplicates import changed_lines, get_near_duplicate_index, same_patient
+from ocr import extract_pages, iter_pages
+from referral_summary import ReferralSummary
 
-def extract_text_with_ocr(file):
+logger = logging.getLogger(__name__)
+
+SUMMARY_MODEL = stage_spec("summary")
+# Bump whenever the summarization prompt changes so cached summaries are not reused.
+SUMMARY_PROMPT_VERSION = "3"
+SUMMARY_CONCURRENCY = int(os.environ.get("REFERRAL_SUMMARY_CONCURRENCY", 8))
+CHUNK_SIZE = 8000
+CHUNK_OVERLAP = 100
+# Summarize chunks while later pages are still being extracted (see ``stream_summarize_pdf``)
+STREAMING_ENABLED = os.environ.get("REFERRAL_STREAMING", "0") == "1"
+
+def extract_text_with_ocr(file, workers=None, dpi=None):
     """
     Extracts text from a PDF using both PyMuPDF for selectable text and OCR for scanned pages.
-    Accepts a file-like object (BytesIO).
+    Accepts a file-like object (BytesIO). Scanned pages are rendered from the open document
+    and OCR'd in parallel; see ``ocr.extract_pages`` for ``workers`` and ``dpi``.
     """
-    text = ""
+    import fitz  # PyMuPDF
+
     try:
         # Open the file using PyMuPDF
-        pdf_document = fitz.open(stream=file.read(), filetype="pdf")
-        
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            page_text = page.get_text()
-
-            if page_text.strip():
-                text += page_text
-            else:
-                # Use OCR if no selectable text
-                pdf_document.seek(0)  # Reset file pointer for pdf2image
-                images = convert_from_bytes(file.read(), first_page=page_num + 1, last_page=page_num + 1)
-                for image in images:
-                    text += pytesseract.image_to_string(image)
+        with fitz.open(stream=file.read(), filetype="pdf") as pdf_document:
+            pages = extract_pages(pdf_document, workers=workers, dpi=dpi)
     except Exception as e:
         raise ValueError(f"Error processing the PDF file: {e}")
-    return text
+    return "".join(page.text for page in pages)
 
-def parse_and_summarize_pdf(file):
+def build_summary_prompt(chunk):
     """
-    Parses and summarizes a PDF file with mixed content (selectable text and scanned images).
-    Accepts a file-like object (BytesIO).
+    Builds the field-extraction prompt for one chunk of form text. The fields are those
+    of ``ReferralSummary``; threshold checks (FIT positive/negative, ferritin, anaemia,
+    age) are computed in ``criteria``, so the model only copies values as written.
     """
-    # Step 1: Extract text
-    raw_text = extract_text_with_ocr(file)
-    
-    # Step 2: Split the text into chunks
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=8000, chunk_overlap=100)
-    split_docs = text_splitter.split_text(raw_text)
-
-    # Step 3: Use LLM for summarization
-    llm = ChatOpenAI(
-        model="gpt-4o",
-        temperature=0.7,
+    return f"""
+        This text is from a 2WW referral form for colorectal cancer. Extract the patient's details exactly as written in the text. Do not interpret, compare or classify numeric results.
+
+        - Copy each lab value with its unit as written (e.g. '120 ugHb/g', '90 g/L', '4 µg/L'). Leave a field null when the text does not give it.
+        - Set each FIT positive pathway symptom (Rectal bleeding, Change in bowel habit, Weight loss, Iron Deficiency Anaemia) to true if it is ticked or described in the text, false if it is listed but not ticked, and null if the text does not cover it.
+
+        Text:
+        {chunk}
+        """
+
+def build_update_prompt(summary, removed, added):
+    """
+    Builds the prompt that re-extracts only the fields touched by the lines that changed
+    in a resubmitted form, given the summary of the earlier submission.
+    """
+    removed_text = "\n".join(removed) or "(none)"
+    added_text = "\n".join(added) or "(none)"
+    return f"""
+        This is the summary of a 2WW referral form for colorectal cancer, followed by the lines of the form text that changed when the form was resubmitted. Extract values exactly as written in the text. Do not interpret, compare or classify numeric results.
+
+        Fill in only the fields whose value these lines change, and leave every other field null.
+
+        Summary:
+        {summary}
+
+        Lines removed:
+        {removed_text}
+
+        Lines added:
+        {added_text}
+        """
+
+@lru_cache(maxsize=1)
+def get_summary_llm():
+    """Returns the long-lived chat model shared by all summarization calls (see REFERRAL_SUMMARY_LLM)."""
+    return get_llm("summary", temperature=0)
+
+def structured_summary_llm(llm):
+    """
+    Wraps a chat model so it answers a prompt with a ``ReferralSummary``: through the
+    model's structured output (tool calling) where it has it, otherwise by asking for
+    JSON matching the schema and validating the reply.
+    """
+    try:
+        return llm.with_structured_output(ReferralSummary)
+    except NotImplementedError:
+        from langchain_core.output_parsers import PydanticOutputParser
+        from langchain_core.runnables import RunnableLambda
+
+        parser = PydanticOutputParser(pydantic_object=ReferralSummary)
+        instructions = parser.get_format_instructions()
+        return RunnableLambda(lambda prompt: f"{prompt}\n{instructions}") | llm | parser
+
+@lru_cache(maxsize=1)
+def get_summary_extractor():
+    """Returns the structured-output wrapper of the shared summary model."""
+    return structured_summary_llm(get_summary_llm())
+
+def _extractor(llm):
+    return structured_summary_llm(llm) if llm is not None else get_summary_extractor()
+
+def _as_summary(result):
+    # A model that answers without calling the schema tool yields None: nothing extracted
+    return result if result is not None else ReferralSummary()
+
+def summarize_chunks_sequential(chunks, llm=None):
+    """Summarizes chunks one blocking call at a time."""
+    extractor = _extractor(llm)
+    return [_as_summary(extractor.invoke(build_summary_prompt(chunk))) for chunk in chunks]
+
+def summarize_chunks(chunks, llm=None, concurrency=SUMMARY_CONCURRENCY):
+    """
+    Summarizes all chunks concurrently, at most ``concurrency`` calls in flight.
+    Results keep the chunk order. A concurrency of 1 uses the sequential path.
+
+    Returns:
+        list[ReferralSummary]: One per chunk, to be merged with ``ReferralSummary.merge``.
+    """
+    if concurrency <= 1 or len(chunks) <= 1:
+        return summarize_chunks_sequential(chunks, llm)
+    prompts = [build_summary_prompt(chunk) for chunk in chunks]
+    responses = _extractor(llm).batch(prompts, config={"max_concurrency": concurrency})
+    return [_as_summary(response) for response in responses]
+
+async def asummarize_chunks(chunks, llm=None, concurrency=SUMMARY_CONCURRENCY):
+    """Async variant of ``summarize_chunks`` for callers already running an event loop."""
+    extractor = _extractor(llm)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def summarize(chunk):
+        async with semaphore:
+            return _as_summary(await extractor.ainvoke(build_summary_prompt(chunk)))
+
+    return list(await asyncio.gather(*(summarize(chunk) for chunk in chunks)))
+
+def extract_referral_text(data, use_cache=True, workers=None):
+    """
+    Extracts text from raw PDF bytes, reusing the cached text for a PDF seen before.
+
+    Returns:
+        tuple[str, str]: The SHA-256 of the PDF bytes and the extracted text.
+    """
+    cache = get_referral_cache() if use_cache else None
+    pdf_hash = hash_bytes(data)
+    raw_text = cache.get_text(pdf_hash) if cache else None
+    if raw_text is None:
+        with timed("extract"):
+            raw_text = extract_text_with_ocr(BytesIO(data), workers=workers)
+        if cache:
+            cache.set_text(pdf_hash, raw_text)
+    return pdf_hash, raw_text
+
+def _summary_version(templates):
+    version = f"{SUMMARY_PROMPT_VERSION}:{SUMMARY_MODEL}"
+    if templates is not None:
+        version += f":{templates.version}"
+    return version
+
+def _finish_summary(summary, raw_features):
+    """Renders the compact summary and appends the referral criteria computed in code."""
+    formatted_summary = summary.to_text()
+    features = merge_features(extract_features(formatted_summary), raw_features)
+    return formatted_summary + "\n" + format_criteria(features, evaluate_criteria(features))
+
+def compress_text(raw_text, templates):
+    """Strips the template text of a known form layout, if templates have been learned."""
+    if templates is None:
+        return raw_text
+    compression = templates.compress(raw_text)
+    logger.info(
+        "Template %s: %d -> %d input tokens (%.0f%% reduction)", compression.layout,
+        compression.original_tokens, compression.compressed_tokens, compression.reduction * 100,
     )
+    return compression.text
+
+def find_resubmission(index, text, version):
+    """
+    Returns the stored record (text and summary) of an earlier submission of the same
+    referral: a near-duplicate for the same patient, summarized with the same prompt
+    and model. Returns None if there is none.
+    """
+    for key, similarity in index.query(text):
+        record = index.get_record(key)
+        if record is not None and record["version"] == version and same_patient(record["text"], text):
+            logger.info("Near-duplicate of a processed referral (similarity %.2f)", similarity)
+            metrics.inc("referral_near_duplicate_hits_total")
+            return record
+    return None
+
+def summarize_changes(previous, text, llm=None):
+    """
+    Updates the summary of an earlier submission of the same form, re-extracting only
+    the fields touched by the lines that changed. Without changed lines (e.g. a re-scan)
+    the summary is reused as is.
+
+    Returns:
+        ReferralSummary: The earlier summary with the changed fields replaced.
+    """
+    summary = ReferralSummary.model_validate(previous["summary"])
+    removed, added = changed_lines(previous["text"], text)
+    if not removed and not added:
+        return summary
+    changes = _extractor(llm).invoke(build_update_prompt(summary.to_text(), removed, added))
+    return summary.updated(_as_summary(changes))
+
+def summarize_text(raw_text, use_cache=True, concurrency=SUMMARY_CONCURRENCY, llm=None, templates=None):
+    """
+    Summarizes extracted form text, reusing the cached summary for text seen before.
+    When form templates have been learned (see ``form_templates``), the boilerplate of a
+    known layout is stripped before the text is sent to the model. When near-duplicate
+    detection is on (see ``near_duplicates``), a resubmitted form reuses the summary of
+    its earlier submission and only the changed fields are re-extracted.
+    """
+    cache = get_referral_cache() if use_cache else None
+    templates = templates or get_form_templates()
+    summary_version = _summary_version(templates)
+
+    cached_summary = cache.get_summary(raw_text, summary_version) if cache else None
+    if cached_summary is not None:
+        metrics.inc("referral_summary_cache_hits_total")
+        return cached_summary
+
+    # Strip the template text of known form layouts
+    model_text = compress_text(raw_text, templates)
+
+    index = get_near_duplicate_index() if use_cache else None
+    previous = find_resubmission(index, model_text, summary_version) if index is not None else None
+    if previous is not None:
+        with timed("summarize_changes"):
+            summary = summarize_changes(previous, model_text, llm=llm)
+    else:
+        # Split the text into chunks
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        with timed("split"):
+            text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+            split_docs = text_splitter.split_text(model_text)
+
+        # Use LLM for summarization
+        with timed("summarize"):
+            summary = ReferralSummary.merge(summarize_chunks(split_docs, llm=llm, concurrency=concurrency))
+
+    # Format the final structured summary, with the referral criteria computed in code
+    formatted_summary = _finish_summary(summary, extract_features(raw_text))
+    if index is not None:
+        index.add(model_text, {"text": model_text, "summary": summary.model_dump(), "version": summary_version})
+    if cache:
+        cache.set_summary(raw_text, summary_version, formatted_summary)
+    return formatted_summary
+
+def iter_text_chunks(texts, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Splits a stream of page texts into chunks as the text arrives. A chunk is
+    emitted once text beyond it has been seen, so only about one chunk plus the
+    latest page is buffered at a time.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    buffer = ""
+    for text in texts:
+        buffer += text
+        if len(buffer) > chunk_size:
+            pieces = text_splitter.split_text(buffer)
+            yield from pieces[:-1]
+            buffer = pieces[-1] if pieces else ""
+    if buffer.strip():
+        yield from text_splitter.split_text(buffer)
+
+def summarize_stream(chunks, llm=None, concurrency=SUMMARY_CONCURRENCY):
+    """
+    Summarizes chunks as they are produced, with at most ``concurrency`` calls in flight.
+    The next chunk is only pulled once there is room, which holds back extraction
+    upstream. Results keep the chunk order.
+    """
+    extractor = _extractor(llm)
+    concurrency = max(1, concurrency)
     summaries = []
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for chunk in chunks:
+            if len(in_flight) >= concurrency:
+                summaries.append(_as_summary(in_flight.popleft().result()))
+            in_flight.append(executor.submit(extractor.invoke, build_summary_prompt(chunk)))
+        summaries.extend(_as_summary(future.result()) for future in in_flight)
+    return summaries
 
-    for chunk in split_docs:
-        prompt = f"""
-            This text is from a 2WW referral form for colorectal cancer. Extract the following details and format the output as a structured summary. Use the rules below to ensure accuracy:
-            
-            0. ** FIT Result
-            - If the FIT result is less than 10 ugHb/g, this will be recorded as Negative, while greater than or equal to 10 ugHb/g will be Positive.
-            
-            1. **FIT Positive Pathway Results Rules**:
-            - For each parameter in the FIT positive pathway results (Rectal bleeding, Change in bowel habit, Weight loss, Iron Deficiency Anaemia), check if it is mentioned in the text.
-            - If the parameter is present and has a FIT value (e.g., 'FIT result: ...'), mark it as 'Yes' and include the FIT value.
-            - If the parameter is present without a FIT value, mark it as 'Yes' but indicate 'FIT value: Not provided'.
-            - If the parameter is not mentioned in the text, mark it as 'No'.
-
-            2. **FIT Negative Pathway Results Rules**:
-            - For FIT-negative patients with Iron Deficiency Anaemia (IDA), extract the following:
-                - Indicate if the patient meets all criteria for referral:
-                - Aged 40 years or over: Yes/No
-                - FIT Negative: Yes/No (This is a "Yes" if FIT result is less than 10), FIT result: [Value/Not provided]
-                - Ferritin ≤45 µg/L: Yes/No (This is a "Yes" if Ferritin value ≤45µg/L), Ferritin: [Value/Not provided]
-                - Anaemia: Yes/No (Yes if Hb value less than 130 g/L (13 g/dL) in men or 115 g/L (11.5 g/dL) in non-menstruating women). Ensure that Hb values reported in g/L are compared to thresholds directly in g/L, Hb: [Value/Not provided].
-                
-            3. **General Formatting Rules**:
-            - Provide a structured summary with the fields below.
-            - Use the following format for the output:
-                - Name: [Value]
-                - Age: [Value]
-                - Gender: [Value]
-                - Address: [Value]
-                - Hospital number: [Value]
-                - GP declaration: [Value]
-                - GP/Doctor details and referral date: [Value]
-                - Symptoms: [Value]
-                - FIT result: [Value], FIT [Positive/Negative]
-                - FIT positive pathway results:
-                    - Rectal bleeding: [Yes/No], FIT result: [Value/Not provided]
-                    - Change in bowel habit: [Yes/No], FIT result: [Value/Not provided]
-                    - Weight loss: [Yes/No], FIT result: [Value/Not provided]
-                    - Iron Deficiency Anaemia: [Yes/No], FIT result: [Value/Not provided]
-                - FIT negative pathway results:
-                    - Meets criteria for referral: [Yes/No]
-                    - Aged 40 years or over: [Yes/No]
-                    - FIT Negative: [Yes/No], FIT result: [Value/Not provided]
-                    - Ferritin ≤45 µg/L: [Yes/No], Ferritin: [Value/Not provided]
-                    - Anaemia: [Yes/No], Hb: [Value/Not provided]
-                - WHO Performance status: [Value]
-                - Additional History: [Value]
-
-            Text:
-            {chunk}
-            """
-        response = llm.invoke(prompt)
-        result = response.content if hasattr(response, "content") else str(response)
-        summaries.append(result)
-
-    # Format the final structured summary
-    formatted_summary = "\n".join(summaries)
+def stream_summarize_pdf(data, use_cache=True, concurrency=SUMMARY_CONCURRENCY, llm=None, templates=None, workers=None):
+    """
+    Extracts and summarizes raw PDF bytes as one pipeline: pages are yielded as they
+    are extracted, chunks are cut as enough text builds up, and summarization starts
+    on the first chunk while later pages are still being OCR'd.
+
+    Memory stays bounded by ``2 * workers`` rendered OCR regions, about one chunk of
+    buffered text and ``concurrency`` chunks in flight, whatever the page count. The
+    full text is only kept when ``use_cache`` is set, to store it in the cache.
+
+    A resubmission is only recognised from the whole text, after every streamed chunk
+    has been sent to the model. So while the near-duplicate index (see ``near_duplicates``)
+    holds forms, the text is extracted first and ``summarize_text`` looks it up; streaming
+    then only applies to the forms that seed the index.
+    """
+    cache = get_referral_cache() if use_cache else None
+    pdf_hash = hash_bytes(data)
+    cached_text = cache.get_text(pdf_hash) if cache else None
+    if cached_text is not None:
+        return summarize_text(cached_text, use_cache=use_cache, concurrency=concurrency, llm=llm, templates=templates)
+
+    index = get_near_duplicate_index() if cache else None
+    if index is not None and len(index):
+        _, raw_text = extract_referral_text(data, use_cache=use_cache, workers=workers)
+        return summarize_text(raw_text, use_cache=use_cache, concurrency=concurrency, llm=llm, templates=templates)
+
+    templates = templates or get_form_templates()
+    page_texts = []
+    raw_features = PatientFeatures()
+
+    def model_texts(pdf_document):
+        nonlocal raw_features
+        layout = None
+        for page in iter_pages(pdf_document, workers=workers):
+            if cache:
+                page_texts.append(page.text)
+            raw_features = merge_features(raw_features, extract_features(page.text))
+            text = page.text
+            if templates is not None:
+                # The layout is recognised from the first page and applied to the rest
+                if page.page_number == 0:
+                    layout = templates.match(text, partial=True)
+                if layout is not None:
+                    text = templates.compress(text, layout).text + "\n"
+            yield text
+
+    import fitz  # PyMuPDF
+
+    try:
+        with fitz.open(stream=data, filetype="pdf") as pdf_document, timed("stream_summarize"):
+            summaries = summarize_stream(
+                iter_text_chunks(model_texts(pdf_document)), llm=llm, concurrency=concurrency
+            )
+    except Exception as e:
+        raise ValueError(f"Error processing the PDF file: {e}")
+
+    summary = ReferralSummary.merge(summaries)
+    formatted_summary = _finish_summary(summary, raw_features)
+    if cache:
+        raw_text = "".join(page_texts)
+        summary_version = _summary_version(templates)
+        cache.set_text(pdf_hash, raw_text)
+        cache.set_summary(raw_text, summary_version, formatted_summary)
+        # Index the form so a later resubmission can reuse this summary
+        if index is not None:
+            model_text = compress_text(raw_text, templates)
+            index.add(model_text, {"text": model_text, "summary": summary.model_dump(), "version": summary_version})
     return formatted_summary
 
+def summarize_fillable_form(data):
+    """
+    Summarizes a fillable PDF from its form widgets without OCR or an LLM call.
+    Returns None unless a field map covers enough of the summary fields (see ``form_fields``).
+    """
+    summary = summarize_form_fields(data)
+    if summary is None:
+        return None
+    return _finish_summary(summary, extract_features(summary.to_text()))
+
+def parse_and_summarize_pdf(file, use_cache=True, concurrency=SUMMARY_CONCURRENCY, streaming=STREAMING_ENABLED):
+    """
+    Parses and summarizes a PDF file with mixed content (selectable text and scanned images).
+    Accepts a file-like object (BytesIO). Fillable forms with a matching field map are
+    summarized straight from their widgets. Otherwise extracted text is cached by the
+    SHA-256 of the PDF bytes and summaries by the text hash plus prompt/model version.
+    Chunks are summarized concurrently; pass ``concurrency=1`` for the sequential path.
+    With ``streaming``, summarization overlaps extraction (see ``stream_summarize_pdf``).
+    """
+    data = file.read()
+    with timed("form_fields"):
+        summary = summarize_fillable_form(data)
+    if summary is not None:
+        metrics.inc("referral_form_field_summaries_total")
+        return summary
+
+    if streaming:
+        return stream_summarize_pdf(data, use_cache=use_cache, concurrency=concurrency)
+
+    # Step 1: Extract text
+    _, raw_text = extract_referral_text(data, use_cache=use_cache)
+
+    # Step 2: Split and summarize
+    return summarize_text(raw_text, use_cache=use_cache, concurrency=concurrency)
+
 
 # from langchain_openai import ChatOpenAI
 # from langchain_community.document_loaders import PDFPlumberLoader
@@ -0,0 +1,198 @@
+### GuidelineQuery Answer and Embedding Cache ###
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from cache import LRUCache
+from local_index import read_index_version
+
+QUERY_CACHE_ENABLED = os.environ.get("REFERRAL_QUERY_CACHE", "1") == "1"
+QUERY_CACHE_TTL = float(os.environ.get("REFERRAL_QUERY_CACHE_TTL", 24 * 3600))
+QUERY_CACHE_ITEMS = int(os.environ.get("REFERRAL_QUERY_CACHE_ITEMS", 1024))
+# Cosine similarity above which a stored answer is reused for a new query. Unset disables it.
+SEMANTIC_CACHE_THRESHOLD = os.environ.get("REFERRAL_SEMANTIC_CACHE_THRESHOLD")
+
+_query_caches = {}
+_query_caches_lock = threading.Lock()
+
+_COMPARATORS = {"<=": "≤", ">=": "≥", "=<": "≤", "=>": "≥"}
+# Terms that tell one pathway branch from the next; two queries differing in any of them
+# ("FIT ≥10" / "FIT <10", "positive" / "negative") never share an answer
+_BRANCH_TERM_RE = re.compile(
+    r"[<>≤≥]\s*\d+(?:\.\d+)?|\d+(?:\.\d+)?|\b(?:positive|negative|over|under|above|below|no|not|without)\b"
+)
+
+
+def normalize_query(text):
+    """Lowercases, strips quotes and surrounding punctuation, and collapses whitespace."""
+    text = text.strip().strip("\"'`").lower()
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" .?!,;:")
+
+
+def branch_terms(text):
+    """The thresholds, numbers and polarity words of a query, e.g. "FIT <= 10 negative" -> {"≤10", "negative"}."""
+    text = text.lower()
+    for comparator, symbol in _COMPARATORS.items():
+        text = text.replace(comparator, symbol)
+    return frozenset(term.replace(" ", "") for term in _BRANCH_TERM_RE.findall(text))
+
+
+def model_identity(llm):
+    """A short, stable id of a chat model and its settings, for keying answers it produced."""
+    params = getattr(llm, "_identifying_params", None) or {}
+    payload = json.dumps([type(llm).__name__, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embeddings client with an LRU cache keyed by normalized text."""
+
+    def __init__(self, embeddings, max_items=QUERY_CACHE_ITEMS, ttl=QUERY_CACHE_TTL):
+        self.embeddings = embeddings
+        self.cache = LRUCache(max_items, ttl)
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+    def embed_documents(self, texts):
+        keys = [normalize_query(text) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            for i, vector in zip(missing, self.embeddings.embed_documents([texts[i] for i in missing])):
+                vectors[i] = vector
+                self.cache.set(keys[i], vector)
+        return vectors
+
+
+class GuidelineQueryCache:
+    """
+    Caches GuidelineQuery answers for one guideline index.
+
+    Answers are keyed by the normalized query and a ``config`` string naming
+    what produced them (retriever mode and QA model), so tools configured
+    differently never serve each other's answers.
+
+    Lookups try an exact match first. When a ``semantic_threshold`` is set, a
+    query whose embedding has cosine similarity at or above the threshold with
+    a previously answered query of the same config reuses that answer, provided
+    both have the same thresholds, numbers and polarity words (``branch_terms``).
+    Entries expire after ``ttl`` seconds, the least recently used are evicted
+    beyond ``max_items``, and everything is dropped when the index version
+    changes (i.e. after re-ingestion).
+    """
+
+    def __init__(self, index_name, embeddings=None, semantic_threshold=None,
+                 max_items=QUERY_CACHE_ITEMS, ttl=QUERY_CACHE_TTL):
+        self.index_name = index_name
+        self.embeddings = embeddings
+        self.semantic_threshold = semantic_threshold
+        self.max_items = max_items
+        self.ttl = ttl
+        self.semantic_hits = 0
+        self.answers = LRUCache(max_items, ttl)
+        self._lock = threading.Lock()
+        self._keys = []
+        self._branch_terms = []
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._version = read_index_version(index_name)
+
+    def invalidate(self):
+        """Drops every cached answer."""
+        with self._lock:
+            self.answers.clear()
+            self._keys = []
+            self._branch_terms = []
+            self._vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def _check_version(self):
+        version = read_index_version(self.index_name)
+        if version != self._version:
+            self.invalidate()
+            self._version = version
+
+    def _embed(self, query):
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    @staticmethod
+    def _key(query, config):
+        return (config, normalize_query(query))
+
+    def get(self, query, config=""):
+        self._check_version()
+        key = self._key(query, config)
+        answer = self.answers.get(key)
+        if answer is not None or self.semantic_threshold is None or self.embeddings is None:
+            return answer
+
+        with self._lock:
+            keys, terms, vectors = self._keys, self._branch_terms, self._vectors
+        if not keys:
+            return None
+        query_terms = branch_terms(query)
+        scores = vectors @ self._embed(query)
+        for i in np.argsort(-scores):
+            if scores[i] < self.semantic_threshold:
+                break
+            if keys[i][0] != config or terms[i] != query_terms:
+                continue
+            # The nearest entry may have expired or been evicted from the answer cache
+            answer = self.answers.get(keys[i])
+            if answer is not None:
+                self.semantic_hits += 1
+                return answer
+        return None
+
+    def set(self, query, answer, config=""):
+        key = self._key(query, config)
+        self.answers.set(key, answer)
+        if self.semantic_threshold is None or self.embeddings is None:
+            return
+        vector = self._embed(query)
+        with self._lock:
+            if key in self._keys:
+                return
+            keys = self._keys + [key]
+            terms = self._branch_terms + [branch_terms(query)]
+            vectors = np.vstack([self._vectors.reshape(-1, len(vector)), vector])
+            if len(keys) > self.max_items:
+                keys, terms, vectors = keys[-self.max_items:], terms[-self.max_items:], vectors[-self.max_items:]
+            self._keys, self._branch_terms, self._vectors = keys, terms, vectors
+
+    def wrap(self, func, config=""):
+        """Returns ``func`` with its answers served from and stored in this cache under ``config``."""
+        def cached(query, *args, **kwargs):
+            answer = self.get(query, config)
+            if answer is None:
+                answer = func(query, *args, **kwargs)
+                self.set(query, answer, config)
+            return answer
+
+        cached.cache = self
+        return cached
+
+    def stats(self):
+        return {**self.answers.stats(), "semantic_hits": self.semantic_hits, "version": self._version}
+
+
+def get_query_cache(index_name, embeddings=None):
+    """Returns the process-wide answer cache for ``index_name``."""
+    with _query_caches_lock:
+        if index_name not in _query_caches:
+            threshold = float(SEMANTIC_CACHE_THRESHOLD) if SEMANTIC_CACHE_THRESHOLD else None
+            _query_caches[index_name] = GuidelineQueryCache(index_name, embeddings, threshold)
+        elif embeddings is not None and _query_caches[index_name].embeddings is None:
+            _query_caches[index_name].embeddings = embeddings
+        return _query_caches[index_name]
@@ -0,0 +1,363 @@
+### Process-Wide Rate Limiting, Backoff and Single-Flight for Model Calls ###
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+logger = logging.getLogger(__name__)
+
+# Set in the response metadata of a call answered by another caller's identical in-flight call
+SHARED_RESPONSE_KEY = "single_flight_shared"
+
+RATE_LIMIT_ENABLED = os.environ.get("REFERRAL_RATE_LIMIT", "1") == "1"
+# Retries of a rate-limited (429), overloaded (5xx) or dropped call
+RATE_LIMIT_RETRIES = int(os.environ.get("REFERRAL_RATE_LIMIT_RETRIES", 5))
+BACKOFF_BASE = float(os.environ.get("REFERRAL_BACKOFF_BASE", 1.0))
+BACKOFF_MAX = float(os.environ.get("REFERRAL_BACKOFF_MAX", 60.0))
+# Completion tokens reserved for a call whose model sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+
+# Requests and tokens per minute for each limiter; 0 means unlimited. Match these to
+# the account's tier, or set REFERRAL_<NAME>_RPM / REFERRAL_<NAME>_TPM.
+DEFAULT_LIMITS = {
+    "openai": (500, 200_000),
+    "openai_embeddings": (3_000, 1_000_000),
+}
+
+_RETRYABLE_ERRORS = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError",
+                     "ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout"}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """A rough token count (about four characters per token), good enough for budgeting."""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Allows ``per_minute`` units a minute, refilled continuously, with up to a minute's worth of burst."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """Seconds until ``amount`` units are available (0 if they are now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        # May go negative when a call used more tokens than were reserved for it
+        self.level -= amount
+
+
+class RateLimiter:
+    """
+    Coordinates every call to one backend: a request bucket and a token bucket,
+    plus a shared pause when the backend reports it is rate limiting us.
+    """
+
+    def __init__(self, name, rpm=0, tpm=0):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.paused_until = 0.0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.acquired = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.rate_limited = 0
+        self.retries = 0
+        self.deduplicated = 0
+        self._lock = threading.Condition()
+
+    def acquire(self, tokens=1):
+        """Blocks until one request and ``tokens`` tokens fit within the limits."""
+        start = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = max(
+                        self.paused_until - now,
+                        self.requests.delay(1, now) if self.requests else 0.0,
+                        self.tokens.delay(tokens, now) if self.tokens else 0.0,
+                    )
+                    if delay <= 0:
+                        break
+                    self._lock.wait(delay)
+                if self.requests:
+                    self.requests.take(1)
+                if self.tokens:
+                    self.tokens.take(tokens)
+            finally:
+                self.waiting -= 1
+            waited = time.monotonic() - start
+            self.acquired += 1
+            if waited > 0.001:
+                self.throttled += 1
+                self.wait_seconds += waited
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def record_usage(self, reserved, used):
+        """Charges (or refunds) the difference between reserved and actual tokens."""
+        if self.tokens and used:
+            with self._lock:
+                self.tokens.take(used - reserved)
+
+    def pause(self, seconds):
+        """Holds back every caller for ``seconds`` after the backend pushed back."""
+        with self._lock:
+            self.rate_limited += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self._lock.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "rate_limited": self.rate_limited,
+                "retries": self.retries,
+                "deduplicated": self.deduplicated,
+            }
+
+
+def get_rate_limiter(name):
+    """Returns the process-wide limiter for ``name``, configured from the environment."""
+    with _limiters_lock:
+        if name not in _limiters:
+            rpm, tpm = DEFAULT_LIMITS.get(name, (0, 0))
+            prefix = f"REFERRAL_{name.upper()}"
+            rpm = int(os.environ.get(f"{prefix}_RPM", rpm))
+            tpm = int(os.environ.get(f"{prefix}_TPM", tpm))
+            _limiters[name] = RateLimiter(name, rpm, tpm)
+        return _limiters[name]
+
+
+def rate_limit_stats():
+    """Queue depth, throttling and retry counters for every limiter in use."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
+
+
+class SingleFlight:
+    """Runs concurrent calls with the same key once; the other callers wait for and share its result."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        Returns:
+            tuple: ``(result, shared)``, where ``shared`` is True if another caller made the call.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result(), False
+
+
+def _is_retryable(error):
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return type(error).__name__ in _RETRYABLE_ERRORS
+
+
+def call_with_backoff(limiter, func, tokens=1, retries=RATE_LIMIT_RETRIES, base=BACKOFF_BASE, max_delay=BACKOFF_MAX):
+    """
+    Calls ``func`` within the limiter's budget, retrying retryable failures with
+    full-jitter exponential backoff. A 429 also pauses every other caller of the
+    limiter, so they stop adding load instead of each discovering the limit.
+    """
+    for attempt in range(retries + 1):
+        limiter.acquire(tokens)
+        try:
+            return func()
+        except Exception as e:
+            if attempt == retries or not _is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base * 2 ** attempt))
+            if type(e).__name__ == "RateLimitError" or getattr(e, "status_code", None) == 429:
+                limiter.pause(delay)
+            limiter.add(retries=1)
+            logger.warning("%s call failed (%s); retry %d in %.1fs", limiter.name, type(e).__name__, attempt + 1, delay)
+            time.sleep(delay)
+
+
+def _request_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _used_tokens(result):
+    usage = (result.llm_output or {}).get("token_usage") or {}
+    if usage.get("total_tokens"):
+        return usage["total_tokens"]
+    metadata = getattr(result.generations[0].message, "usage_metadata", None) if result.generations else None
+    return (metadata or {}).get("total_tokens", 0)
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """
+    Wraps a chat model so every call goes through the backend's rate limiter,
+    retries with jittered backoff, and shares identical in-flight calls.
+    """
+    inner: Any
+    limiter: Any
+    single_flight: Any = None
+    retries: int = RATE_LIMIT_RETRIES
+
+    @property
+    def _llm_type(self):
+        return self.inner._llm_type
+
+    @property
+    def _identifying_params(self):
+        return self.inner._identifying_params
+
+    def bind_tools(self, tools, **kwargs):
+        # Let the wrapped model format the tools, but keep its calls going through this wrapper
+        return self.bind(**self.inner.bind_tools(tools, **kwargs).kwargs)
+
+    def _reserve(self, messages):
+        completion = getattr(self.inner, "max_tokens", None) or DEFAULT_COMPLETION_TOKENS
+        return sum(estimate_tokens(str(message.content)) for message in messages) + completion
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        reserved = self._reserve(messages)
+
+        def call():
+            result = call_with_backoff(
+                self.limiter, lambda: self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                tokens=reserved, retries=self.retries,
+            )
+            self.limiter.record_usage(reserved, _used_tokens(result))
+            return result
+
+        if self.single_flight is None:
+            return call()
+        key = _request_key(self.inner._identifying_params, [(m.type, m.content) for m in messages], stop, kwargs)
+        result, shared = self.single_flight.do(key, call)
+        if shared:
+            self.limiter.add(deduplicated=1)
+            return _as_shared(result)
+        return result
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # Callers such as the agent stream by default; unless the wrapped model is set to stream
+        # (and can), make one whole call so it still gets backoff and single-flight
+        if not getattr(self.inner, "streaming", False) or type(self.inner)._stream is BaseChatModel._stream:
+            message = self._generate(messages, stop=stop, run_manager=run_manager, **kwargs).generations[0].message
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=message.content,
+                additional_kwargs=message.additional_kwargs,
+                tool_call_chunks=[
+                    {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": index}
+                    for index, call in enumerate(getattr(message, "tool_calls", None) or [])
+                ],
+                usage_metadata=getattr(message, "usage_metadata", None),
+                response_metadata=message.response_metadata,
+            ))
+            return
+        self.limiter.acquire(self._reserve(messages))
+        yield from self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+def _as_shared(result):
+    """
+    A copy of another caller's result, flagged so usage metrics count its tokens only once.
+    The leader's own result object is left untouched.
+    """
+    generations = [
+        ChatGeneration(
+            message=generation.message.model_copy(update={
+                "response_metadata": {**generation.message.response_metadata, SHARED_RESPONSE_KEY: True},
+            }),
+            generation_info=generation.generation_info,
+        )
+        for generation in result.generations
+    ]
+    return ChatResult(generations=generations, llm_output={**(result.llm_output or {}), SHARED_RESPONSE_KEY: True})
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """Wraps an embeddings client with the same limiter, backoff and single-flight as chat calls."""
+
+    def __init__(self, inner, limiter, single_flight=None, retries=RATE_LIMIT_RETRIES):
+        self.inner = inner
+        self.limiter = limiter
+        self.single_flight = single_flight
+        self.retries = retries
+
+    def embed_documents(self, texts):
+        tokens = sum(estimate_tokens(text) for text in texts)
+        return call_with_backoff(self.limiter, lambda: self.inner.embed_documents(texts), tokens, self.retries)
+
+    def embed_query(self, text):
+        def call():
+            return call_with_backoff(self.limiter, lambda: self.inner.embed_query(text), estimate_tokens(text), self.retries)
+
+        if self.single_flight is None:
+            return call()
+        result, shared = self.single_flight.do(_request_key("query", text), call)
+        if shared:
+            self.limiter.add(deduplicated=1)
+        return result
+
+
+_single_flight = SingleFlight()
+
+
+def rate_limited_chat_model(llm, name, retries=RATE_LIMIT_RETRIES):
+    """Wraps ``llm`` with the limiter ``name`` and the process-wide single-flight group."""
+    return RateLimitedChatModel(inner=llm, limiter=get_rate_limiter(name), single_flight=_single_flight, retries=retries)
+
+
+def rate_limited_embeddings(embeddings, name="openai_embeddings", retries=RATE_LIMIT_RETRIES):
+    """Wraps an embeddings client with the limiter ``name``. Returns it unchanged when disabled."""
+    if not RATE_LIMIT_ENABLED:
+        return embeddings
+    return RateLimitedEmbeddings(embeddings, get_rate_limiter(name), _single_flight, retries)
@@ -0,0 +1,109 @@
+### Structured Referral Summary ###
+import logging
+from typing import Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+logger = logging.getLogger(__name__)
+
+_MISSING = {"", "not provided", "not stated", "n/a", "na", "none", "unknown", "-"}
+
+# Free-text fields whose chunk values are combined; every other field keeps the first value given
+NARRATIVE_FIELDS = ("symptoms", "additional_history")
+SYMPTOM_FIELDS = ("rectal_bleeding", "change_in_bowel_habit", "weight_loss", "iron_deficiency_anaemia")
+
+
+class ReferralSummary(BaseModel):
+    """
+    The fields extracted from a 2WW colorectal referral form. A field is null when
+    the text does not give it. Values are copied as written, with their units;
+    thresholds are applied in ``criteria``, not by the model.
+    """
+    name: Optional[str] = Field(None, title="Name", description="Patient's forename and surname")
+    age: Optional[str] = Field(None, title="Age", description="Age in years, only if the form states it")
+    gender: Optional[str] = Field(None, title="Gender", description="Gender as written, e.g. M or F")
+    address: Optional[str] = Field(None, title="Address", description="Patient's address")
+    hospital_number: Optional[str] = Field(None, title="Hospital number", description="Hospital or NHS number")
+    gp_declaration: Optional[str] = Field(None, title="GP declaration", description="What the GP declares they have told the patient")
+    gp_details: Optional[str] = Field(
+        None, title="GP/Doctor details and referral date", description="Referring GP, practice and date of referral"
+    )
+    symptoms: Optional[str] = Field(None, title="Symptoms", description="Presenting symptoms ticked or described")
+    fit_result: Optional[str] = Field(None, title="FIT result", description="FIT value with its unit, e.g. '120 ugHb/g'")
+    rectal_bleeding: Optional[bool] = Field(None, title="Rectal bleeding", description="FIT positive pathway box ticked or described")
+    change_in_bowel_habit: Optional[bool] = Field(
+        None, title="Change in bowel habit", description="FIT positive pathway box ticked or described"
+    )
+    weight_loss: Optional[bool] = Field(None, title="Weight loss", description="FIT positive pathway box ticked or described")
+    iron_deficiency_anaemia: Optional[bool] = Field(
+        None, title="Iron Deficiency Anaemia", description="FIT positive pathway box ticked or described"
+    )
+    ferritin: Optional[str] = Field(None, title="Ferritin", description="Ferritin value with its unit, e.g. '4 µg/L'")
+    hb: Optional[str] = Field(None, title="Hb", description="Haemoglobin value with its unit, e.g. '90 g/L'")
+    who_performance_status: Optional[str] = Field(None, title="WHO Performance status", description="WHO grade 0-4")
+    additional_history: Optional[str] = Field(None, title="Additional History", description="Other relevant history")
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def _missing_as_none(cls, value):
+        if isinstance(value, str):
+            value = value.strip()
+            if value.lower() in _MISSING:
+                return None
+        return value
+
+    @classmethod
+    def labels(cls):
+        """Maps each printed label (e.g. "Hospital number") to its field name."""
+        return {field.title: name for name, field in cls.model_fields.items()}
+
+    @classmethod
+    def from_labels(cls, values):
+        """Builds a summary from values keyed by printed label, ignoring labels it has no field for."""
+        labels = cls.labels()
+        return cls(**{labels[label]: value for label, value in values.items() if label in labels})
+
+    @classmethod
+    def merge(cls, summaries):
+        """
+        Merges per-chunk summaries field by field: a ticked symptom on any chunk counts,
+        free-text fields keep every distinct value, and other fields keep the first
+        value given (the patient details are on the first page).
+        """
+        merged = {}
+        for name in cls.model_fields:
+            values = [getattr(summary, name) for summary in summaries if getattr(summary, name) is not None]
+            if not values:
+                continue
+            if name in SYMPTOM_FIELDS:
+                merged[name] = any(values)
+            elif name in NARRATIVE_FIELDS:
+                merged[name] = "; ".join(dict.fromkeys(values))
+            else:
+                if len(set(values)) > 1:
+                    logger.debug("Chunks disagree on %s: %s; keeping the first", name, values)
+                merged[name] = values[0]
+        return cls(**merged)
+
+    def updated(self, changes):
+        """Returns a copy with every field ``changes`` sets replacing this summary's value."""
+        return self.model_copy(update=changes.model_dump(exclude_none=True))
+
+    def to_text(self):
+        """
+        The compact form passed to the recommendation engines: one "- Label: value"
+        line per field given, with the ticked symptoms on one line.
+        """
+        lines = []
+        for name, field in type(self).model_fields.items():
+            value = getattr(self, name)
+            if name in SYMPTOM_FIELDS:
+                continue
+            if value is not None:
+                lines.append(f"- {field.title}: {value}")
+            if name == "fit_result":
+                flags = {type(self).model_fields[symptom].title: getattr(self, symptom) for symptom in SYMPTOM_FIELDS}
+                ticked = [f"{title}: Yes" for title, flag in flags.items() if flag]
+                if ticked or any(flag is False for flag in flags.values()):
+                    lines.append(f"- FIT positive pathway symptoms: {', '.join(ticked) or 'None'}")
+        return "\n".join(lines)
@@ -0,0 +1,202 @@
+### Record/Replay Stand-Ins for Offline Benchmarks ###
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from local_index import LocalVectorIndex
+
+
+def estimate_tokens(text):
+    """A rough token count (about four characters per token) for recorded and synthetic calls."""
+    return max(1, len(text) // 4)
+
+
+def _key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CallStats:
+    """Counts model and embedding calls made through the stand-ins."""
+
+    def __init__(self):
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.embedding_calls = 0
+        self.embedded_texts = 0
+        self.vector_searches = 0
+        self.replay_misses = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: value for name, value in vars(self).items() if not name.startswith("_")}
+
+
+class ReplayStore:
+    """Recorded responses keyed by a hash of the request, persisted as one JSON file."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+
+
+def synthetic_response(prompt):
+    """
+    A plausible response for prompts with no recording, so the pipeline runs end to end.
+
+    ReAct prompts get one GuidelineQuery action followed by a final answer;
+    summary prompts get the summary fields as JSON; anything else gets a short guideline answer.
+    """
+    if "Action Input:" in prompt:
+        if "Observation:" in prompt.split("Begin!")[-1]:
+            return "Thought: I now know the final answer\nFinal Answer: Refer on the LGI 2WW pathway for colonoscopy."
+        return "Thought: I should check the guideline.\nAction: GuidelineQuery\nAction Input: FIT positive rectal bleeding next steps"
+    if "2WW referral form" in prompt:
+        return json.dumps({
+            "name": "Synthetic Patient",
+            "age": "70",
+            "gender": "M",
+            "symptoms": "Rectal bleeding",
+            "fit_result": "120 ugHb/g",
+            "rectal_bleeding": True,
+            "ferritin": None,
+            "hb": None,
+            "who_performance_status": "0",
+        })
+    return "The guideline recommends an urgent LGI 2WW referral for FIT ≥10 µgHb/g."
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    A chat model that replays recorded responses after a simulated latency.
+
+    In record mode every call goes to ``inner`` and the response is stored.
+    In replay mode a missing recording falls back to ``synthetic_response``.
+    """
+
+    store: ReplayStore
+    stats: CallStats
+    inner: Optional[BaseChatModel] = None
+    record: bool = False
+    latency: float = 0.0
+    name_tag: str = "default"
+
+    @property
+    def _llm_type(self):
+        return "replay-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(message.content) for message in messages)
+        key = _key("chat", self.name_tag, prompt, stop)
+
+        if self.record and self.inner is not None:
+            text = self.inner.invoke(messages, stop=stop).content
+            self.store.set(key, text)
+        else:
+            text = self.store.get(key)
+            if text is None:
+                self.stats.add(replay_misses=1)
+                text = synthetic_response(prompt)
+            if self.latency:
+                time.sleep(self.latency)
+
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        self.stats.add(llm_calls=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        message = AIMessage(content=text, usage_metadata={
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class ReplayEmbeddings(Embeddings):
+    """
+    Embeddings replayed from recordings, with a deterministic hash-seeded
+    vector for texts that were never recorded.
+    """
+
+    def __init__(self, store, stats, inner=None, record=False, latency=0.0, size=1536):
+        self.store = store
+        self.stats = stats
+        self.inner = inner
+        self.record = record
+        self.latency = latency
+        self.size = size
+
+    def _vector(self, text):
+        key = _key("embedding", text)
+        vector = self.store.get(key)
+        if vector is None:
+            self.stats.add(replay_misses=1)
+            seed = int(key[:8], 16)
+            vector = np.random.default_rng(seed).standard_normal(self.size).tolist()
+        return vector
+
+    def embed_documents(self, texts):
+        self.stats.add(embedding_calls=1, embedded_texts=len(texts))
+        if self.record and self.inner is not None:
+            vectors = self.inner.embed_documents(texts)
+            for text, vector in zip(texts, vectors):
+                self.store.set(_key("embedding", text), vector)
+            return vectors
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class ReplayVectorStore(LocalVectorIndex):
+    """A local index that sleeps for ``latency`` seconds per search to mimic a hosted index."""
+
+    def __init__(self, path, embedding, stats, latency=0.0):
+        super().__init__(path, embedding)
+        self.stats = stats
+        self.latency = latency
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        self.stats.add(vector_searches=1)
+        if self.latency:
+            time.sleep(self.latency)
+        return super().similarity_search_by_vector_with_score(embedding, k)
@@ -0,0 +1,158 @@
+"""
+Referral analysis service: an HTTP API over the persistent job queue.
+
+    POST /jobs               Body: the PDF (Content-Type: application/pdf), optional
+                             ?filename=. Returns 202 and the job, with its "id".
+    GET  /jobs/<id>          The job: status (queued, running, done, failed), stage,
+                             timestamps, and its result or error once finished.
+    GET  /jobs/<id>/events   Server-sent events: the job each time its status or
+                             stage changes, ending once it has finished.
+    GET  /health             Jobs per status and the number of workers.
+    GET  /metrics            Prometheus metrics (see metrics.py).
+
+Several service processes can share one queue database (REFERRAL_JOB_DB) to add
+workers; set REFERRAL_SERVICE_URL for the Streamlit app to use the service.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python src/referral_agent/service.py --port 8000 --workers 4
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from job_queue import FINISHED, JOB_DB_PATH, JOB_WORKERS, JobQueue, WorkerPool
+
+logger = logging.getLogger(__name__)
+
+SERVICE_HOST = os.environ.get("REFERRAL_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("REFERRAL_SERVICE_PORT", 8000))
+MAX_UPLOAD_BYTES = int(os.environ.get("REFERRAL_MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+# How often an event stream checks its job for changes, and sends a keep-alive when idle
+EVENT_POLL_INTERVAL = 0.5
+EVENT_KEEPALIVE_SECONDS = 15
+
+_JOB_PATH_RE = re.compile(r"^/jobs/([0-9a-f]{32})(/events)?$")
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Routes the API requests; ``server.queue`` and ``server.pool`` are set by ``make_server``."""
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send_json(status, {"error": message})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/jobs":
+            self._error(404, "Not found")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_UPLOAD_BYTES:
+            self._error(413, f"PDF larger than {MAX_UPLOAD_BYTES} bytes")
+            self.close_connection = True
+            return
+        data = self.rfile.read(length)
+        if not data.startswith(b"%PDF"):
+            self._error(400, "Request body must be a PDF")
+            return
+        filename = parse_qs(url.query).get("filename", [None])[0]
+        self._send_json(202, self.server.queue.submit(data, filename=filename))
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send_json(200, {"jobs": self.server.queue.counts(), "workers": self.server.pool.workers})
+            return
+        if path == "/metrics":
+            from metrics import metrics
+
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        match = _JOB_PATH_RE.match(path)
+        job = self.server.queue.get(match.group(1)) if match else None
+        if job is None:
+            self._error(404, "No such job")
+        elif match.group(2):
+            self._stream_events(job)
+        else:
+            self._send_json(200, job)
+
+    def _stream_events(self, job):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        last_state, last_sent = None, 0.0
+        try:
+            while True:
+                state = (job["status"], job["stage"])
+                if state != last_state:
+                    self.wfile.write(f"event: job\ndata: {json.dumps(job)}\n\n".encode("utf-8"))
+                    last_state, last_sent = state, time.monotonic()
+                elif time.monotonic() - last_sent > EVENT_KEEPALIVE_SECONDS:
+                    self.wfile.write(b": keep-alive\n\n")
+                    last_sent = time.monotonic()
+                self.wfile.flush()
+                if job["status"] in FINISHED:
+                    return
+                time.sleep(EVENT_POLL_INTERVAL)
+                job = self.server.queue.get(job["id"])
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug("Event stream for job %s closed by the client", job["id"])
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def make_server(host=SERVICE_HOST, port=SERVICE_PORT, queue=None, workers=JOB_WORKERS):
+    """Builds the HTTP server and starts its worker pool. Call ``serve_forever`` to serve."""
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.queue = queue or JobQueue()
+    server.pool = WorkerPool(server.queue, workers=workers).start()
+    return server
+
+
+### Example Usage ###
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve referral analysis jobs over HTTP.")
+    parser.add_argument("--host", default=SERVICE_HOST, help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="Jobs processed at once by this process")
+    parser.add_argument("--db", default=JOB_DB_PATH, help="Queue database, shared by every service process")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    from warmup import start_warm_up
+
+    # Build the recommender and model clients before the first job arrives
+    start_warm_up()
+    server = make_server(args.host, args.port, JobQueue(args.db), args.workers)
+    logger.info("Serving referral jobs on http://%s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.stop()
@@ -0,0 +1,82 @@
+### Client for the Referral Analysis Service ###
+import json
+import os
+
+from job_queue import FINISHED
+from llm_backends import http_session
+
+# Base URL of a running service.py; unset means the app runs the pipeline itself
+SERVICE_URL = os.environ.get("REFERRAL_SERVICE_URL")
+SERVICE_TIMEOUT = float(os.environ.get("REFERRAL_SERVICE_TIMEOUT", 30))
+
+
+class ServiceError(RuntimeError):
+    """The service rejected a request or a job failed."""
+
+
+class ServiceClient:
+    """Submits referrals to the service and follows their jobs, over a pooled keep-alive session."""
+
+    def __init__(self, base_url=SERVICE_URL, timeout=SERVICE_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = http_session(self.base_url)
+
+    def _check(self, response):
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("error", response.text)
+            except ValueError:
+                message = response.text
+            raise ServiceError(f"Service error {response.status_code}: {message}")
+        return response.json()
+
+    def submit(self, data, filename=None):
+        """
+        Queues a PDF. Submitting a PDF the service already has returns its existing job.
+
+        Returns:
+            dict: The job, with its "id" and "status".
+        """
+        response = self.session.post(
+            f"{self.base_url}/jobs", data=data, params={"filename": filename} if filename else None,
+            headers={"Content-Type": "application/pdf"}, timeout=self.timeout,
+        )
+        return self._check(response)
+
+    def get(self, job_id):
+        return self._check(self.session.get(f"{self.base_url}/jobs/{job_id}", timeout=self.timeout))
+
+    def watch(self, job_id):
+        """Yields the job each time its status or stage changes, until it has finished."""
+        with self.session.get(f"{self.base_url}/jobs/{job_id}/events", stream=True,
+                              timeout=(self.timeout, None)) as response:
+            if response.status_code >= 400:
+                self._check(response)
+            for line in response.iter_lines(decode_unicode=True):
+                if line and line.startswith("data:"):
+                    job = json.loads(line[len("data:"):])
+                    yield job
+                    if job["status"] in FINISHED:
+                        return
+
+    def wait(self, job_id, on_update=None):
+        """
+        Follows a job until it finishes, calling ``on_update(job)`` on each change.
+
+        Returns:
+            dict: The result (summary, intermediate steps, final answer).
+
+        Raises:
+            ServiceError: If the job failed.
+        """
+        job = None
+        for job in self.watch(job_id):
+            if on_update:
+                on_update(job)
+        if job is None or job["status"] not in FINISHED:
+            # The stream ended early (e.g. the service restarted); fall back to one poll
+            job = self.get(job_id)
+        if job["status"] != "done":
+            raise ServiceError(job.get("error") or f"Job {job_id} is {job['status']}")
+        return job["result"]
@@ -0,0 +1,249 @@
+### Structured Agent Trace Collection ###
+import threading
+import time
+from dataclasses import dataclass, field
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from metrics import metrics, record_llm_call
+from rate_limit import SHARED_RESPONSE_KEY
+
+
+@dataclass
+class TraceStep:
+    """One Thought/Action/Observation round of the agent."""
+    started_at: float
+    log: str = ""  # The model's Thought/Action/Action Input text
+    tool: str = None
+    tool_input: str = None
+    observation: str = None
+    llm_seconds: float = 0.0
+    tool_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    error: str = None
+
+
+@dataclass
+class Trace:
+    steps: list = field(default_factory=list)
+    final_answer: str = None
+    final_log: str = ""
+    started_at: float = field(default_factory=time.time)
+    finished_at: float = None
+
+    @property
+    def total_tokens(self):
+        return sum(step.prompt_tokens + step.completion_tokens for step in self.steps)
+
+
+def _token_usage(response):
+    """Reads prompt/completion token counts from an LLMResult, whichever way the model reports them."""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            prompt_tokens += metadata.get("input_tokens", 0)
+            completion_tokens += metadata.get("output_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+class TraceCollector(BaseCallbackHandler):
+    """
+    Records an agent run through LangChain callbacks.
+
+    Attach a fresh collector to each invocation via
+    ``agent_executor.invoke(..., config={"callbacks": [collector]})``.
+    Because nothing global is touched, concurrent invocations in other
+    threads or tasks keep separate traces.
+    """
+
+    def __init__(self):
+        self.trace = Trace()
+        self._lock = threading.Lock()
+        self._llm_started = {}
+        self._tool_started = {}
+        self._parents = {}
+        self._tool_llm_runs = set()
+        self._pending = None  # LLM timings/tokens waiting for the action they produced
+
+    def _current_step(self):
+        if self._pending is None:
+            self._pending = TraceStep(started_at=time.time())
+        return self._pending
+
+    def _inside_tool(self, run_id):
+        while run_id is not None:
+            if run_id in self._tool_started:
+                return True
+            run_id = self._parents.get(run_id)
+        return False
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            if self._inside_tool(parent_run_id):
+                # A model call made by a tool (e.g. RetrievalQA); its time is part of the tool's
+                self._tool_llm_runs.add(run_id)
+                return
+            self._llm_started[run_id] = time.perf_counter()
+            self._current_step()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.on_llm_start(serialized, [], run_id=run_id, **kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            prompt_tokens, completion_tokens = _token_usage(response)
+            if run_id in self._tool_llm_runs:
+                self._tool_llm_runs.discard(run_id)
+                step = self.trace.steps[-1] if self.trace.steps else self._current_step()
+            else:
+                step = self._current_step()
+                step.llm_seconds += time.perf_counter() - self._llm_started.pop(run_id, time.perf_counter())
+            step.prompt_tokens += prompt_tokens
+            step.completion_tokens += completion_tokens
+
+    def on_agent_action(self, action, *, run_id, **kwargs):
+        with self._lock:
+            step = self._current_step()
+            step.log = action.log
+            step.tool = action.tool
+            step.tool_input = action.tool_input if isinstance(action.tool_input, str) else str(action.tool_input)
+            self.trace.steps.append(step)
+            self._pending = None
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            self._tool_started[run_id] = time.perf_counter()
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        with self._lock:
+            seconds = time.perf_counter() - self._tool_started.pop(run_id, time.perf_counter())
+            if self.trace.steps:
+                step = self.trace.steps[-1]
+                step.observation = str(getattr(output, "content", output))
+                step.tool_seconds += seconds
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._tool_started.pop(run_id, None)
+            if self.trace.steps:
+                self.trace.steps[-1].error = str(error)
+
+    def on_agent_finish(self, finish, *, run_id, **kwargs):
+        with self._lock:
+            if self._pending is not None:
+                # The final LLM call produced the answer rather than an action
+                self._pending.log = finish.log
+                self.trace.steps.append(self._pending)
+                self._pending = None
+            self.trace.final_log = finish.log
+            self.trace.final_answer = finish.return_values.get("output")
+            self.trace.finished_at = time.time()
+
+    def render_text(self):
+        """Renders the trace in the agent's Thought/Action/Observation layout."""
+        lines = []
+        for number, step in enumerate(self.trace.steps, start=1):
+            stats = f"[step {number}: LLM {step.llm_seconds:.2f}s"
+            if step.tool:
+                stats += f", {step.tool} {step.tool_seconds:.2f}s"
+            stats += f", {step.prompt_tokens + step.completion_tokens} tokens]"
+            lines.append(stats)
+            lines.append(step.log.strip())
+            if step.observation is not None:
+                lines.append(f"Observation: {step.observation.strip()}")
+            if step.error:
+                lines.append(f"Error: {step.error}")
+            lines.append("")
+        if self.trace.finished_at:
+            lines.append(
+                f"Finished in {self.trace.finished_at - self.trace.started_at:.2f}s "
+                f"using {self.trace.total_tokens} tokens."
+            )
+        return "\n".join(lines)
+
+
+def _shared(response):
+    """True if the call was answered by another caller's identical in-flight call (see rate_limit)."""
+    if (response.llm_output or {}).get(SHARED_RESPONSE_KEY):
+        return True
+    return any(
+        (getattr(getattr(generation, "message", None), "response_metadata", None) or {}).get(SHARED_RESPONSE_KEY)
+        for generations in response.generations for generation in generations
+    )
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Records latency, tokens and cost of every call of the chat model it is attached to."""
+
+    def __init__(self, stage, model):
+        self.stage = stage
+        self.model = model
+        self._started = {}
+
+    @property
+    def ignore_chain(self):
+        return True
+
+    @property
+    def ignore_agent(self):
+        return True
+
+    @property
+    def ignore_retriever(self):
+        return True
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        seconds = time.perf_counter() - self._started.pop(run_id, time.perf_counter())
+        record_llm_call(self.stage, self.model, seconds, *_token_usage(response), shared=_shared(response))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+        metrics.inc("referral_llm_errors_total", stage=self.stage, model=self.model, error=type(error).__name__)
+
+
+class RetrieverMetricsHandler(BaseCallbackHandler):
+    """Records the latency of every run of the retriever it is attached to."""
+
+    def __init__(self, index, retriever):
+        self.index = index
+        self.retriever = retriever
+        self._started = {}
+
+    @property
+    def ignore_llm(self):
+        return True
+
+    @property
+    def ignore_chat_model(self):
+        return True
+
+    @property
+    def ignore_chain(self):
+        return True
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        seconds = time.perf_counter() - self._started.pop(run_id, time.perf_counter())
+        metrics.observe("referral_retrieval_seconds", seconds, index=self.index, retriever=self.retriever)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
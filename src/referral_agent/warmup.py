@@ -0,0 +1,93 @@
+### Background Warm-up of Lazy Dependencies ###
+import importlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Set to "0" to skip the warm-up and load everything on the first request instead
+WARMUP_ENABLED = os.environ.get("REFERRAL_WARMUP", "1") == "1"
+# Also build the recommendation engine (opens the vector index) during warm-up
+WARMUP_RECOMMENDER = os.environ.get("REFERRAL_WARMUP_RECOMMENDER", "1") == "1"
+
+# Heavy third-party modules the pipeline imports on first use
+HEAVY_MODULES = [
+    "fitz",
+    "pytesseract",
+    "PIL.Image",
+    "langchain_core.callbacks",
+    "langchain.text_splitter",
+    "langchain_openai",
+    "langchain.agents",
+    "langchain.chains",
+]
+
+_thread = None
+_thread_lock = threading.Lock()
+_report = {}
+
+
+def _step(name, func):
+    start = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        # A missing optional dependency or an unreachable service must not stop the app
+        # from starting; the first request will raise the error where it can be handled.
+        logger.warning("Warm-up step %s failed: %s", name, e)
+        _report[name] = None
+    else:
+        _report[name] = time.perf_counter() - start
+
+
+def warm_up(recommender=WARMUP_RECOMMENDER):
+    """
+    Imports the heavy dependencies and builds the shared clients ahead of the first request.
+
+    Every step is one the first request would otherwise pay for; each is cached
+    process-wide, so running it again is cheap.
+
+    Args:
+        recommender (bool): Also build the recommendation engine from
+            ``initialize_agent.get_recommender`` (connects to the vector index).
+
+    Returns:
+        dict: Seconds taken by each step, or None for steps that failed.
+    """
+    from decision_table import get_decision_table
+    from form_fields import load_field_maps
+    from form_templates import get_form_templates
+    from initialize_agent import get_recommender
+    from parse_and_summarize_pdf import get_summary_extractor
+
+    for module in HEAVY_MODULES:
+        _step(f"import {module}", lambda: importlib.import_module(module))
+    _step("decision table", get_decision_table)
+    _step("form templates", get_form_templates)
+    _step("field maps", load_field_maps)
+    _step("summary llm", get_summary_extractor)
+    if recommender:
+        _step("recommender", get_recommender)
+    return dict(_report)
+
+
+def start_warm_up(recommender=WARMUP_RECOMMENDER):
+    """
+    Runs ``warm_up`` once per process on a daemon thread and returns the thread.
+    Returns None when REFERRAL_WARMUP is disabled.
+    """
+    global _thread
+    if not WARMUP_ENABLED:
+        return None
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=warm_up, args=(recommender,), name="referral-warm-up", daemon=True)
+            _thread.start()
+        return _thread
+
+
+def warm_up_report():
+    """Seconds taken by each warm-up step completed so far."""
+    return dict(_report)
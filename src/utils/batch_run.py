@@ -0,0 +1,252 @@
+"""
+Batch processing of 2WW referral forms.
+
+Extraction (PyMuPDF + OCR) runs on a pool of worker processes. Extracted text is
+handed through a bounded queue to a pool of threads that run summarization and
+guideline recommendations. Results are appended to a JSONL file (and optionally
+a CSV file) as each form finishes, so a rerun skips forms that already succeeded.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python src/utils/batch_run.py sample_forms --output results.jsonl
+    PYTHONPATH=src/referral_agent python src/utils/batch_run.py manifest.txt --csv results.csv
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import queue
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+from cache import hash_bytes
+from initialize_agent import initialize_recommender
+from guideline_recommendations import get_guideline_recommendations
+from parse_and_summarize_pdf import extract_referral_text, summarize_fillable_form, summarize_text
+from metrics import dump_metrics, metrics, summary as metrics_summary
+from rate_limit import rate_limit_stats
+
+CSV_FIELDS = ["file", "pdf_hash", "status", "summary", "recommendation", "error",
+              "extract_seconds", "summarize_seconds", "recommend_seconds"]
+
+_DONE = object()
+
+
+def collect_inputs(source):
+    """Returns the PDF paths in a directory, or listed one per line in a manifest file."""
+    source = Path(source)
+    if source.is_dir():
+        return sorted(str(path) for path in source.rglob("*.pdf"))
+    with open(source, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def load_finished(output_path):
+    """Returns the files already processed successfully according to the JSONL output."""
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A partially written line from an interrupted run
+            if record.get("status") == "ok":
+                finished.add(record["file"])
+    return finished
+
+
+def extract_form(path):
+    """
+    Extraction stage. Runs in a worker process, so OCR runs in-process there.
+    Fillable forms with a matching field map come back already summarized.
+    """
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        data = f.read()
+    summary = summarize_fillable_form(data)
+    if summary is not None:
+        return path, hash_bytes(data), None, summary, time.perf_counter() - start
+    pdf_hash, raw_text = extract_referral_text(data, workers=1)
+    return path, pdf_hash, raw_text, None, time.perf_counter() - start
+
+
+def percentile(values, pct):
+    """Returns the ``pct`` percentile of ``values`` using nearest-rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class ResultWriter:
+    """Appends one record per form to JSONL (and optionally CSV), flushing each line."""
+
+    def __init__(self, jsonl_path, csv_path=None):
+        self._lock = threading.Lock()
+        self._jsonl = open(jsonl_path, "a", encoding="utf-8")
+        self._csv_file = None
+        if csv_path:
+            new_file = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+            self._csv_file = open(csv_path, "a", encoding="utf-8", newline="")
+            self._csv = csv.DictWriter(self._csv_file, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            if new_file:
+                self._csv.writeheader()
+
+    def write(self, record):
+        with self._lock:
+            self._jsonl.write(json.dumps(record) + "\n")
+            self._jsonl.flush()
+            if self._csv_file:
+                self._csv.writerow(record)
+                self._csv_file.flush()
+
+    def close(self):
+        self._jsonl.close()
+        if self._csv_file:
+            self._csv_file.close()
+
+
+def run_batch(paths, output_path, csv_path=None, cpu_workers=None, io_workers=4, queue_size=8):
+    """
+    Processes ``paths`` through the extraction and LLM stages.
+
+    Returns:
+        dict: Per-stage latencies (seconds), counts and total wall time.
+    """
+    cpu_workers = cpu_workers or os.cpu_count() or 1
+    finished = load_finished(output_path)
+    pending_paths = [path for path in paths if path not in finished]
+
+    stats = {"extract": [], "summarize": [], "recommend": [], "ok": 0, "error": 0,
+             "skipped": len(paths) - len(pending_paths)}
+    stats_lock = threading.Lock()
+    handoff = queue.Queue(maxsize=queue_size)
+    writer = ResultWriter(output_path, csv_path)
+    agent_executor = initialize_recommender()
+
+    def record_result(record, status):
+        record["status"] = status
+        writer.write(record)
+        with stats_lock:
+            stats[status] += 1
+
+    def llm_stage():
+        while True:
+            item = handoff.get()
+            if item is _DONE:
+                return
+            path, pdf_hash, raw_text, summary, extract_seconds = item
+            # Extraction ran in a worker process, so its timing is recorded here
+            metrics.observe("referral_stage_seconds", extract_seconds, stage="extract")
+            record = {"file": path, "pdf_hash": pdf_hash, "extract_seconds": extract_seconds}
+            try:
+                start = time.perf_counter()
+                record["summary"] = summary if summary is not None else summarize_text(raw_text)
+                record["summarize_seconds"] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                record["intermediate_steps"], record["recommendation"] = get_guideline_recommendations(
+                    record["summary"], agent_executor
+                )
+                record["recommend_seconds"] = time.perf_counter() - start
+            except Exception as e:
+                record["error"] = str(e)
+                record_result(record, "error")
+                continue
+            with stats_lock:
+                stats["extract"].append(extract_seconds)
+                stats["summarize"].append(record["summarize_seconds"])
+                stats["recommend"].append(record["recommend_seconds"])
+            record_result(record, "ok")
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=llm_stage, daemon=True) for _ in range(io_workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        with ProcessPoolExecutor(max_workers=cpu_workers) as pool:
+            remaining = iter(pending_paths)
+            in_flight = {}
+            # Keep at most 2 forms per CPU worker in flight so memory stays bounded
+            while True:
+                while len(in_flight) < 2 * cpu_workers:
+                    path = next(remaining, None)
+                    if path is None:
+                        break
+                    in_flight[pool.submit(extract_form, path)] = path
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = in_flight.pop(future)
+                    try:
+                        handoff.put(future.result())  # Blocks while the LLM stage is behind
+                    except Exception as e:
+                        record_result({"file": path, "error": str(e)}, "error")
+    finally:
+        for _ in threads:
+            handoff.put(_DONE)
+        for thread in threads:
+            thread.join()
+        writer.close()
+
+    stats["wall_seconds"] = time.perf_counter() - started
+    stats["rate_limits"] = rate_limit_stats()
+    stats["metrics"] = metrics_summary()
+    return stats
+
+
+def print_report(stats):
+    processed = stats["ok"] + stats["error"]
+    wall = stats["wall_seconds"]
+    print(f"Processed {processed} forms ({stats['ok']} ok, {stats['error']} failed, "
+          f"{stats['skipped']} already done) in {wall:.1f}s")
+    if processed and wall:
+        print(f"Throughput: {processed / wall:.2f} forms/s ({processed / wall * 3600:.0f} forms/hour)")
+    for stage in ("extract", "summarize", "recommend"):
+        values = stats[stage]
+        if values:
+            print(f"{stage:>10}: mean {statistics.mean(values):.2f}s  p50 {percentile(values, 50):.2f}s  "
+                  f"p90 {percentile(values, 90):.2f}s  p99 {percentile(values, 99):.2f}s")
+    totals = stats.get("metrics")
+    if totals:
+        print(f"LLM: {totals['llm_calls']} calls, {totals['input_tokens']} input / {totals['output_tokens']} output "
+              f"tokens, ${totals['cost_usd']:.2f}")
+    for name, limiter in stats.get("rate_limits", {}).items():
+        print(f"{name:>10}: {limiter['acquired']} calls, {limiter['throttled']} throttled "
+              f"({limiter['wait_seconds']:.1f}s waiting, max queue {limiter['max_waiting']}), "
+              f"{limiter['rate_limited']} rate limited, {limiter['retries']} retries, "
+              f"{limiter['deduplicated']} shared")
+
+
+### Example Usage ###
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process a backlog of 2WW referral forms.")
+    parser.add_argument("source", help="Directory of PDFs or a manifest file with one path per line")
+    parser.add_argument("--output", default="referral_results.jsonl", help="JSONL results file (appended to)")
+    parser.add_argument("--csv", help="Optional CSV results file (appended to)")
+    parser.add_argument("--cpu-workers", type=int, default=None, help="Extraction processes")
+    parser.add_argument("--io-workers", type=int, default=4, help="Concurrent summarization/recommendation threads")
+    parser.add_argument("--queue-size", type=int, default=8, help="Extracted forms buffered between stages")
+    parser.add_argument("--metrics", default=None, help="Write Prometheus-format metrics to this file when done")
+    args = parser.parse_args()
+
+    stats = run_batch(
+        collect_inputs(args.source),
+        args.output,
+        csv_path=args.csv,
+        cpu_workers=args.cpu_workers,
+        io_workers=args.io_workers,
+        queue_size=args.queue_size,
+    )
+    print_report(stats)
+    if args.metrics:
+        dump_metrics(args.metrics)
+        print(f"Wrote metrics to {args.metrics}")
@@ -0,0 +1,227 @@
+"""
+Offline benchmark for the referral pipeline.
+
+Runs extraction, summarization, guideline retrieval and the agent loop over
+sample_forms/form1..5.pdf (plus synthetic forms made by repeating their pages)
+with record/replay stand-ins for the chat model, embeddings and vector store.
+No OpenAI or Pinecone calls are made unless --record is given, in which case
+real responses are captured to the recordings file for later replay.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python src/utils/benchmark.py --output bench.json
+    PYTHONPATH=src/referral_agent python src/utils/benchmark.py --scale 4 --llm-latency 0.8 --compare bench.json
+    PYTHONPATH=src/referral_agent python src/utils/benchmark.py --record --recordings bench_recordings.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import fitz  # PyMuPDF
+
+from guideline_recommendations import get_guideline_recommendations
+from ingest import LocalSink, ingest, load_chunks
+from initialize_agent import create_query_tool, initialize_agent, initialize_direct_recommender
+from parse_and_summarize_pdf import extract_text_with_ocr, summarize_text
+from replay import CallStats, ReplayChatModel, ReplayEmbeddings, ReplayStore, ReplayVectorStore
+
+RETRIEVAL_QUERIES = [
+    "FIT positive rectal bleeding next steps",
+    "FIT negative iron deficiency anaemia ferritin 45 criteria",
+    "WHO performance status 3 or 4 mobility problems",
+    "change in bowel habit over 50 FIT negative",
+    "unexplained weight loss with abdominal pain",
+]
+
+
+def scaled_form(path, scale):
+    """Returns the bytes of ``path`` with its pages repeated ``scale`` times."""
+    with fitz.open(path) as source, fitz.open() as scaled:
+        for _ in range(scale):
+            scaled.insert_pdf(source)
+        return scaled.tobytes()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def cpu_seconds():
+    """CPU time of this process and its finished children (OCR workers)."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def measure(stats, func, *args, **kwargs):
+    """Runs ``func`` and returns its result with wall time, CPU time, peak RSS and call counts."""
+    before = stats.snapshot()
+    wall_start, cpu_start = time.perf_counter(), cpu_seconds()
+    result = func(*args, **kwargs)
+    after = stats.snapshot()
+    return result, {
+        "wall_seconds": time.perf_counter() - wall_start,
+        "cpu_seconds": cpu_seconds() - cpu_start,
+        "peak_rss_mb": peak_rss_mb(),
+        **{name: after[name] - before[name] for name in after},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_stand_ins(args, workdir):
+    """Creates the replay chat models, embeddings and a local vector store over rules/."""
+    store = ReplayStore(args.recordings)
+    stats = CallStats()
+    inner_chat = inner_qa = inner_embeddings = None
+    if args.record:
+        from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+        inner_chat = ChatOpenAI(model="gpt-4o", temperature=0)
+        inner_qa = ChatOpenAI(model="gpt-3.5-turbo")
+        inner_embeddings = OpenAIEmbeddings()
+
+    def chat(tag, inner):
+        return ReplayChatModel(store=store, stats=stats, inner=inner, record=args.record,
+                               latency=args.llm_latency, name_tag=tag)
+
+    embeddings = ReplayEmbeddings(store, stats, inner=inner_embeddings, record=args.record, latency=args.embed_latency)
+    vector_store = ReplayVectorStore(os.path.join(workdir, "index"), embeddings, stats, latency=args.vector_latency)
+    ingest(load_chunks(), LocalSink(vector_store), embeddings)
+    return store, stats, {
+        "summary_llm": chat("summary", inner_chat),
+        "qa_llm": chat("qa", inner_qa),
+        "agent_llm": chat("agent", inner_qa),
+        "embeddings": embeddings,
+        "vector_store": vector_store,
+    }
+
+
+def run_benchmark(args):
+    forms = []
+    for path in sorted(glob.glob(args.forms)):
+        with open(path, "rb") as f:
+            forms.append((os.path.basename(path), f.read()))
+        if args.scale > 1:
+            forms.append((f"{os.path.basename(path)}x{args.scale}", scaled_form(path, args.scale)))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        store, stats, stand_ins = build_stand_ins(args, workdir)
+        query_tool = create_query_tool(
+            "pathways", "GuidelineQuery", "Search the colorectal cancer guideline index for next steps.",
+            cache=False, vector_store=stand_ins["vector_store"], llm=stand_ins["qa_llm"],
+        )
+        if args.mode == "direct":
+            agent_executor = initialize_direct_recommender(
+                llm=stand_ins["agent_llm"], vector_store=stand_ins["vector_store"], embeddings=stand_ins["embeddings"]
+            )
+        else:
+            agent_executor = initialize_agent(llm=stand_ins["agent_llm"], guideline_tool=query_tool)
+
+        results = []
+        for name, data in forms:
+            for repeat in range(args.repeat):
+                row = {"form": name, "repeat": repeat, "bytes": len(data)}
+                raw_text, row["extract"] = measure(stats, extract_text_with_ocr, BytesIO(data), workers=args.ocr_workers)
+                summary, row["summarize"] = measure(
+                    stats, summarize_text, raw_text, use_cache=False, llm=stand_ins["summary_llm"]
+                )
+                _, row["retrieval"] = measure(
+                    stats, lambda: [stand_ins["vector_store"].similarity_search(q, k=4) for q in RETRIEVAL_QUERIES]
+                )
+                _, row["agent"] = measure(
+                    stats, get_guideline_recommendations, summary, agent_executor, use_table=args.decision_table
+                )
+                results.append(row)
+                print(f"{name} #{repeat}: " + ", ".join(
+                    f"{stage} {row[stage]['wall_seconds']:.3f}s" for stage in ("extract", "summarize", "retrieval", "agent")
+                ))
+
+        if args.record:
+            store.save()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        "totals": summarize_results(results),
+        "results": results,
+    }
+
+
+def summarize_results(results):
+    """Sums each metric per stage across all forms."""
+    totals = {}
+    for row in results:
+        for stage in ("extract", "summarize", "retrieval", "agent"):
+            stage_totals = totals.setdefault(stage, {})
+            for metric, value in row[stage].items():
+                if metric == "peak_rss_mb":
+                    stage_totals[metric] = max(stage_totals.get(metric, 0), value)
+                else:
+                    stage_totals[metric] = stage_totals.get(metric, 0) + value
+    return totals
+
+
+def compare(current, baseline_path):
+    """Prints the change in each stage's totals against a previous results file."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    for stage, metrics in current["totals"].items():
+        old_metrics = baseline.get("totals", {}).get(stage, {})
+        for metric in ("wall_seconds", "cpu_seconds", "llm_calls", "prompt_tokens", "completion_tokens"):
+            new, old = metrics.get(metric, 0), old_metrics.get(metric)
+            if old is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"  {stage:>10} {metric:<18} {old:>10.3f} -> {new:>10.3f}  ({change})")
+
+
+### Example Usage ###
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the referral pipeline offline.")
+    parser.add_argument("--forms", default="sample_forms/form*.pdf", help="Glob of input PDFs")
+    parser.add_argument("--scale", type=int, default=1, help="Also run synthetic forms with pages repeated N times")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per form")
+    parser.add_argument("--mode", choices=["agent", "direct"], default="agent", help="Recommendation engine to run")
+    parser.add_argument("--decision-table", action="store_true",
+                        help="Answer from the compiled decision table when it can decide")
+    parser.add_argument("--ocr-workers", type=int, default=None)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated seconds per chat model call")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Simulated seconds per embeddings call")
+    parser.add_argument("--vector-latency", type=float, default=0.0, help="Simulated seconds per vector search")
+    parser.add_argument("--recordings", default=None, help="JSON file of recorded responses to replay")
+    parser.add_argument("--record", action="store_true", help="Call the real services and save responses to --recordings")
+    parser.add_argument("--output", default="bench_results.json", help="Machine-readable results file")
+    parser.add_argument("--compare", default=None, help="Previous results file to compare against")
+    args = parser.parse_args()
+
+    if args.record and not args.recordings:
+        parser.error("--record requires --recordings")
+
+    report = run_benchmark(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+    for stage, metrics in report["totals"].items():
+        print(f"{stage:>10}: {metrics['wall_seconds']:.3f}s wall, {metrics['cpu_seconds']:.3f}s CPU, "
+              f"{metrics['llm_calls']} LLM calls, {metrics['prompt_tokens'] + metrics['completion_tokens']} tokens, "
+              f"peak RSS {metrics['peak_rss_mb']:.0f} MB")
+    if args.compare:
+        compare(report, args.compare)
@@ -1,31 +1,37 @@
+import argparse
+
 import fitz  # PyMuPDF
 
+from page_analysis import analyze_document
+
 def check_pdf_for_scanned_images(pdf_path):
     with fitz.open(pdf_path) as pdf:
-        has_images = False
-        has_text = False
-
-        for page in pdf:
-            # Check if the page has selectable text
-            if page.get_text():
-                has_text = True
-            
-            # Check if the page contains images
-            images = page.get_images(full=True)
-            if images:
-                has_images = True
-
-        return has_text, has_images
-
-# Example usage
-file_path = "form1.pdf"  # Replace with your file path
-text_present, images_present = check_pdf_for_scanned_images(file_path)
-
-if images_present and not text_present:
-    print("The PDF contains scanned images but no selectable text.")
-elif text_present and not images_present:
-    print("The PDF contains selectable text and no scanned images.")
-elif images_present and text_present:
-    print("The PDF contains both scanned images and selectable text.")
-else:
-    print("The PDF is empty or contains unsupported content.")
+        layouts = analyze_document(pdf)
+
+    has_text = any(layout.has_text for layout in layouts)
+    has_images = any(layout.has_images for layout in layouts)
+    return has_text, has_images, layouts
+
+### Example Usage ###
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report which pages and regions of a PDF need OCR.")
+    parser.add_argument("pdf", help="Path to the PDF file")
+    args = parser.parse_args()
+
+    text_present, images_present, layouts = check_pdf_for_scanned_images(args.pdf)
+
+    if images_present and not text_present:
+        print("The PDF contains scanned images but no selectable text.")
+    elif text_present and not images_present:
+        print("The PDF contains selectable text and no scanned images.")
+    elif images_present and text_present:
+        print("The PDF contains both scanned images and selectable text.")
+    else:
+        print("The PDF is empty or contains unsupported content.")
+
+    for layout in layouts:
+        print(f"Page {layout.page_number + 1}: {layout.kind}, {len(layout.text_blocks)} text blocks, "
+              f"{len(layout.image_blocks)} images")
+        for region in layout.ocr_regions:
+            x0, y0, x1, y1 = region.bbox
+            print(f"    OCR region ({x0:.0f}, {y0:.0f}, {x1:.0f}, {y1:.0f}) at {region.dpi} dpi")
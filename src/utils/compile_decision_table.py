@@ -0,0 +1,44 @@
+"""
+Compiles the pathway PDFs in rules/ into the versioned decision table used to
+resolve common referral outcomes without retrieval or an LLM call.
+
+Each rule in decision_table.RULE_SPECS quotes its pathway document; compilation
+fails if a quote is no longer found, so a changed pathway PDF cannot silently
+leave a stale table behind.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python src/utils/compile_decision_table.py
+    PYTHONPATH=src/referral_agent python src/utils/compile_decision_table.py --check
+"""
+import argparse
+import json
+import sys
+
+from decision_table import DECISION_TABLE_PATH, RULES_DIR, compile_table
+
+
+### Example Usage ###
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the pathway decision table.")
+    parser.add_argument("--rules-dir", default=RULES_DIR, help="Directory with the pathway PDFs")
+    parser.add_argument("--output", default=DECISION_TABLE_PATH, help="Where to write the table")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero if the table on disk is out of date")
+    args = parser.parse_args()
+
+    table = compile_table(args.rules_dir)
+    if args.check:
+        try:
+            with open(args.output, encoding="utf-8") as f:
+                current = json.load(f).get("version")
+        except FileNotFoundError:
+            current = None
+        if current != table["version"]:
+            print(f"{args.output} is out of date ({current} != {table['version']})")
+            sys.exit(1)
+        print(f"{args.output} is up to date ({current})")
+        sys.exit(0)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(table, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    print(f"Wrote {args.output}: {len(table['rules'])} rules, version {table['version']}")
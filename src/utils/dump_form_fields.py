@@ -0,0 +1,51 @@
+"""
+Lists the form widgets of a fillable referral PDF and writes a skeleton field map.
+
+Fill in the skeleton's "fields" and "checkboxes" with the widget names that hold
+each summary field, then save it in rules/field_maps/ (or
+REFERRAL_FIELD_MAPS_DIR). Forms of that template are then summarized straight
+from their widgets.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python src/utils/dump_form_fields.py referral.pdf
+    PYTHONPATH=src/referral_agent python src/utils/dump_form_fields.py referral.pdf --skeleton rules/field_maps/my_form.json
+"""
+import argparse
+import json
+
+import fitz  # PyMuPDF
+
+from form_fields import DATE_FIELDS, LAB_FIELDS, SUMMARY_FIELDS, SYMPTOM_FIELDS, read_widgets
+
+
+def skeleton(name, widgets):
+    return {
+        "name": name,
+        "match": sorted(widgets)[:3],
+        "fields": {field: [] for field in SUMMARY_FIELDS + LAB_FIELDS + DATE_FIELDS},
+        "checkboxes": {field: [] for field in SYMPTOM_FIELDS},
+        "units": {"FIT result": "ugHb/g", "Ferritin": "µg/L", "Hb": "g/L"},
+        "widgets": sorted(widgets),  # For reference only; ignored when loading
+    }
+
+
+### Example Usage ###
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the form widgets of a fillable PDF.")
+    parser.add_argument("pdf", help="Path to the PDF file")
+    parser.add_argument("--skeleton", default=None, help="Write a field map skeleton to this path")
+    parser.add_argument("--name", default="new-template", help="Template name for the skeleton")
+    args = parser.parse_args()
+
+    with fitz.open(args.pdf) as pdf:
+        if not pdf.is_form_pdf:
+            raise SystemExit(f"{args.pdf} has no form fields.")
+        widgets = read_widgets(pdf)
+
+    for name, value in sorted(widgets.items()):
+        print(f"{name!r}: {value!r}")
+
+    if args.skeleton:
+        with open(args.skeleton, "w", encoding="utf-8") as f:
+            json.dump(skeleton(args.name, widgets), f, indent=2, ensure_ascii=False)
+        print(f"Wrote {args.skeleton}")
@@ -1,47 +1,55 @@
-import os
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.document_loaders import PyPDFLoader
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import Pinecone
-from pinecone import Pinecone, ServerlessSpec
-
-pc = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
-# Set your environment variables
-
-# Initialize Pinecone
-index_name = "pathways"
-index = pc.Index(index_name)
-
-# Load the PDF file
-loader = PyPDFLoader("./rules/BSOL_Pathway.pdf")
-documents = loader.load()
+"""
+Ingests every pathway PDF under rules/ into the guideline vector index.
 
-# Split the text into manageable chunks
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-texts = text_splitter.split_documents(documents)
+Runs incrementally: chunks are identified by a content hash, so only new or
+changed chunks are embedded and chunks that no longer exist are deleted.
 
-# Initialize OpenAI embeddings
-embeddings = OpenAIEmbeddings()
-
-# Convert texts to embeddings 
-embeddings_list = []
-for text in texts:
-    try:
-        embedding = embeddings.embed_query(text.page_content)
-        embeddings_list.append(embedding)
-    except Exception as e:
-        print(f"Error embedding text: {e}")
-        continue
-
-vectors = [
-    {
-        "id": f"doc-{i}",
-        "values": embedding,
-        "metadata": {"text": text.page_content, "document": "BSOL_Pathway.pdf", "source": "Bsol"}
-    }
-    for i, (text, embedding) in enumerate(zip(texts, embeddings_list))
-]
-
-index.upsert(vectors=vectors, namespace="ns1")
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python src/utils/ingestpdfpinecone.py
+    PYTHONPATH=src/referral_agent python src/utils/ingestpdfpinecone.py --backend local
+"""
+import argparse
+import os
 
-print(f"Successfully ingested {len(texts)} documents into Pinecone.")
+from ingest import (
+    RULES_DIR, EMBED_BATCH_SIZE, EMBED_CONCURRENCY, UPSERT_BATCH_SIZE,
+    LocalSink, PineconeSink, ingest, load_chunks,
+)
+from llm_backends import get_embeddings
+from local_index import LOCAL_INDEX_DIR, LocalVectorIndex, bump_index_version
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest the pathway PDFs into the guideline index.")
+    parser.add_argument("--backend", choices=["pinecone", "local"], default="pinecone")
+    parser.add_argument("--index-name", default="pathways")
+    parser.add_argument("--namespace", default="ns1")
+    parser.add_argument("--rules-dir", default=str(RULES_DIR))
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--upsert-batch-size", type=int, default=UPSERT_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY)
+    args = parser.parse_args()
+
+    embeddings = get_embeddings()
+    if args.backend == "local":
+        sink = LocalSink(LocalVectorIndex(os.path.join(LOCAL_INDEX_DIR, args.index_name), embeddings))
+    else:
+        from pinecone import Pinecone
+
+        pc = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
+        sink = PineconeSink(pc.Index(args.index_name), namespace=args.namespace)
+
+    chunks = load_chunks(args.rules_dir)
+    report = ingest(
+        chunks,
+        sink,
+        embeddings,
+        embed_batch_size=args.embed_batch_size,
+        upsert_batch_size=args.upsert_batch_size,
+        concurrency=args.concurrency,
+    )
+    # Invalidates cached GuidelineQuery answers; a partial run leaves that to the run that completes it
+    if not report.failed and (report.embedded or report.deleted):
+        bump_index_version(args.index_name)
+    print(f"Ingested {args.rules_dir} into {args.backend} index '{args.index_name}': {report}")
+    for error in report.errors:
+        print(f"Error embedding batch: {error}")
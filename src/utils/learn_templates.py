@@ -0,0 +1,61 @@
+"""
+Learns the static template text of each referral form layout from a corpus of
+forms and reports the input-token reduction template stripping gives each form.
+
+The learned templates are written to rules/templates.json (or
+REFERRAL_TEMPLATES_PATH), where summarization picks them up automatically.
+Use a corpus with several differently filled forms per layout: a value that
+is identical in every example of a layout is indistinguishable from boilerplate.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python src/utils/learn_templates.py "forms/*.pdf"
+    PYTHONPATH=src/referral_agent python src/utils/learn_templates.py "sample_forms/*.pdf" --report-only
+"""
+import argparse
+import glob
+import os
+
+from form_templates import TEMPLATES_PATH, FormTemplates
+from parse_and_summarize_pdf import extract_text_with_ocr
+
+
+def load_texts(pattern):
+    texts = {}
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            texts[path] = extract_text_with_ocr(f)
+    return texts
+
+
+def print_report(templates, texts):
+    """Prints the matched layout and token counts before and after stripping, per form."""
+    total_before = total_after = 0
+    for path, text in texts.items():
+        result = templates.compress(text)
+        total_before += result.original_tokens
+        total_after += result.compressed_tokens
+        print(f"{os.path.basename(path)}: {result.layout or 'unknown layout'}, "
+              f"{result.original_tokens} -> {result.compressed_tokens} tokens ({result.reduction:.0%} reduction)")
+    if total_before:
+        print(f"Total: {total_before} -> {total_after} tokens ({1 - total_after / total_before:.0%} reduction)")
+
+
+### Example Usage ###
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Learn referral form templates from example forms.")
+    parser.add_argument("forms", help="Glob of example form PDFs")
+    parser.add_argument("--output", default=TEMPLATES_PATH, help="Where to write the learned templates")
+    parser.add_argument("--min-support", type=float, default=1.0,
+                        help="Fraction of a layout's forms a line must appear in to be template text")
+    parser.add_argument("--report-only", action="store_true", help="Print the report without saving the templates")
+    args = parser.parse_args()
+
+    texts = load_texts(args.forms)
+    templates = FormTemplates.learn(list(texts.values()), min_support=args.min_support)
+    for layout in templates.layouts:
+        print(f"{layout.name}: {len(layout.lines)} template lines from {layout.forms} forms")
+    print_report(templates, texts)
+
+    if not args.report_only:
+        templates.save(args.output)
+        print(f"Wrote {args.output} (version {templates.version})")
@@ -1,16 +1,41 @@
-import requests
+import json
+
+from llm_backends import OLLAMA_CONNECT_TIMEOUT, OLLAMA_TIMEOUT, OLLAMA_URL, http_session
 
 class OllamaLlama:
-    def __init__(self, model="llama3:latest", port=11435):
-        self.base_url = f"http://localhost:{port}"
+    """
+    Plain-prompt completions from a local Ollama server. Requests reuse the pooled
+    keep-alive session shared with the pipeline's Ollama chat models.
+    """
+    def __init__(self, model="llama3:latest", base_url=OLLAMA_URL, timeout=OLLAMA_TIMEOUT):
+        self.base_url = base_url
         self.model = model
+        self.timeout = timeout
 
-    def invoke(self, prompt):
-        response = requests.post(
-            f"{self.base_url}/api/v1/completions",
-            json={"model": self.model, "prompt": prompt}
+    def _post(self, prompt, stream):
+        response = http_session(self.base_url).post(
+            f"{self.base_url}/api/generate",
+            json={"model": self.model, "prompt": prompt, "stream": stream},
+            stream=stream,
+            timeout=(OLLAMA_CONNECT_TIMEOUT, self.timeout),
         )
-        if response.status_code == 200:
-            return response.json().get("completion", "")
-        else:
+        if response.status_code != 200:
             raise Exception(f"Ollama API Error: {response.status_code} - {response.text}")
+        return response
+
+    def stream(self, prompt):
+        """Yields the completion piece by piece as the model generates it."""
+        with self._post(prompt, stream=True) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                part = json.loads(line)
+                if "error" in part:
+                    raise Exception(f"Ollama API Error: {part['error']}")
+                yield part.get("response", "")
+                if part.get("done"):
+                    break
+
+    def invoke(self, prompt):
+        with self._post(prompt, stream=False) as response:
+            return response.json().get("response", "")
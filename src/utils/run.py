@@ -1,4 +1,4 @@
-from initialize_agent import initialize_agent
+from initialize_agent import initialize_recommender
 from guideline_recommendations import get_guideline_recommendations
 from parse_and_summarize_pdf import parse_and_summarize_pdf
 
@@ -8,7 +8,7 @@ if __name__ == "__main__":
     file_path = "sample_forms/form3.pdf"
     with open(file_path, "rb") as pdf_file:
         # Initialize the agent
-        agent_executor = initialize_agent()
+        agent_executor = initialize_recommender()
 
         # Parse and summarize the PDF
         summary = parse_and_summarize_pdf(pdf_file)
@@ -0,0 +1,168 @@
+"""
+Startup benchmark: cold import times and time-to-first-request.
+
+Each measurement runs in a fresh interpreter so nothing is already imported.
+The first request processes one sample form through extraction, summarization
+and the agent with the offline record/replay stand-ins (see benchmark.py), so
+no OpenAI or Pinecone calls are made. With --warmup the background warm-up is
+started as the app would start it, and the request arrives --idle seconds later
+(the time a user takes to pick a file).
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python src/utils/startup_benchmark.py --output startup.json
+    PYTHONPATH=src/referral_agent python src/utils/startup_benchmark.py --warmup --idle 3 --compare startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# The modules main.py imports before it can render the page
+APP_MODULES = ["initialize_agent", "guideline_recommendations", "parse_and_summarize_pdf", "warmup"]
+
+
+def run_child(*args):
+    """Runs this script in a fresh interpreter and returns the JSON it prints."""
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), *args], capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_seconds"] = time.perf_counter() - started
+    return result
+
+
+def child_import(module):
+    start = time.perf_counter()
+    __import__(module)
+    return {"import_seconds": time.perf_counter() - start}
+
+
+def child_first_request(form, index_dir, warmup, idle):
+    """Imports the app modules, optionally starts the warm-up, then serves one request."""
+    start = time.perf_counter()
+    for module in APP_MODULES:
+        __import__(module)
+    imported = time.perf_counter() - start
+
+    from warmup import start_warm_up, warm_up_report
+
+    thread = start_warm_up(recommender=False) if warmup else None
+    time.sleep(idle)
+
+    request_start = time.perf_counter()
+    from io import BytesIO
+
+    from guideline_recommendations import get_guideline_recommendations
+    from initialize_agent import create_query_tool, initialize_agent
+    from parse_and_summarize_pdf import extract_text_with_ocr, summarize_text
+    from replay import CallStats, ReplayChatModel, ReplayEmbeddings, ReplayStore, ReplayVectorStore
+
+    store, stats = ReplayStore(), CallStats()
+    vector_store = ReplayVectorStore(index_dir, ReplayEmbeddings(store, stats), stats)
+    query_tool = create_query_tool(
+        "pathways", "GuidelineQuery", "Search the colorectal cancer guideline index for next steps.",
+        cache=False, vector_store=vector_store, llm=ReplayChatModel(store=store, stats=stats),
+    )
+    agent_executor = initialize_agent(llm=ReplayChatModel(store=store, stats=stats), guideline_tool=query_tool)
+    with open(form, "rb") as f:
+        raw_text = extract_text_with_ocr(BytesIO(f.read()))
+    summary = summarize_text(raw_text, use_cache=False, llm=ReplayChatModel(store=store, stats=stats))
+    get_guideline_recommendations(summary, agent_executor, use_table=False)
+    first_request = time.perf_counter() - request_start
+
+    return {
+        "import_seconds": imported,
+        "first_request_seconds": first_request,
+        "warm_up_finished": thread is not None and not thread.is_alive(),
+        "warm_up_steps": warm_up_report(),
+    }
+
+
+def build_index(index_dir):
+    """Embeds rules/ into a local replay index once, outside the timed processes."""
+    from ingest import LocalSink, ingest, load_chunks
+    from replay import CallStats, ReplayEmbeddings, ReplayStore, ReplayVectorStore
+
+    stats = CallStats()
+    embeddings = ReplayEmbeddings(ReplayStore(), stats)
+    ingest(load_chunks(), LocalSink(ReplayVectorStore(index_dir, embeddings, stats)), embeddings)
+
+
+def run_benchmark(args):
+    imports = {}
+    for module in APP_MODULES:
+        samples = [run_child("--child-import", module)["import_seconds"] for _ in range(args.repeat)]
+        imports[module] = statistics.median(samples)
+        print(f"import {module:<28} {imports[module] * 1000:8.1f} ms")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        index_dir = os.path.join(workdir, "index")
+        build_index(index_dir)
+        runs = []
+        for _ in range(args.repeat):
+            child_args = ["--child-request", args.form, "--index-dir", index_dir, "--idle", str(args.idle)]
+            runs.append(run_child(*child_args, *(["--warmup"] if args.warmup else [])))
+
+    first_request = statistics.median(run["first_request_seconds"] for run in runs)
+    time_to_first_request = statistics.median(
+        run["import_seconds"] + args.idle + run["first_request_seconds"] for run in runs
+    )
+    print(f"app imports {statistics.median(run['import_seconds'] for run in runs):.3f}s, "
+          f"first request {first_request:.3f}s, time to first answer {time_to_first_request:.3f}s"
+          f"{' (warm-up on)' if args.warmup else ''}")
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "settings": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        "imports": imports,
+        "first_request_seconds": first_request,
+        "time_to_first_request_seconds": time_to_first_request,
+        "runs": runs,
+    }
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path}:")
+    rows = [(f"import {module}", seconds, baseline.get("imports", {}).get(module))
+            for module, seconds in current["imports"].items()]
+    rows += [(name, current[name], baseline.get(name))
+             for name in ("first_request_seconds", "time_to_first_request_seconds")]
+    for name, new, old in rows:
+        if old is None:
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"  {name:<34} {old:>8.3f} -> {new:>8.3f}  ({change})")
+
+
+### Example Usage ###
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold imports and time-to-first-request.")
+    parser.add_argument("--form", default="sample_forms/form1.pdf", help="Form for the first request")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh processes per measurement (median is reported)")
+    parser.add_argument("--warmup", action="store_true", help="Start the background warm-up before the request")
+    parser.add_argument("--idle", type=float, default=0.0, help="Seconds between startup and the first request")
+    parser.add_argument("--output", default="startup_results.json", help="Machine-readable results file")
+    parser.add_argument("--compare", default=None, help="Previous results file to compare against")
+    parser.add_argument("--child-import", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--child-request", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--index-dir", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_import:
+        print(json.dumps(child_import(args.child_import)))
+    elif args.child_request:
+        print(json.dumps(child_first_request(args.child_request, args.index_dir, args.warmup, args.idle)))
+    else:
+        report = run_benchmark(args)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+        if args.compare:
+            compare(report, args.compare)
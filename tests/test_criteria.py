@@ -0,0 +1,89 @@
+"""
+Tests for the deterministic referral criteria.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python -m unittest discover -s tests
+"""
+import unittest
+
+from criteria import PatientFeatures, evaluate_criteria, evaluate_criteria_batch, extract_features, format_criteria
+
+
+class ExtractFeaturesTest(unittest.TestCase):
+    def test_plain_fit_value(self):
+        features = extract_features("- FIT result: 120 ugHb/g")
+        self.assertEqual(features.fit, 120)
+        self.assertIsNone(features.fit_below)
+
+    def test_censored_fit_values(self):
+        cases = {
+            "FIT <4": (4, "<"),
+            "FIT: < 10 ug/g": (10, "<"),
+            "- FIT result: <=7 ugHb/g": (7, "≤"),
+            "FIT result ≤ 9": (9, "≤"),
+        }
+        for text, (value, below) in cases.items():
+            with self.subTest(text=text):
+                features = extract_features(text)
+                self.assertEqual(features.fit, value)
+                self.assertEqual(features.fit_below, below)
+
+    def test_age_from_dates_needs_the_referral_date(self):
+        self.assertEqual(extract_features("DoB: 01/02/1960\nDate of Referral: 15/03/2024").age, 64)
+        self.assertIsNone(extract_features("DoB: 01/02/1960").age)
+
+
+class EvaluateCriteriaTest(unittest.TestCase):
+    def test_censored_fit_below_threshold_is_negative(self):
+        for text in ("FIT <4", "FIT: < 10 ug/g", "FIT ≤ 9"):
+            with self.subTest(text=text):
+                result = evaluate_criteria(extract_features(text))
+                self.assertIs(result.fit_positive, False)
+                self.assertIs(result.fit_negative, True)
+
+    def test_censored_fit_spanning_threshold_is_unknown(self):
+        for text in ("FIT <15", "FIT ≤10"):
+            with self.subTest(text=text):
+                result = evaluate_criteria(extract_features(text))
+                self.assertIsNone(result.fit_positive)
+                self.assertIsNone(result.fit_negative)
+
+    def test_fit_positive_pathway_has_no_age_limit(self):
+        result = evaluate_criteria(PatientFeatures(age=35, fit=50))
+        self.assertIs(result.meets_fit_positive_criteria, True)
+        self.assertIs(result.aged_40_or_over, False)
+
+    def test_fit_negative_ida_criteria_keep_the_age_limit(self):
+        features = PatientFeatures(age=35, gender="F", fit=3, ferritin=10, hb=100)
+        self.assertIs(evaluate_criteria(features).meets_fit_negative_ida_criteria, False)
+        features.age = 45
+        self.assertIs(evaluate_criteria(features).meets_fit_negative_ida_criteria, True)
+
+    def test_batch_matches_single(self):
+        features_list = [
+            PatientFeatures(age=35, fit=50),
+            PatientFeatures(age=45, gender="F", fit=4, fit_below="<", ferritin=10, hb=100),
+            PatientFeatures(fit=15, fit_below="<"),
+            PatientFeatures(fit=10, fit_below="≤"),
+            PatientFeatures(gender="M", hb=120),
+            PatientFeatures(),
+        ]
+        batch = evaluate_criteria_batch(features_list)
+        for row, features in enumerate(features_list):
+            result = evaluate_criteria(features)
+            for name, values in batch.items():
+                with self.subTest(row=row, field=name):
+                    self.assertEqual(values[row], getattr(result, name))
+
+
+class FormatCriteriaTest(unittest.TestCase):
+    def test_renders_fit_bound_and_label(self):
+        features = extract_features("- Age: 35\n- FIT result: <4 ugHb/g")
+        text = format_criteria(features, evaluate_criteria(features))
+        self.assertIn("FIT result: <4 ugHb/g, FIT Negative", text)
+        self.assertIn("Meets FIT positive pathway criteria (FIT ≥10): No", text)
+        self.assertNotIn("aged 40+", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
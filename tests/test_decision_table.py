@@ -0,0 +1,73 @@
+"""
+Tests for the compiled pathway decision table.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python -m unittest discover -s tests
+"""
+import unittest
+
+from decision_table import DECISION_TABLE_PATH, DecisionTable, facts_from_summary
+
+TICKED_SYMPTOMS = {
+    "rectal_bleeding": "Rectal bleeding",
+    "change_in_bowel_habit": "Change in bowel habit",
+    "weight_loss": "Weight loss",
+    "iron_deficiency_anaemia": "Iron Deficiency Anaemia",
+}
+
+
+def summary_text(age=None, fit_result=None, symptoms=None, who_performance_status=None, **ticked):
+    """A structured summary in the layout the summarization step produces."""
+    lines = [f"- Age: {age or 'Not provided'}", f"- Symptoms: {symptoms or 'Not provided'}",
+             f"- FIT result: {fit_result or 'Not provided'}", "- FIT positive pathway symptoms:"]
+    lines.extend(f"    - {label}: {'Yes' if ticked.get(name) else 'No'}" for name, label in TICKED_SYMPTOMS.items())
+    lines.append(f"- WHO Performance status: {who_performance_status or 'Not provided'}")
+    return "\n".join(lines)
+
+
+class DecisionTableTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.table = DecisionTable.load(DECISION_TABLE_PATH)
+
+    def rule_ids(self, **fields):
+        decision = self.table.lookup_summary(summary_text(**fields))
+        return None if decision is None else [rule.id for rule in decision.rules]
+
+    def test_isolated_weight_loss(self):
+        ids = self.rule_ids(age="45", fit_result="3 ugHb/g", symptoms="Weight loss", weight_loss=True,
+                            who_performance_status="1")
+        self.assertEqual(ids, ["bsol-neg-weight-loss-isolated"])
+
+    def test_defers_on_free_text_symptoms_not_ticked(self):
+        summary = summary_text(
+            age="45", fit_result="3 ugHb/g", weight_loss=True, who_performance_status="1",
+            symptoms="weight loss and persistent abdominal pain; abdominal mass palpable",
+        )
+        facts = facts_from_summary(summary)
+        self.assertEqual(facts.mentioned_symptoms, {"weight loss", "abdominal pain", "abdominal mass"})
+        self.assertEqual(facts.symptoms, {"weight loss"})
+        self.assertIsNone(self.table.lookup(facts))
+
+    def test_defers_when_a_candidate_rule_is_undecidable(self):
+        # Over 80 and WHO 3/4 take FIT-positive patients to a different clinic
+        self.assertIsNone(self.rule_ids(fit_result="120 ugHb/g", symptoms="Rectal bleeding", rectal_bleeding=True))
+        self.assertIsNone(self.rule_ids(age="60", fit_result="120 ugHb/g", symptoms="Rectal bleeding",
+                                        rectal_bleeding=True))
+
+    def test_fit_positive_rectal_bleeding(self):
+        ids = self.rule_ids(age="60", fit_result="120 ugHb/g", symptoms="Rectal bleeding", rectal_bleeding=True,
+                            who_performance_status="1")
+        self.assertEqual(ids, ["bsol-fit-positive", "uhb-pos-rectal-bleeding"])
+
+    def test_fit_positive_weight_loss_uses_the_percentage(self):
+        fields = dict(age="60", fit_result="120 ugHb/g", weight_loss=True, who_performance_status="1")
+        self.assertIsNone(self.rule_ids(symptoms="Weight loss", **fields))
+        self.assertEqual(self.rule_ids(symptoms="Weight loss of 12% over 3 months", **fields),
+                         ["bsol-fit-positive", "uhb-pos-weight-loss"])
+        # Under 10% no FIT-positive rule covers weight loss
+        self.assertIsNone(self.rule_ids(symptoms="Weight loss (5%)", **fields))
+
+
+if __name__ == "__main__":
+    unittest.main()
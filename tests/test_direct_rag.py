@@ -0,0 +1,56 @@
+"""
+Tests for the single-pass direct RAG recommendation engine.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python -m unittest discover -s tests
+"""
+import time
+import unittest
+
+from direct_rag import DirectRecommender
+
+SUMMARY = "- Age: 60\n- FIT result: 120 ugHb/g"
+
+
+class Document:
+    def __init__(self, page_content):
+        self.page_content = page_content
+        self.metadata = {"document": "UHB_Pathway.pdf"}
+
+
+class StubVectorStore:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def similarity_search_by_vector(self, vector, k):
+        time.sleep(self.delay)
+        return [Document("FIT ≥10: urgent LGI 2WW referral")]
+
+
+class StubEmbeddings:
+    def embed_documents(self, texts):
+        return [[1.0] for _ in texts]
+
+
+class StubLLM:
+    def invoke(self, prompt):
+        return "Refer urgently [1]"
+
+
+class DirectRecommenderTest(unittest.TestCase):
+    def test_recommends_from_the_retrieved_excerpts(self):
+        recommender = DirectRecommender(StubVectorStore(), StubEmbeddings(), StubLLM(), timeout=5)
+        steps, answer = recommender.recommend(SUMMARY)
+        self.assertEqual(answer, "Refer urgently [1]")
+        self.assertIn("UHB_Pathway.pdf: FIT ≥10", steps)
+
+    def test_slow_retrieval_counts_against_the_deadline(self):
+        recommender = DirectRecommender(StubVectorStore(delay=0.2), StubEmbeddings(), StubLLM(), timeout=0.1)
+        start = time.perf_counter()
+        with self.assertRaises(TimeoutError):
+            recommender.recommend(SUMMARY)
+        self.assertLess(time.perf_counter() - start, 0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Tests for the AcroForm field extraction fast path.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python -m unittest discover -s tests
+"""
+import unittest
+
+import fitz  # PyMuPDF
+
+from form_fields import FIELD_MAPS_DIR, load_field_maps, summarize_form_fields
+
+TEXT_FIELDS = {
+    "Patient_Forename": "Jane",
+    "Patient_Surname": "Smith",
+    "Patient_DoB": "01/02/1960",
+    "Patient_Address": "1 High Street, Birmingham",
+    "Patient_NHS_Number": "943 476 5919",
+    "GP_Name": "Dr A Patel",
+    "GP_Practice": "Hill Surgery",
+    "Referral_Date": "15/03/2024",
+    "Symptoms_Details": "Rectal bleeding for 6 weeks",
+    "FIT_Result": "120",
+    "Ferritin": "40",
+    "Haemoglobin": "130",
+    "WHO_Status": "1",
+    "Additional_History": "None",
+}
+CHECKBOXES = {
+    "GP_Declaration": True,
+    "Sx_Rectal_Bleeding": True,
+    "Sx_Change_In_Bowel_Habit": False,
+    "Sx_Weight_Loss": False,
+    "Sx_Iron_Deficiency_Anaemia": False,
+}
+
+
+def build_form(text_fields, checkboxes=None, sex=None):
+    """A fillable PDF with the given text widgets, checkboxes and a Male/Female radio group."""
+    document = fitz.open()
+    page = document.new_page()
+    widgets = [(name, fitz.PDF_WIDGET_TYPE_TEXT, value) for name, value in text_fields.items()]
+    widgets += [(name, fitz.PDF_WIDGET_TYPE_CHECKBOX, value) for name, value in (checkboxes or {}).items()]
+    for row, (name, field_type, value) in enumerate(widgets):
+        widget = fitz.Widget()
+        widget.field_name, widget.field_type, widget.field_value = name, field_type, value
+        widget.rect = fitz.Rect(20, 20 + 24 * row, 300, 40 + 24 * row)
+        page.add_widget(widget)
+    if sex is not None:
+        for column, state in enumerate(["Male", "Female"]):
+            widget = fitz.Widget()
+            widget.field_name, widget.field_type, widget.field_value = "Patient_Sex", fitz.PDF_WIDGET_TYPE_RADIOBUTTON, False
+            widget.rect = fitz.Rect(320 + 30 * column, 20, 340 + 30 * column, 40)
+            annot = page.add_widget(widget)
+            # PyMuPDF names every button's on-state "Yes"; give each its own, as form designers do
+            _, states = document.xref_get_key(annot.xref, "AP/N")
+            document.xref_set_key(annot.xref, "AP/N", states.replace("/Yes", f"/{state}"))
+            document.xref_set_key(annot.xref, "AS", f"/{state}" if state == sex else "/Off")
+    return document.tobytes()
+
+
+class SummarizeFormFieldsTest(unittest.TestCase):
+    def test_example_field_map_ships(self):
+        self.assertIn("example-2ww-fillable", [field_map.name for field_map in load_field_maps(FIELD_MAPS_DIR)])
+
+    def test_summarizes_a_form_of_the_example_template(self):
+        summary = summarize_form_fields(build_form(TEXT_FIELDS, CHECKBOXES, sex="Female"))
+        self.assertIsNotNone(summary)
+        text = summary.to_text()
+        self.assertIn("- Name: Jane Smith", text)
+        self.assertIn("- Gender: Female", text)
+        self.assertIn("- FIT result: 120 ugHb/g", text)
+        self.assertIn("- Hb: 130 g/L", text)
+        self.assertIn("- GP/Doctor details and referral date: Dr A Patel Hill Surgery 15/03/2024", text)
+        # No age widget: worked out from the date of birth and the referral date
+        self.assertIn("- Age: 64", text)
+        self.assertIn("Rectal bleeding: Yes", text)
+        self.assertNotIn("Weight loss: Yes", text)
+
+    def test_unselected_radio_group_leaves_the_field_empty(self):
+        text = summarize_form_fields(build_form(TEXT_FIELDS, CHECKBOXES, sex="")).to_text()
+        self.assertNotIn("- Gender: Male", text)
+        self.assertNotIn("- Gender: Female", text)
+
+    def test_falls_back_below_min_coverage(self):
+        sparse = {name: TEXT_FIELDS[name] for name in ("Patient_Surname", "Patient_NHS_Number", "FIT_Result")}
+        self.assertIsNone(summarize_form_fields(build_form(sparse)))
+        form = build_form(TEXT_FIELDS, CHECKBOXES, sex="Female")
+        self.assertIsNone(summarize_form_fields(form, min_coverage=1.01))
+
+    def test_ignores_forms_of_other_templates_and_plain_pdfs(self):
+        self.assertIsNone(summarize_form_fields(build_form({"Other_Field": "x"})))
+        document = fitz.open()
+        document.new_page().insert_text((72, 72), "FIT result: 120")
+        self.assertIsNone(summarize_form_fields(document.tobytes()))
+
+
+if __name__ == "__main__":
+    unittest.main()
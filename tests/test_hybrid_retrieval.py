@@ -0,0 +1,44 @@
+"""
+Tests for the hybrid BM25 + vector guideline retrieval.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python -m unittest discover -s tests
+"""
+import unittest
+from unittest import mock
+
+import hybrid_retrieval
+from ingest import Chunk
+
+
+def chunks(*texts):
+    return [Chunk(str(i), text, {"text": text}) for i, text in enumerate(texts)]
+
+
+class GetBM25IndexTest(unittest.TestCase):
+    def setUp(self):
+        hybrid_retrieval._build_bm25_index.cache_clear()
+        self.version = "1"
+        self.chunks = chunks("FIT positive pathway", "iron deficiency anaemia")
+        patches = [
+            mock.patch.object(hybrid_retrieval, "read_index_version", lambda index_name: self.version),
+            mock.patch.object(hybrid_retrieval, "load_chunks", lambda rules_dir: self.chunks),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_rebuilt_when_the_index_version_changes(self):
+        index = hybrid_retrieval.get_bm25_index("rules")
+        self.assertIs(hybrid_retrieval.get_bm25_index("rules"), index)
+        self.assertEqual(len(index.search("rectal bleeding", k=5)), 0)
+
+        self.chunks = chunks("FIT positive pathway", "rectal bleeding")
+        self.version = "2"
+        rebuilt = hybrid_retrieval.get_bm25_index("rules")
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual([doc.page_content for doc, _ in rebuilt.search("rectal bleeding", k=5)], ["rectal bleeding"])
+
+
+if __name__ == "__main__":
+    unittest.main()
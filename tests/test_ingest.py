@@ -0,0 +1,56 @@
+"""
+Tests for the incremental guideline ingestion.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python -m unittest discover -s tests
+"""
+import tempfile
+import unittest
+
+from ingest import Chunk, LocalSink, chunk_id, ingest
+from local_index import LocalVectorIndex
+
+
+class StubEmbeddings:
+    def embed_documents(self, texts):
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FailingEmbeddings(StubEmbeddings):
+    def embed_documents(self, texts):
+        raise ConnectionError("embeddings service unavailable")
+
+
+def chunks(document, texts):
+    return [Chunk(chunk_id(document, text), text, {"text": text, "document": document}) for text in texts]
+
+
+class IngestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = LocalVectorIndex(self.directory.name, StubEmbeddings())
+        self.sink = LocalSink(self.index)
+        self.old = chunks("UHB_Pathway.pdf", ["old pathway text", "unchanged text"])
+        ingest(self.old, self.sink, StubEmbeddings())
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_replaces_changed_chunks(self):
+        new = chunks("UHB_Pathway.pdf", ["new pathway text", "unchanged text"])
+        report = ingest(new, self.sink, StubEmbeddings())
+        self.assertEqual((report.embedded, report.unchanged, report.deleted, report.failed), (1, 1, 1, 0))
+        self.assertEqual(set(self.index.get_ids()), {chunk.id for chunk in new})
+
+    def test_failed_embeddings_keep_the_old_chunks(self):
+        new = chunks("UHB_Pathway.pdf", ["new pathway text", "unchanged text"])
+        report = ingest(new, self.sink, FailingEmbeddings())
+        self.assertEqual((report.embedded, report.deleted, report.failed), (0, 0, 1))
+        self.assertEqual(set(self.index.get_ids()), {chunk.id for chunk in self.old})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Tests for the persistent job queue.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python -m unittest discover -s tests
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from job_queue import DONE, FAILED, RUNNING, JobQueue, WorkerPool
+
+PDF = b"%PDF-1.4 test"
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "jobs.sqlite3")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_resubmission_returns_the_existing_job(self):
+        queue = JobQueue(self.path)
+        job = queue.submit(PDF, filename="form.pdf")
+        self.assertEqual(queue.submit(PDF)["id"], job["id"])
+
+    def test_stale_worker_cannot_overwrite_the_new_owner(self):
+        queue = JobQueue(self.path, lease_seconds=0.05)
+        job_id = queue.submit(PDF)["id"]
+        self.assertEqual(queue.claim("stale")[0], job_id)
+        time.sleep(0.1)
+        self.assertEqual(queue.claim("current")[0], job_id)
+
+        self.assertFalse(queue.set_stage(job_id, "stale", "recommending"))
+        self.assertTrue(queue.complete(job_id, "current", {"final_answer": "ok"}))
+        self.assertFalse(queue.fail(job_id, "stale", "timed out"))
+
+        job = queue.get(job_id)
+        self.assertEqual(job["status"], DONE)
+        self.assertEqual(job["result"], {"final_answer": "ok"})
+        self.assertIsNone(job["error"])
+
+    def test_heartbeat_keeps_the_lease_during_a_long_stage(self):
+        queue = JobQueue(self.path, lease_seconds=0.3)
+        job_id = queue.submit(PDF)["id"]
+        started, release = threading.Event(), threading.Event()
+
+        def pipeline(data, on_stage):
+            on_stage("summarizing")
+            started.set()
+            release.wait(5)
+            return {"final_answer": "ok"}
+
+        pool = WorkerPool(queue, workers=1, pipeline=pipeline, poll_interval=0.05).start()
+        try:
+            self.assertTrue(started.wait(5))
+            # Well past the lease: another worker must not be able to take the job
+            time.sleep(1)
+            self.assertIsNone(queue.claim("other"))
+            self.assertEqual(queue.get(job_id)["status"], RUNNING)
+            release.set()
+            deadline = time.monotonic() + 5
+            while queue.get(job_id)["status"] == RUNNING and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            release.set()
+            pool.stop()
+        self.assertEqual(queue.get(job_id)["status"], DONE)
+
+    def test_failed_pipeline_marks_the_job_failed(self):
+        queue = JobQueue(self.path)
+        job_id = queue.submit(PDF)["id"]
+        pool = WorkerPool(queue, workers=1, pipeline=lambda data, on_stage: 1 / 0)
+        pool.run_job(*queue.claim("worker"), "worker")
+        job = queue.get(job_id)
+        self.assertEqual(job["status"], FAILED)
+        self.assertIn("ZeroDivisionError", job["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Tests for the local memory-mapped vector index.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python -m unittest discover -s tests
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from local_index import CHUNKS_FILE, CURRENT_FILE, LocalVectorIndex
+
+
+class OneHotEmbeddings:
+    """Embeds the texts "a", "b", "c", ... as unit vectors along their own axis."""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        vector = np.zeros(8, dtype=np.float32)
+        vector[ord(text[0]) - ord("a")] = 1.0
+        return vector.tolist()
+
+
+class LocalVectorIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / "pathways"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_saves_reload_with_matching_rows(self):
+        index = LocalVectorIndex(self.path, OneHotEmbeddings())
+        index.add_texts(["a", "b", "c"], ids=["1", "2", "3"])
+        index.delete(["2"])
+        index.add_texts(["d"], ids=["4"])
+
+        reopened = LocalVectorIndex.load(self.path, OneHotEmbeddings())
+        self.assertEqual(reopened.get_ids(), ["1", "3", "4"])
+        self.assertEqual([doc.page_content for doc in reopened.similarity_search("c", k=1)], ["c"])
+        # Only the current version and the one before it are kept
+        versions = [entry for entry in self.path.iterdir() if entry.is_dir()]
+        self.assertLessEqual(len(versions), 2)
+        self.assertIn(self.path / (self.path / CURRENT_FILE).read_text(), versions)
+
+    def test_rejects_mismatched_rows(self):
+        index = LocalVectorIndex(self.path, OneHotEmbeddings())
+        index.add_texts(["a", "b"], ids=["1", "2"])
+        chunks = self.path / (self.path / CURRENT_FILE).read_text() / CHUNKS_FILE
+        chunks.write_text(chunks.read_text().splitlines()[0] + "\n")
+        with self.assertRaises(ValueError):
+            LocalVectorIndex.load(self.path, OneHotEmbeddings())
+
+
+if __name__ == "__main__":
+    unittest.main()
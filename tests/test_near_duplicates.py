@@ -0,0 +1,50 @@
+"""
+Tests for the MinHash/LSH near-duplicate referral index.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python -m unittest discover -s tests
+"""
+import tempfile
+import unittest
+
+from near_duplicates import NearDuplicateIndex, same_patient
+
+FORM = "\n".join([
+    "Suspected colorectal cancer referral",
+    "Surname: Smith",
+    "DoB: 01/02/1960",
+    "NHS number: 943 476 5919",
+] + [f"Question {i}: the patient reports symptom number {i} for several weeks" for i in range(40)])
+
+
+class NearDuplicateIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = NearDuplicateIndex(self.directory.name, threshold=0.8)
+        self.key = self.index.add(FORM, {"text": FORM, "summary": {}, "version": "1"})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_finds_a_resubmission_above_the_threshold(self):
+        resubmission = FORM.replace("Question 39: the patient reports", "Question 39: the patient now reports")
+        matches = self.index.query(resubmission)
+        self.assertEqual([key for key, _ in matches], [self.key])
+        self.assertGreaterEqual(matches[0][1], 0.8)
+        self.assertEqual(self.index.query("An unrelated discharge letter about a knee replacement"), [])
+
+    def test_same_layout_for_another_patient_is_not_the_same_patient(self):
+        other = FORM.replace("Smith", "Jones").replace("943 476 5919", "943 476 5920")
+        self.assertTrue(self.index.query(other))
+        self.assertFalse(same_patient(FORM, other))
+        self.assertTrue(same_patient(FORM, FORM.replace("NHS number: 943 476 5919", "")))
+
+    def test_reloads_signatures_and_records(self):
+        reloaded = NearDuplicateIndex(self.directory.name, threshold=0.8)
+        self.assertEqual(len(reloaded), 1)
+        self.assertEqual([key for key, _ in reloaded.query(FORM)], [self.key])
+        self.assertEqual(reloaded.get_record(self.key)["version"], "1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+"""
+Tests for the GuidelineQuery answer cache.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python -m unittest discover -s tests
+"""
+import unittest
+
+from query_cache import GuidelineQueryCache, branch_terms
+
+
+class SameVectorEmbeddings:
+    """Embeds every query identically, so any two queries are semantic neighbours."""
+
+    def embed_query(self, text):
+        return [1.0, 0.0, 0.0]
+
+
+class GuidelineQueryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = GuidelineQueryCache("test-query-cache", SameVectorEmbeddings(), semantic_threshold=0.9)
+
+    def test_config_is_part_of_the_key(self):
+        self.cache.set("FIT positive pathway?", "vector answer", config="vector:a")
+        self.assertEqual(self.cache.get("fit positive pathway", config="vector:a"), "vector answer")
+        self.assertIsNone(self.cache.get("FIT positive pathway?", config="hybrid:a"))
+        self.assertIsNone(self.cache.get("FIT positive pathway?", config="vector:b"))
+
+    def test_semantic_hit_requires_the_same_branch_terms(self):
+        self.cache.set("Pathway for FIT >= 10 with rectal bleeding", "FIT positive answer")
+        self.assertEqual(self.cache.get("Which pathway for FIT ≥ 10 and rectal bleeding"), "FIT positive answer")
+        self.assertIsNone(self.cache.get("Pathway for FIT < 10 with rectal bleeding"))
+        self.assertIsNone(self.cache.get("Pathway for FIT >= 100 with rectal bleeding"))
+        self.assertEqual(self.cache.semantic_hits, 1)
+
+    def test_branch_terms(self):
+        self.assertEqual(branch_terms("FIT <= 10 negative, age 45"), {"≤10", "negative", "45"})
+        self.assertEqual(branch_terms("FIT positive"), {"positive"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Tests for the rate-limited model wrappers.
+
+Usage (from the repository root):
+    PYTHONPATH=src/referral_agent python -m unittest discover -s tests
+"""
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from metrics import metrics
+from rate_limit import RateLimitedChatModel, RateLimiter, SingleFlight
+from tracing import LLMMetricsHandler
+
+
+class SlowChatModel(BaseChatModel):
+    """Answers after a delay, reporting 100 input and 10 output tokens per call."""
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "slow-test"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        time.sleep(0.2)
+        message = AIMessage(content="ok", usage_metadata={"input_tokens": 100, "output_tokens": 10, "total_tokens": 110})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class SharedCallMetricsTest(unittest.TestCase):
+    def check_shared_calls(self, stage, call):
+        inner = SlowChatModel()
+        llm = RateLimitedChatModel(inner=inner, limiter=RateLimiter(stage), single_flight=SingleFlight())
+        llm.callbacks = [LLMMetricsHandler(stage, "slow-test")]
+        barrier = threading.Barrier(3)
+
+        def run(_):
+            barrier.wait()
+            return call(llm)
+
+        with ThreadPoolExecutor(3) as executor:
+            self.assertEqual(list(executor.map(run, range(3))), ["ok"] * 3)
+        self.assertEqual(inner.calls, 1)
+        self.assertEqual(metrics.counter("referral_llm_calls_total", stage=stage, model="slow-test"), 3)
+        self.assertEqual(metrics.counter("referral_llm_shared_calls_total", stage=stage, model="slow-test"), 2)
+        self.assertEqual(
+            metrics.counter("referral_llm_tokens_total", stage=stage, model="slow-test", kind="input"), 100
+        )
+        self.assertEqual(
+            metrics.counter("referral_llm_tokens_total", stage=stage, model="slow-test", kind="output"), 10
+        )
+
+    def test_invoke_counts_tokens_once(self):
+        self.check_shared_calls("test-invoke", lambda llm: llm.invoke("same prompt").content)
+
+    def test_stream_counts_tokens_once(self):
+        self.check_shared_calls("test-stream", lambda llm: "".join(chunk.content for chunk in llm.stream("same prompt")))
+
+
+if __name__ == "__main__":
+    unittest.main()